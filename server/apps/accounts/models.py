@@ -7,7 +7,12 @@ class User(AbstractUser):
     phone_number = models.CharField(max_length=15, blank=True, null=True)
     google_id = models.CharField(max_length=100, blank=True, null=True, unique=True)
     profile_picture = models.URLField(blank=True, null=True)
-    
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['date_joined', 'id'], name='user_date_joined_id_idx'),
+        ]
+
     def __str__(self):
         return self.username
 
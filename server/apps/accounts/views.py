@@ -10,6 +10,7 @@ from django.utils.decorators import method_decorator
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.encoding import force_bytes, force_str
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
+from castle_core.pagination import KeysetPagination
 
 User = get_user_model()
 import logging
@@ -165,6 +166,8 @@ class AdminUserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAdminUser]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-date_joined', '-id')
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
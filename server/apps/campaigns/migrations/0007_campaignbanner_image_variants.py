@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0006_campaignbanner_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaignbanner',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
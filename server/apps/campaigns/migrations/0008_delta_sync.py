@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:54
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce, Now
+
+
+def fill_missing_updated_at(apps, schema_editor):
+    # Rows from before updated_at existed would never show up in delta sync
+    Campaign = apps.get_model('campaigns', 'Campaign')
+    Campaign.objects.filter(updated_at__isnull=True).update(updated_at=Coalesce('created_at', Now()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0007_campaignbanner_image_variants'),
+        ('products', '0017_product_image_main_variants_productimage_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_missing_updated_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='campaign',
+            index=models.Index(fields=['updated_at', 'id'], name='campaign_updated_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='campaignbanner',
+            index=models.Index(fields=['updated_at', 'id'], name='banner_updated_id_idx'),
+        ),
+    ]
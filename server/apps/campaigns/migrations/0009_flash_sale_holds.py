@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-18 08:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0008_delta_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='hold_seconds',
+            field=models.PositiveIntegerField(default=300, help_text='How long a flash-sale hold keeps its stock'),
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='is_flash_sale',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='max_hold_quantity',
+            field=models.PositiveSmallIntegerField(default=2, help_text='Most units one buyer can hold per product'),
+        ),
+    ]
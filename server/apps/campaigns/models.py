@@ -39,9 +39,20 @@ class Campaign(models.Model):
     # Discount
     discount_percentage = models.DecimalField(max_digits=5, decimal_places=2, default=0.00, help_text="Percentage off (0-100)")
 
+    # Flash sale mode: buyers first take a timed stock hold (apps.orders.holds), then check out
+    is_flash_sale = models.BooleanField(default=False)
+    hold_seconds = models.PositiveIntegerField(default=300, help_text="How long a flash-sale hold keeps its stock")
+    max_hold_quantity = models.PositiveSmallIntegerField(default=2, help_text="Most units one buyer can hold per product")
+
     created_at = models.DateTimeField(auto_now_add=True, null=True)
     updated_at = models.DateTimeField(auto_now=True, null=True)
 
+    class Meta:
+        # Delta sync (apps.products.changes)
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='campaign_updated_id_idx'),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -73,11 +84,20 @@ class CampaignBanner(models.Model):
     heading = models.CharField(max_length=255, blank=True)
     subheading = models.TextField(blank=True)
     image = models.ImageField(upload_to='campaigns/banners/', blank=True, null=True)
+    # Resized copies of image (castle_core.image_variants)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     link = models.CharField(max_length=500, blank=True, help_text="URL to redirect to")
     button_text = models.CharField(max_length=50, blank=True, default="Shop Now")
     
     # Display Logic
     display_pages = models.JSONField(default=list, help_text="List of pages to show this banner e.g. ['/', '/shop']")
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='banner_updated_id_idx'),
+        ]
     
     def __str__(self):
         return f"{self.campaign.title} - {self.get_type_display()}"
@@ -1,14 +1,21 @@
 from rest_framework import serializers
 from .models import Campaign, CampaignBanner
-from apps.products.serializers import ProductSerializer
+from apps.products.serializers import ProductListSerializer
+from apps.products.projection import DynamicFieldsMixin
+from castle_core.image_variants import srcsets
 
 class CampaignBannerSerializer(serializers.ModelSerializer):
+    image_srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = CampaignBanner
-        fields = '__all__'
+        exclude = ['image_variants']
 
-class CampaignSerializer(serializers.ModelSerializer):
-    products = ProductSerializer(many=True, read_only=True)
+    def get_image_srcset(self, obj):
+        return srcsets(obj.image_variants, obj.image)
+
+class CampaignSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    products = ProductListSerializer(many=True, read_only=True)
     banners = CampaignBannerSerializer(many=True, read_only=True)
     product_ids = serializers.ListField(
         child=serializers.UUIDField(),
@@ -33,3 +40,14 @@ class CampaignSerializer(serializers.ModelSerializer):
         if product_ids is not None:
             instance.products.set(product_ids)
         return instance
+
+class CampaignListSerializer(CampaignSerializer):
+    """Campaign list rows without the product cards; ?expand=products adds them."""
+    products = None
+    expandable_fields = {
+        'products': lambda: ProductListSerializer(many=True, read_only=True),
+    }
+
+    class Meta:
+        model = Campaign
+        exclude = ['products']
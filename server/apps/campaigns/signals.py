@@ -0,0 +1,71 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from apps.campaigns.models import Campaign, CampaignBanner
+from apps.products.pricing import recompute_effective_prices
+from castle_core.response_cache import invalidate, forget_campaign_boundary
+from castle_core.image_variants import pending_manifest, queue_variants, source_of, variants_updated
+
+@receiver(post_save, sender=Campaign)
+@receiver(post_delete, sender=Campaign)
+def reprice_campaign_products(sender, instance, **kwargs):
+    # Targeting, discount or window may have changed; only changed rows are written
+    recompute_effective_prices()
+
+@receiver(m2m_changed, sender=Campaign.products.through)
+def reprice_campaign_members(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    from django.utils import timezone
+
+    if reverse:
+        # product.campaigns.add(...) - only this product is affected
+        recompute_effective_prices([instance.pk])
+        if pk_set:
+            # Membership is part of the campaign in delta sync
+            Campaign.objects.filter(pk__in=pk_set).update(updated_at=timezone.now())
+        invalidate('campaigns')
+        return
+
+    Campaign.objects.filter(pk=instance.pk).update(updated_at=timezone.now())
+
+    if pk_set:
+        recompute_effective_prices(pk_set)
+    else:
+        # post_clear does not say which products were removed
+        recompute_effective_prices()
+    invalidate('campaigns', f'campaign:{instance.pk}')
+
+@receiver(post_save, sender=Campaign)
+@receiver(post_delete, sender=Campaign)
+def invalidate_campaign_responses(sender, instance, **kwargs):
+    forget_campaign_boundary()
+    invalidate('campaigns', f'campaign:{instance.pk}')
+
+@receiver(post_save, sender=CampaignBanner)
+@receiver(post_delete, sender=CampaignBanner)
+def invalidate_banner_responses(sender, instance, **kwargs):
+    # Banners are nested in campaign responses too
+    invalidate('banners', f'banner:{instance.pk}', f'campaign:{instance.campaign_id}')
+
+@receiver(post_save, sender=CampaignBanner)
+def build_banner_image_variants(sender, instance, **kwargs):
+    source = source_of(instance, 'image')
+    if source and instance.image_variants.get('source') != source:
+        queue_variants('banner', [(instance.pk, source)])
+        # A later save of this instance must not write the old manifest back over the queued one
+        instance.image_variants = pending_manifest(source)
+
+@receiver(variants_updated, sender=CampaignBanner)
+def touch_banners_with_new_variants(sender, pks, **kwargs):
+    from django.utils import timezone
+    CampaignBanner.objects.filter(pk__in=pks).update(updated_at=timezone.now())
+    campaign_ids = set(CampaignBanner.objects.filter(pk__in=pks).values_list('campaign_id', flat=True))
+    invalidate('banners', *(f'banner:{pk}' for pk in pks), *(f'campaign:{pk}' for pk in campaign_ids))
+
+@receiver(post_delete, sender=Campaign)
+@receiver(post_delete, sender=CampaignBanner)
+def record_campaign_tombstone(sender, instance, **kwargs):
+    from apps.products.changes import record_tombstones
+    kind = 'banner' if sender is CampaignBanner else 'campaign'
+    record_tombstones(kind, [instance.pk])
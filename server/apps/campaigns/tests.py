@@ -1,3 +1,114 @@
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from datetime import timedelta
+from decimal import Decimal
+from apps.products.models import Product, Category
+from .models import Campaign
 
-# Create your tests here.
+class CampaignRepresentationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        category = Category.objects.create(name='Kitchen', slug='kitchen')
+        self.product = Product.objects.create(name='Pot', slug='pot', category=category, price=Decimal('100.00'))
+        now = timezone.now()
+        self.campaign = Campaign.objects.create(
+            title='Flash', slug='flash',
+            start_time=now - timedelta(hours=1), end_time=now + timedelta(hours=1),
+            discount_percentage=Decimal('10'),
+        )
+        self.campaign.products.add(self.product)
+
+    def test_list_omits_products_unless_expanded(self):
+        response = self.client.get('/api/campaigns/')
+        self.assertNotIn('products', response.data['results'][0])
+
+        response = self.client.get('/api/campaigns/', {'expand': 'products'})
+        self.assertEqual(response.data['results'][0]['products'][0]['id'], str(self.product.id))
+
+    def test_active_includes_compact_product_cards(self):
+        response = self.client.get('/api/campaigns/active/')
+        card = response.data[0]['products'][0]
+        self.assertEqual(card['discount_price'], '90.00')
+        self.assertNotIn('reviews', card)
+
+    def test_active_cache_is_dropped_by_banner_and_product_saves(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.assertEqual(self.client.get('/api/campaigns/active/')['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get('/api/campaigns/active/')['X-Cache'], 'HIT')
+
+        self.campaign.banners.create(type='top_bar', heading='Now on')
+        response = self.client.get('/api/campaigns/active/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data[0]['banners'][0]['heading'], 'Now on')
+
+        self.product.name = 'Big pot'
+        self.product.save()
+        response = self.client.get('/api/campaigns/active/')
+        self.assertEqual(response.data[0]['products'][0]['name'], 'Big pot')
+
+
+class MediaServingTests(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        overrides = override_settings(MEDIA_ROOT=media.name, MEDIA_SENDFILE=None)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import default_storage
+        self.name = default_storage.save('campaigns/banners/hero.jpg', ContentFile(bytes(range(256)) * 4))
+        self.url = default_storage.url(self.name)
+
+    def get(self, url, **headers):
+        response = self.client.get(url, **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_hashed_url_is_immutable(self):
+        self.assertIn('?v=', self.url)
+        response, body = self.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(body), 1024)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+
+        response, _ = self.get(self.url.split('?')[0])
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+    def test_conditional_request_gets_304(self):
+        response, _ = self.get(self.url)
+        response, body = self.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(body, b'')
+
+    def test_range_requests(self):
+        response, body = self.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(body, bytes(range(10, 20)))
+
+        response, body = self.get(self.url, HTTP_RANGE='bytes=-4')
+        self.assertEqual(body, bytes(range(252, 256)))
+
+        response, _ = self.get(self.url, HTTP_RANGE='bytes=2000-')
+        self.assertEqual(response.status_code, 416)
+
+        # A stale If-Range gets the whole (changed) file
+        response, body = self.get(self.url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"old"')
+        self.assertEqual((response.status_code, len(body)), (200, 1024))
+
+    def test_nginx_offload(self):
+        from django.test import override_settings
+        with override_settings(MEDIA_SENDFILE='nginx'):
+            response, body = self.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.name)
+        self.assertEqual(body, b'')
+
+    def test_path_traversal_is_rejected(self):
+        response, _ = self.get('/media/%2E%2E/manage.py')
+        self.assertEqual(response.status_code, 404)
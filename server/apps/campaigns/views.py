@@ -1,11 +1,52 @@
+from functools import partial
 from rest_framework import viewsets, permissions, decorators, response
 from django.utils import timezone
 from .models import Campaign, CampaignBanner
-from .serializers import CampaignSerializer, CampaignBannerSerializer
+from .serializers import CampaignSerializer, CampaignListSerializer, CampaignBannerSerializer
+from apps.products.projection import ProjectionViewMixin
+from apps.products.pricing import refresh_prices_for_request
+from castle_core.response_cache import CachedResponseMixin, collect_ids, iter_rows
+from castle_core.conditional import ConditionalGetMixin
 
-class CampaignViewSet(viewsets.ModelViewSet):
+class CampaignViewSet(CachedResponseMixin, ConditionalGetMixin, ProjectionViewMixin, viewsets.ModelViewSet):
     queryset = Campaign.objects.all().order_by('-start_time')
     serializer_class = CampaignSerializer
+    prefetch_related_for = {'banners': ['banners'], 'products': ['products']}
+    cache_collection_tag = 'campaigns'
+    cache_entity_prefix = 'campaign'
+    cached_actions = ('list', 'retrieve', 'active')
+    conditional_actions = ('list', 'retrieve', 'active')
+    validator_relations = ('banners', 'products')
+
+    def get_queryset(self):
+        # Nested product cards read the stored prices; bring them up to date first
+        refresh_prices_for_request(self.request)
+        default = ('banners',) if self.action == 'list' else ('banners', 'products')
+        return self.with_relations(super().get_queryset(), self.get_serialized_relations(default))
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return CampaignListSerializer
+        return CampaignSerializer
+
+    def get_active_queryset(self):
+        now = timezone.now()
+        return self.get_queryset().filter(
+            is_active=True,
+            start_time__lte=now,
+            end_time__gte=now
+        )
+
+    def get_validator_queryset(self):
+        if self.action == 'active':
+            return self.get_active_queryset().order_by()
+        return super().get_validator_queryset()
+
+    def get_cache_tags(self, data):
+        tags = super().get_cache_tags(data)
+        for row in iter_rows(data):
+            tags.update(f'product:{pk}' for pk in collect_ids(row.get('products') or []))
+        return tags
     
     def get_permissions(self):
         if self.action in ['list', 'retrieve', 'active']:
@@ -14,18 +55,17 @@ class CampaignViewSet(viewsets.ModelViewSet):
 
     @decorators.action(detail=False, methods=['get'])
     def active(self, request):
-        now = timezone.now()
-        active_campaigns = Campaign.objects.filter(
-            is_active=True,
-            start_time__lte=now,
-            end_time__gte=now
-        )
-        serializer = self.get_serializer(active_campaigns, many=True)
+        return self.cached_response(partial(self.conditional_response, self._active), request)
+
+    def _active(self, request):
+        serializer = self.get_serializer(self.get_active_queryset(), many=True)
         return response.Response(serializer.data)
 
-class CampaignBannerViewSet(viewsets.ModelViewSet):
+class CampaignBannerViewSet(CachedResponseMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = CampaignBanner.objects.all()
     serializer_class = CampaignBannerSerializer
+    cache_collection_tag = 'banners'
+    cache_entity_prefix = 'banner'
     
     def get_permissions(self):
         if self.action in ['list', 'retrieve']:
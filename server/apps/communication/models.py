@@ -38,6 +38,9 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='notification_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.type} - {self.user.username}"
@@ -1,13 +1,15 @@
 from rest_framework import viewsets, permissions
 from .models import Notification
 from .serializers import NotificationSerializer
+from castle_core.pagination import KeysetPagination
 
 class NotificationViewSet(viewsets.ModelViewSet):
     serializer_class = NotificationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        return Notification.objects.filter(user=self.request.user).order_by('-created_at')
+        return Notification.objects.filter(user=self.request.user).order_by('-created_at', '-id')
 
     def perform_create(self, serializer):
         # Users shouldn't create notifications, but if they do, it's for themselves?
@@ -1,13 +1,23 @@
 from django.contrib import admin
-from .models import Order, OrderItem
+from .models import Order, OrderItem, OrderStatusEvent
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     raw_id_fields = ('product',)
 
+class OrderStatusEventInline(admin.TabularInline):
+    model = OrderStatusEvent
+    fields = ('from_status', 'status', 'created_at')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'status', 'total_amount', 'is_paid', 'created_at')
     list_filter = ('status', 'is_paid', 'payment_method')
     search_fields = ('id', 'user__username', 'paystack_ref')
-    inlines = [OrderItemInline]
+    inlines = [OrderItemInline, OrderStatusEventInline]
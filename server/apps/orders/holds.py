@@ -0,0 +1,225 @@
+"""
+Flash-sale stock holds.
+
+While a product is in a running flash-sale campaign (Campaign.is_flash_sale),
+buyers take a hold before they check out:
+
+    POST /api/orders/holds/ {"product_id": ..., "quantity": 1}
+
+Issuing a hold takes the stock out of inventory at once. It uses the same
+guarded UPDATE or stock shards as checkout and is recorded as a 'hold'
+movement. The hold also fixes the flash price for Campaign.hold_seconds.
+Checkout names the hold on its line (`hold_id`) and converts it. That line
+costs one UPDATE of the hold row and never touches the product row. Lines
+for flash-sale products without a hold are refused, so nobody skips the
+queue.
+
+Admission: at most FLASH_SALE_ADMISSION_SLOTS hold requests per product are
+reserving stock at any moment. Anyone beyond that is turned away at once
+with 429 and Retry-After, so a rush of buyers waits in their browsers
+rather than on database locks. Each slot is its own cache key, taken with
+add() and expiring on its own, so a slot leaked by a crashed worker never
+outlives ADMISSION_TTL and cannot skew the others. The slots live in the
+cache: Redis in production, shared by every worker; per process with
+LocMemCache.
+
+Holds that expire are returned to stock by `release_expired_holds` (the
+sweep_stock_holds command, run continuously with --interval).
+"""
+import random
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+ACTIVE = 'active'
+CONVERTED = 'converted'
+RELEASED = 'released'
+# Safety net: a slot leaked by a crashed worker frees itself after this long
+ADMISSION_TTL = 30
+SWEEP_BATCH = 1000
+
+
+class HoldError(Exception):
+    status_code = 400
+
+
+class SoldOut(HoldError):
+    status_code = 409
+
+
+class Busy(HoldError):
+    status_code = 429
+    retry_after = 1
+
+
+def admission_slots():
+    return getattr(settings, 'FLASH_SALE_ADMISSION_SLOTS', 32)
+
+
+@contextmanager
+def admission(product_id):
+    """Holds one of the product's admission slots for the block, or raises Busy."""
+    keys = [f'flash:admission:{product_id}:{slot}' for slot in range(admission_slots())]
+    taken = cache.get_many(keys)
+    free = [key for key in keys if key not in taken]
+    # Spread concurrent requests over the free slots so they rarely race for the same one
+    random.shuffle(free)
+    token = uuid.uuid4().hex
+    for key in free:
+        if cache.add(key, token, timeout=ADMISSION_TTL):
+            break
+    else:
+        raise Busy('Too many buyers right now, please retry in a moment.')
+    try:
+        yield
+    finally:
+        # Unless it expired and another request has it by now
+        if cache.get(key) == token:
+            cache.delete(key)
+
+
+def running_flash_sales(now):
+    from apps.campaigns.models import Campaign
+
+    return Campaign.objects.filter(is_active=True, is_flash_sale=True, start_time__lte=now, end_time__gt=now)
+
+
+def flash_sale_for(product, now):
+    """The running flash-sale campaign covering `product` (the deepest one), or None."""
+    return running_flash_sales(now).filter(
+        Q(product_selection_type='all')
+        | Q(product_selection_type='category', target_category_id=product.category_id)
+        | Q(product_selection_type='manual', products=product)
+    ).order_by('-discount_percentage').first()
+
+
+def flash_sale_product_ids(products, now):
+    """Ids of `products` in a running flash sale; one query when there is none."""
+    from apps.campaigns.models import Campaign
+
+    campaigns = list(running_flash_sales(now).only('id', 'product_selection_type', 'target_category_id'))
+    if not campaigns:
+        return set()
+    if any(campaign.product_selection_type == 'all' for campaign in campaigns):
+        return {product.pk for product in products}
+    categories = {campaign.target_category_id for campaign in campaigns if campaign.product_selection_type == 'category'}
+    flash = {product.pk for product in products if product.category_id in categories}
+    manual = [campaign.pk for campaign in campaigns if campaign.product_selection_type == 'manual']
+    if manual:
+        flash.update(Campaign.products.through.objects.filter(
+            campaign_id__in=manual, product_id__in=[product.pk for product in products],
+        ).values_list('product_id', flat=True))
+    return flash
+
+
+def create_hold(user, product_id, quantity, now=None):
+    """
+    Issues (or returns the buyer's live) hold on a flash-sale product.
+    Returns (hold, created). Raises HoldError, SoldOut or Busy.
+    """
+    from apps.products.inventory import HOLD
+    from apps.products.models import Product
+    from .models import StockHold
+    from .stock import InsufficientStock, reserve_stock
+
+    now = now or timezone.now()
+    product = Product.objects.filter(pk=product_id, is_active=True).first()
+    if product is None:
+        raise HoldError('Product not found.')
+    campaign = flash_sale_for(product, now)
+    if campaign is None:
+        raise HoldError(f'{product.name} is not in a running flash sale.')
+    if not 1 <= quantity <= campaign.max_hold_quantity:
+        raise HoldError(f'You can hold between 1 and {campaign.max_hold_quantity} of {product.name}.')
+
+    existing = StockHold.objects.filter(user=user, product=product, status=ACTIVE).first()
+    if existing is not None:
+        if existing.expires_at > now:
+            return existing, False
+        release_holds(StockHold.objects.filter(pk=existing.pk))
+
+    hold = StockHold(
+        user=user, product=product, campaign=campaign, quantity=quantity,
+        expires_at=min(now + timedelta(seconds=campaign.hold_seconds), campaign.end_time),
+    )
+    with admission(product.pk):
+        try:
+            with transaction.atomic():
+                try:
+                    reserved = reserve_stock([(product.pk, quantity)], kind=HOLD, note=f'hold {hold.pk}')
+                except InsufficientStock:
+                    raise SoldOut(f'{product.name} is sold out.')
+                hold.price = reserved[product.pk].effective_price
+                hold.save(force_insert=True)
+        except IntegrityError:
+            # The same buyer's concurrent request got there first
+            return StockHold.objects.get(user=user, product=product, status=ACTIVE), False
+    return hold, True
+
+
+def lock_holds(user, hold_ids, now=None):
+    """
+    Checkout: the buyer's live holds `hold_ids`, locked, as {id: hold} with
+    their products. Raises HoldError if any has expired or been used.
+    """
+    from .models import StockHold
+
+    now = now or timezone.now()
+    holds = {
+        hold.pk: hold for hold in StockHold.objects.select_for_update(of=('self',)).select_related('product')
+        .filter(pk__in=hold_ids, user=user, status=ACTIVE, expires_at__gt=now).order_by('pk')
+    }
+    if len(holds) < len(set(hold_ids)):
+        raise HoldError('Your flash-sale hold has expired or was already used. Please reserve the item again.')
+    return holds
+
+
+def convert_holds(holds, order, quantities):
+    """Marks locked holds as checked out by `order`; units held but not bought go back to stock."""
+    from apps.products.inventory import RELEASE, add_stock
+    from .models import StockHold
+
+    StockHold.objects.filter(pk__in=holds).update(status=CONVERTED, order=order)
+    unused = Counter()
+    for hold_id, hold in holds.items():
+        unused[hold.product_id] += hold.quantity - quantities[hold_id]
+    add_stock(+unused, RELEASE, order_id=order.pk, note='unused hold')
+
+
+def release_holds(queryset, note='expired hold'):
+    """Returns the stock of the active holds in `queryset`. Returns how many were released."""
+    from apps.products.inventory import RELEASE, add_stock
+
+    with transaction.atomic():
+        holds = list(queryset.select_for_update(skip_locked=True).filter(status=ACTIVE))
+        if not holds:
+            return 0
+        queryset.model.objects.filter(pk__in=[hold.pk for hold in holds]).update(status=RELEASED)
+        quantities = Counter()
+        for hold in holds:
+            quantities[hold.product_id] += hold.quantity
+        add_stock(quantities, RELEASE, note=note)
+    return len(holds)
+
+
+def release_expired_holds(now=None):
+    """Sweeps expired holds back into stock, in batches. Returns how many were released."""
+    from .models import StockHold
+
+    now = now or timezone.now()
+    released = 0
+    while True:
+        batch = StockHold.objects.filter(
+            pk__in=StockHold.objects.filter(status=ACTIVE, expires_at__lte=now).order_by('expires_at')
+            .values('pk')[:SWEEP_BATCH]
+        )
+        count = release_holds(batch)
+        released += count
+        if count < SWEEP_BATCH:
+            return released
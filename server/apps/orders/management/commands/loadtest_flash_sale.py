@@ -0,0 +1,116 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+from django.utils import timezone
+
+class Command(BaseCommand):
+    help = 'Runs a flash sale against the database: concurrent buyers hold and check out one product'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=200)
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--stock', type=int, default=50)
+        parser.add_argument('--shards', type=int, default=0, help='Spread the product\'s stock over this many shards')
+        parser.add_argument('--retries', type=int, default=20, help='Attempts per buyer turned away with 429')
+        parser.add_argument('--force', action='store_true', help='Run even with DEBUG off')
+
+    def handle(self, *args, **options):
+        from apps.campaigns.models import Campaign
+        from apps.orders.models import Order, StockHold
+        from apps.products.inventory import on_hand, reconcile, set_shards
+        from apps.products.models import Category, Product
+
+        if not settings.DEBUG and not options['force']:
+            raise CommandError('This writes test orders: run it against a development database, or pass --force.')
+
+        run = uuid.uuid4().hex[:8]
+        now = timezone.now()
+        category = Category.objects.create(name=f'Load test {run}', slug=f'loadtest-{run}')
+        product = Product.objects.create(
+            category=category, name=f'Load test {run}', slug=f'loadtest-{run}', price=1000,
+            stock_quantity=options['stock'], image_main='',
+        )
+        if options['shards']:
+            set_shards(product, options['shards'])
+        campaign = Campaign.objects.create(
+            title=f'Load test {run}', slug=f'loadtest-{run}', start_time=now - timedelta(minutes=1),
+            end_time=now + timedelta(hours=1), is_flash_sale=True, discount_percentage=50, max_hold_quantity=1,
+        )
+        campaign.products.add(product)
+        User = get_user_model()
+        users = [User.objects.create_user(username=f'loadtest-{run}-{i}', password=None) for i in range(options['buyers'])]
+
+        try:
+            started = time.monotonic()
+            with ThreadPoolExecutor(options['threads']) as pool:
+                results = list(pool.map(lambda user: self.buy(user, product.pk, options['retries']), users))
+            elapsed = time.monotonic() - started
+
+            latencies = sorted(latency for outcome, latency in results if outcome == 'bought')
+            counts = {outcome: sum(1 for result in results if result[0] == outcome) for outcome in ('bought', 'sold_out', 'busy', 'failed')}
+            self.stdout.write(
+                f"{options['buyers']} buyers in {elapsed:.2f}s: {counts['bought']} bought, {counts['sold_out']} sold out, "
+                f"{counts['busy']} gave up on 429, {counts['failed']} failed"
+            )
+            if latencies:
+                self.stdout.write(
+                    f'hold + checkout: p50 {self.percentile(latencies, 50):.0f}ms, p99 {self.percentile(latencies, 99):.0f}ms'
+                )
+
+            left = on_hand([product.pk])[product.pk]
+            sold = counts['bought']
+            # Buyers who got a hold but did not check out keep those units until the holds expire
+            held = StockHold.objects.filter(product=product, status='active').aggregate(total=Sum('quantity'))['total'] or 0
+            summary = f"{sold} sold, {held} held, {left} left of {options['stock']}"
+            if left < 0 or sold > options['stock']:
+                self.stdout.write(self.style.ERROR(f'Oversold: {summary}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(summary))
+            mismatches = [row for row in reconcile() if row[0] == product.pk]
+            if mismatches:
+                self.stdout.write(self.style.ERROR(f'Ledger {mismatches[0][1]} does not match stock {mismatches[0][2]}'))
+        finally:
+            Order.objects.filter(user__in=users).delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+            campaign.delete()
+            product.delete()
+            category.delete()
+
+    def buy(self, user, product_id, retries):
+        from apps.orders.holds import Busy, SoldOut, create_hold
+        from apps.orders.serializers import OrderSerializer
+
+        started = time.monotonic()
+        try:
+            for _ in range(retries):
+                try:
+                    hold, _ = create_hold(user, product_id, 1)
+                    break
+                except Busy as exc:
+                    time.sleep(exc.retry_after / 10)
+            else:
+                return 'busy', None
+            serializer = OrderSerializer(data={
+                'payment_method': 'pod', 'total_amount': hold.price, 'delivery_address': 'Load test',
+                'items': [{'product_id': str(product_id), 'hold_id': str(hold.pk), 'quantity': 1}],
+            })
+            serializer.is_valid(raise_exception=True)
+            serializer.save(user=user)
+            return 'bought', (time.monotonic() - started) * 1000
+        except SoldOut:
+            return 'sold_out', None
+        except Exception as exc:
+            self.stderr.write(f'{user.username}: {exc}')
+            return 'failed', None
+        finally:
+            connection.close()
+
+    @staticmethod
+    def percentile(values, p):
+        return values[min(len(values) - 1, int(len(values) * p / 100))]
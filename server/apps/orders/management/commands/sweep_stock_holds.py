@@ -0,0 +1,18 @@
+import time
+from django.core.management.base import BaseCommand
+from apps.orders.holds import release_expired_holds
+
+class Command(BaseCommand):
+    help = 'Returns the stock of expired flash-sale holds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0, help='Keep sweeping every this many seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_expired_holds()
+            if released or not options['interval']:
+                self.stdout.write(self.style.SUCCESS(f'Released {released} expired holds'))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.8 on 2026-10-18 08:10
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def record_existing_statuses(apps, schema_editor):
+    # Existing orders start their timeline placed at creation, then their current status as of their last update
+    Order = apps.get_model('orders', 'Order')
+    OrderStatusEvent = apps.get_model('orders', 'OrderStatusEvent')
+
+    def events():
+        for pk, status, created_at, updated_at in Order.objects.values_list('pk', 'status', 'created_at', 'updated_at').iterator():
+            yield OrderStatusEvent(order_id=pk, from_status=None, status='placed', created_at=created_at)
+            if status != 'placed':
+                yield OrderStatusEvent(order_id=pk, from_status='placed', status=status, created_at=updated_at)
+
+    OrderStatusEvent.objects.bulk_create(events(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_flash_sale_holds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStatusEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(blank=True, choices=[('placed', 'Order Placed'), ('payment_confirmed', 'Payment Confirmed'), ('processing', 'Processing/Packing'), ('shipped', 'Out for Delivery'), ('delivered', 'Delivered'), ('cancelled', 'Cancelled')], max_length=20, null=True)),
+                ('status', models.CharField(choices=[('placed', 'Order Placed'), ('payment_confirmed', 'Payment Confirmed'), ('processing', 'Processing/Packing'), ('shipped', 'Out for Delivery'), ('delivered', 'Delivered'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_events', to='orders.order')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['order', 'created_at'], name='order_status_event_idx')],
+            },
+        ),
+        migrations.RunPython(record_existing_statuses, migrations.RunPython.noop),
+    ]
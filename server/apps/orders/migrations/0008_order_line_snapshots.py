@@ -0,0 +1,69 @@
+# Generated by Django 5.2.8 on 2026-10-18 08:12
+
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import migrations, models
+
+
+def snapshot_existing_lines(apps, schema_editor):
+    # The purchase-time product is gone; existing lines take the product as it is now, at the price they were sold at
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    fields = ['product_name', 'product_slug', 'product_sku', 'product_image', 'list_price', 'discount_percent', 'discount_source']
+    batch = []
+    for item in OrderItem.objects.select_related('product').iterator(chunk_size=500):
+        product = item.product
+        item.product_name, item.product_slug, item.product_sku = product.name, product.slug, product.sku
+        item.product_image, item.list_price = product.image_main, product.price
+        if product.price and item.price < product.price:
+            item.discount_percent = ((product.price - item.price) * 100 / product.price).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+            item.discount_source = product.discount_source or 'campaign'
+        batch.append(item)
+        if len(batch) == 500:
+            OrderItem.objects.bulk_update(batch, fields)
+            batch = []
+    OrderItem.objects.bulk_update(batch, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_order_status_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='discount_percent',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=5),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='discount_source',
+            field=models.CharField(blank=True, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='list_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_image',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_sku',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_slug',
+            field=models.SlugField(blank=True),
+        ),
+        migrations.RunPython(snapshot_existing_lines, migrations.RunPython.noop),
+    ]
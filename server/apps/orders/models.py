@@ -1,5 +1,7 @@
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 import uuid
+from decimal import Decimal, ROUND_HALF_UP
 from django.conf import settings
 from apps.products.models import Product
 
@@ -38,9 +40,45 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='order_created_id_idx'),
+            models.Index(fields=['user', 'created_at', 'id'], name='order_user_created_id_idx'),
+        ]
+
     def __str__(self):
         return f"Order {self.id} - {self.user.username}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What a save's status change is recorded against (OrderStatusEvent); None when deferred
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # The status event (and the other post_save work) commits or rolls back with the change
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+class OrderStatusEvent(models.Model):
+    """
+    An order's status history, one row per change, written by the post_save
+    receiver in signals.py. Notifications and the tracking timeline read it.
+    """
+    order = models.ForeignKey(Order, related_name='status_events', on_delete=models.CASCADE)
+    from_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES, blank=True, null=True)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['order', 'created_at'], name='order_status_event_idx'),
+        ]
+
+    def __str__(self):
+        return f"Order {self.order_id}: {self.from_status} -> {self.status}"
+
 class OrderItem(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
@@ -49,8 +87,77 @@ class OrderItem(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2) # Price at time of purchase
     selected_options = models.JSONField(default=dict, blank=True, help_text="Selected options for this item")
 
+    # The product as it was sold, so order history renders without the live product
+    product_name = models.CharField(max_length=255, blank=True)
+    product_slug = models.SlugField(blank=True)
+    product_sku = models.CharField(max_length=50, blank=True, null=True)
+    product_image = models.CharField(max_length=500, blank=True)
+    list_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    discount_percent = models.DecimalField(max_digits=5, decimal_places=2, default=0)
+    discount_source = models.CharField(max_length=10, blank=True)
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_name}"
+
+    def save(self, *args, **kwargs):
+        # Checkout fills the snapshot in bulk; lines added one at a time (admin, scripts) take it here
+        if not self.product_name:
+            for field, value in self.snapshot(self.product, self.price).items():
+                setattr(self, field, value)
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def snapshot(product, price):
+        """The snapshot fields of a line selling `product` at `price`."""
+        list_price = product.price
+        if list_price and price < list_price:
+            percent = ((list_price - price) * 100 / list_price).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+            # A flash-sale hold's price comes from its campaign even if the product's has since changed
+            source = product.discount_source or 'campaign'
+        else:
+            percent, source = Decimal('0.00'), ''
+        return {
+            'product_name': product.name, 'product_slug': product.slug, 'product_sku': product.sku,
+            'product_image': product.image_main, 'list_price': list_price,
+            'discount_percent': percent, 'discount_source': source,
+        }
+
+class StockHold(models.Model):
+    """
+    A flash-sale buyer's claim on stock, taken out of inventory when issued.
+    Checkout turns it into an order line at the held price; otherwise the
+    sweeper returns it to stock after `expires_at` (holds.py).
+    """
+    STATUS_CHOICES = (
+        ('active', 'Active'),
+        ('converted', 'Checked Out'),
+        ('released', 'Released'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='stock_holds', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name='stock_holds', on_delete=models.CASCADE)
+    campaign = models.ForeignKey('campaigns.Campaign', related_name='stock_holds', on_delete=models.SET_NULL, null=True)
+    quantity = models.PositiveIntegerField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)  # Flash price when the hold was issued
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
+    order = models.ForeignKey(Order, related_name='stock_holds', on_delete=models.SET_NULL, null=True, blank=True)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='stockhold_status_expiry_idx'),
+        ]
+        constraints = [
+            # One live hold per buyer and product
+            models.UniqueConstraint(
+                fields=['user', 'product'], condition=models.Q(status='active'), name='unique_active_stock_hold',
+            ),
+        ]
+
     def __str__(self):
-        return f"{self.quantity} x {self.product.name}"
+        return f"Hold {self.id} - {self.quantity} x {self.product_id} ({self.status})"
 
 class StoreSettings(models.Model):
     # Singleton pattern logic can be handled in view/admin, but model is standard
@@ -1,21 +1,53 @@
 from rest_framework import serializers
-from .models import Order, OrderItem, StoreSettings
-from apps.products.serializers import ProductSerializer
+from .models import Order, OrderItem, OrderStatusEvent, StockHold, StoreSettings
+from apps.products.serializers import ProductListSerializer
 
 class StoreSettingsSerializer(serializers.ModelSerializer):
     class Meta:
         model = StoreSettings
         fields = '__all__'
 
+class OrderLineProductSerializer(serializers.Serializer):
+    """An order line's product as it was sold, read from the line's snapshot fields."""
+    id = serializers.UUIDField(source='product_id')
+    name = serializers.CharField(source='product_name')
+    slug = serializers.CharField(source='product_slug')
+    sku = serializers.CharField(source='product_sku')
+    image_main = serializers.CharField(source='product_image')
+    price = serializers.DecimalField(source='list_price', max_digits=10, decimal_places=2)
+    effective_price = serializers.DecimalField(source='price', max_digits=10, decimal_places=2)
+    discount_percent = serializers.DecimalField(max_digits=5, decimal_places=2)
+    discount_source = serializers.CharField()
+
 class OrderItemSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
+    # The purchase-time snapshot: no product join, and today's name/price never rewrite history
+    product = OrderLineProductSerializer(source='*', read_only=True)
     product_id = serializers.UUIDField(write_only=True)
+    # Flash-sale lines name the buyer's stock hold (apps.orders.holds)
+    hold_id = serializers.UUIDField(write_only=True, required=False)
 
     class Meta:
         model = OrderItem
-        fields = ['id', 'product', 'product_id', 'quantity', 'price', 'selected_options']
+        fields = ['id', 'product', 'product_id', 'hold_id', 'quantity', 'price', 'selected_options']
         read_only_fields = ['price']
 
+class OrderStatusEventSerializer(serializers.ModelSerializer):
+    label = serializers.CharField(source='get_status_display', read_only=True)
+
+    class Meta:
+        model = OrderStatusEvent
+        fields = ['from_status', 'status', 'label', 'created_at']
+
+class StockHoldSerializer(serializers.ModelSerializer):
+    product = ProductListSerializer(read_only=True)
+    product_id = serializers.UUIDField(write_only=True)
+    quantity = serializers.IntegerField(min_value=1, default=1)
+
+    class Meta:
+        model = StockHold
+        fields = ['id', 'product', 'product_id', 'quantity', 'price', 'status', 'expires_at', 'created_at']
+        read_only_fields = ['price', 'status', 'expires_at', 'created_at']
+
 from apps.accounts.serializers import UserSerializer
 
 class OrderSerializer(serializers.ModelSerializer):
@@ -27,60 +59,86 @@ class OrderSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'status', 'payment_method', 'total_amount', 'delivery_address', 'delivery_latitude', 'delivery_longitude', 'shipping_cost', 'items', 'created_at', 'paystack_ref', 'is_paid']
         read_only_fields = ['user', 'created_at']
 
+    def validate_items(self, items):
+        if not items:
+            raise serializers.ValidationError("An order needs at least one item.")
+        if any(item['quantity'] < 1 for item in items):
+            raise serializers.ValidationError("Quantities must be at least 1.")
+        return items
+
     def create(self, validated_data):
         items_data = validated_data.pop('items')
         
         try:
-            # 1. Validate Stock First
-            from apps.products.models import Product
-            for item_data in items_data:
-                product = Product.objects.get(id=item_data['product_id'])
-                if product.stock_quantity < item_data['quantity']:
+            from collections import Counter
+            from functools import partial
+            from django.db import transaction
+            from django.db.models import prefetch_related_objects
+            from django.utils import timezone
+            from apps.products.pricing import refresh_stale_prices
+            from apps.products.copurchase import record_order
+            from .holds import HoldError, convert_holds, flash_sale_product_ids, lock_holds
+            from .stock import InsufficientStock, UnknownProducts, reserve_stock
+
+            refresh_stale_prices()
+            now = timezone.now()
+            held_lines = [item for item in items_data if item.get('hold_id')]
+            open_lines = [item for item in items_data if not item.get('hold_id')]
+
+            # 1-3. Lock the cart's products (or its flash-sale holds), take the stock and write the
+            # order in one transaction: a constant number of queries however many lines the cart has
+            with transaction.atomic():
+                order = Order(**validated_data)
+                try:
+                    holds = lock_holds(order.user, [item['hold_id'] for item in held_lines], now) if held_lines else {}
+                    products = reserve_stock(
+                        [(item['product_id'], item['quantity']) for item in open_lines], order_id=order.pk,
+                    ) if open_lines else {}
+                except (InsufficientStock, UnknownProducts, HoldError) as exc:
+                    raise serializers.ValidationError(str(exc))
+
+                held_quantities = Counter()
+                for item in held_lines:
+                    held_quantities[item['hold_id']] += item['quantity']
+                for hold_id, quantity in held_quantities.items():
+                    if quantity > holds[hold_id].quantity:
+                        raise serializers.ValidationError(f"Your hold covers {holds[hold_id].quantity} of {holds[hold_id].product.name}.")
+                for item in held_lines:
+                    if holds[item['hold_id']].product_id != item['product_id']:
+                        raise serializers.ValidationError("A flash-sale hold does not match its order line.")
+                flash = flash_sale_product_ids(list(products.values()), now) if products else set()
+                if flash:
                     raise serializers.ValidationError(
-                        f"Insufficient stock for {product.name}. Available: {product.stock_quantity}, Requested: {item_data['quantity']}"
+                        f"{products[next(iter(flash))].name} is in a flash sale: reserve it before checking out."
                     )
 
-            # 2. Create Order
-            order = Order.objects.create(**validated_data)
-            
-            # 3. Create Items and Reduce Stock
-            for item_data in items_data:
-                product = Product.objects.get(id=item_data['product_id'])
-                
-                # Double check (concurrency edge case, though minimal risk here)
-                if product.stock_quantity < item_data['quantity']:
-                     raise serializers.ValidationError(f"Stock changed during checkout for {product.name}.")
-                
-                OrderItem.objects.create(
-                    order=order, 
-                    product=product, 
-                    price=product.discount_price if product.discount_price else product.price, 
-                    quantity=item_data['quantity'],
-                    selected_options=item_data.get('selected_options', {})
-                )
-                
-                # Reduce Stock
-                product.stock_quantity -= item_data['quantity']
-                
-                # Deactivate if out of stock (as requested)
-                if product.stock_quantity <= 0:
-                    product.stock_quantity = 0 # Ensure no negative
-                    # product.is_active = False # User requested "redeactivate itself" (deactivate). 
-                    # Keeping it active but 0 stock is usually better for SEO, but let's follow instruction strictly if needed.
-                    # "when stock is out the product should automatically redeactivate itself" -> "deactivate"
-                    # I'll interpret "redeactivate" as "deactivate" or "change status". 
-                    # Let's just keep it active but 0 stock, as that effectively disables purchase in my new logic.
-                    # But if they insist on "redeactivate" (maybe re-activate when stock added?), 
-                    # I will just ensure stock is 0. 
-                    # Actually, let's set is_active=False to be safe if that's what they meant by "redeactivate" (maybe typo for deactivate).
-                    # But "redeactivate" sounds like "make active again". 
-                    # Maybe they meant "deactivate itself". I will assume deactivate.
-                    # However, hiding the product completely might be bad. 
-                    # I'll stick to stock_quantity = 0. The frontend will show "Out of Stock".
-                
-                product.save()
-                
-            # 4. Remove items from cart (frontend handles this, but good to know)
+                order.save(force_insert=True)
+                if holds:
+                    convert_holds(holds, order, held_quantities)
+                order_items = []
+                for item_data in items_data:
+                    if item_data.get('hold_id'):
+                        hold = holds[item_data['hold_id']]
+                        product, price = hold.product, hold.price
+                    else:
+                        product = products[item_data['product_id']]
+                        price = product.effective_price
+                    order_items.append(OrderItem(
+                        order=order,
+                        product=product,
+                        price=price,
+                        quantity=item_data['quantity'],
+                        selected_options=item_data.get('selected_options', {}),
+                        **OrderItem.snapshot(product, price),
+                    ))
+                OrderItem.objects.bulk_create(order_items)
+                # The response and the admin email both render the lines; one query loads them for both
+                prefetch_related_objects([order], 'items')
+
+                # 4. Remove items from cart (frontend handles this, but good to know)
+
+                # Count this order's product pairs for "frequently bought together" once it commits
+                transaction.on_commit(partial(record_order, order.pk))
             
             # 5. Send Email Notification
             try:
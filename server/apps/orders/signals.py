@@ -1,19 +1,31 @@
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_save
 from django.dispatch import receiver
-from apps.orders.models import Order
+from apps.orders.models import Order, OrderStatusEvent
 from apps.communication.models import Notification
 
-@receiver(pre_save, sender=Order)
-def track_order_status_change(sender, instance, **kwargs):
-    try:
-        old_instance = Order.objects.get(pk=instance.pk)
-        instance._old_status = old_instance.status
-    except Order.DoesNotExist:
-        instance._old_status = None
+@receiver(post_save, sender=Order)
+def record_status_event(sender, instance, created, update_fields=None, **kwargs):
+    # Connected first: the receivers below read the change from instance._status_event
+    instance._status_event = None
+    if update_fields is not None and 'status' not in update_fields:
+        return
+    if created:
+        old_status = None
+    elif getattr(instance, '_loaded_status', None) is not None:
+        old_status = instance._loaded_status
+    else:
+        # Not loaded with its status (built by hand or deferred): the log's last entry has it
+        old_status = instance.status_events.order_by('-created_at', '-id').values_list('status', flat=True).first()
+    if created or old_status != instance.status:
+        instance._status_event = OrderStatusEvent.objects.create(
+            order=instance, from_status=old_status, status=instance.status,
+        )
+    instance._loaded_status = instance.status
 
 @receiver(post_save, sender=Order)
 def create_order_notification(sender, instance, created, **kwargs):
     import threading
+    from django.db import transaction
     from django.core.mail import send_mail
     from django.template.loader import render_to_string
     from django.utils.html import strip_tags
@@ -49,11 +61,11 @@ def create_order_notification(sender, instance, created, **kwargs):
                 import traceback
                 logger.error(traceback.format_exc())
 
-        threading.Thread(target=send_placed_email, daemon=True).start()
+        # After commit: the thread's own connection must see the order and its items
+        transaction.on_commit(threading.Thread(target=send_placed_email, daemon=True).start)
 
     else:
-        # Check if status changed
-        if hasattr(instance, '_old_status') and instance._old_status != instance.status:
+        if instance._status_event is not None:
             # Map status to notification type and title
             status_map = {
                 'placed': ('order_placed', 'Order Placed'),
@@ -100,4 +112,23 @@ def create_order_notification(sender, instance, created, **kwargs):
                     import traceback
                     logger.error(traceback.format_exc())
 
-            threading.Thread(target=send_update_email, daemon=True).start()
+            transaction.on_commit(threading.Thread(target=send_update_email, daemon=True).start)
+
+
+@receiver(post_save, sender=Order)
+def restock_cancelled_order(sender, instance, created, **kwargs):
+    # Put the order's stock back (and record it in the ledger) when it is cancelled
+    if created or instance._status_event is None or instance.status != 'cancelled':
+        return
+    from collections import Counter
+    from apps.products.inventory import CANCEL, add_stock
+    from apps.products.models import StockMovement
+
+    # Reopening a cancelled order does not take its stock again: only the first cancel returns it
+    if StockMovement.objects.filter(order_id=instance.pk, kind=CANCEL).exists():
+        return
+
+    quantities = Counter()
+    for product_id, quantity in instance.items.values_list('product_id', 'quantity'):
+        quantities[product_id] += quantity
+    add_stock(quantities, CANCEL, order_id=instance.pk)
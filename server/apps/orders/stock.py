@@ -0,0 +1,102 @@
+"""
+Stock reservation for checkout.
+
+All of a cart's regular products are locked with one SELECT ... FOR UPDATE,
+in id order so that two checkouts sharing products always lock them in the
+same order and cannot deadlock. Stock is then checked and decremented with
+one UPDATE whose per-row CASE subtracts each line's quantity. The UPDATE is
+also guarded by `stock_quantity >= quantity`, so even without row locks
+(SQLite) it can never drive stock negative: if it matches fewer rows than
+expected, the transaction is rolled back.
+
+Hot products (stock_shards > 0) are not locked at all. Their lines are taken
+from the product's stock shards (apps.products.inventory), so a flash sale
+does not queue every buyer on one row. Every line is recorded in the
+inventory ledger as a sale.
+
+Run it inside the checkout's transaction.
+"""
+from collections import Counter
+from django.db.models import Case, F, Q, When
+from django.utils import timezone
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product, requested):
+        self.product = product
+        self.requested = requested
+        super().__init__(
+            f"Insufficient stock for {product.name}. Available: {product.stock_quantity}, Requested: {requested}"
+        )
+
+
+class UnknownProducts(Exception):
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        super().__init__(f"Products not found: {', '.join(str(pk) for pk in product_ids)}")
+
+
+def reserve_stock(lines, order_id=None, kind=None, note=''):
+    """
+    Decrements stock for [(product_id, quantity), ...] (a product may appear
+    on several lines) and records it in the ledger as `kind` (a sale unless
+    given), against `order_id`. Returns
+    {product_id: product}, with stock_quantity as it was before the
+    decrement. Raises InsufficientStock or UnknownProducts, leaving stock
+    untouched once the transaction rolls back.
+    """
+    from apps.products.inventory import SALE, record_movements, take_from_shards
+    from apps.products.models import Product
+    from castle_core.response_cache import invalidate_products
+
+    quantities = Counter()
+    for product_id, quantity in lines:
+        quantities[product_id] += quantity
+
+    # Regular products locked in one query; hot ones (if any) read without a lock
+    by_id = {
+        product.pk: product
+        for product in Product.objects.select_for_update().filter(pk__in=quantities, stock_shards=0).order_by('pk')
+    }
+    regular = [pk for pk in quantities if pk in by_id]
+    if len(by_id) < len(quantities):
+        by_id.update(Product.objects.in_bulk([pk for pk in quantities if pk not in by_id]))
+    missing = [pk for pk in quantities if pk not in by_id]
+    if missing:
+        raise UnknownProducts(missing)
+    for product_id in regular:
+        product = by_id[product_id]
+        if product.stock_quantity < quantities[product_id]:
+            raise InsufficientStock(product, quantities[product_id])
+
+    if regular:
+        guard = Q()
+        for product_id in regular:
+            guard |= Q(pk=product_id, stock_quantity__gte=quantities[product_id])
+        updated = Product.objects.filter(guard).update(
+            stock_quantity=Case(
+                *(When(pk=product_id, then=F('stock_quantity') - quantities[product_id]) for product_id in regular),
+                default=F('stock_quantity'),
+            ),
+            updated_at=timezone.now(),
+        )
+        if updated != len(regular):
+            # Another writer got in between the check and the update (only possible without row locks)
+            stock = dict(Product.objects.filter(pk__in=regular).values_list('pk', 'stock_quantity'))
+            for product_id in regular:
+                if stock[product_id] < quantities[product_id]:
+                    by_id[product_id].stock_quantity = stock[product_id]
+                    raise InsufficientStock(by_id[product_id], quantities[product_id])
+        # UPDATE sends no post_save: drop the cached product responses here
+        invalidate_products(regular)
+
+    # Hot products in id order too, so shard locks are also taken in a consistent order
+    for product_id in sorted(pk for pk in quantities if pk not in regular):
+        product = by_id[product_id]
+        available = take_from_shards(product_id, quantities[product_id], product.stock_shards)
+        if available is not None:
+            product.stock_quantity = available
+            raise InsufficientStock(product, quantities[product_id])
+
+    record_movements((product_id, kind or SALE, -quantity, order_id, note) for product_id, quantity in quantities.items())
+    return by_id
@@ -58,3 +58,355 @@ class OrderEmailNotificationTest(TestCase):
         email = admin_emails[0]
         self.assertIn("New Order", email.subject)
         self.assertIn("TEST-SKU-001", email.alternatives[0][0] if email.alternatives else email.body) # Check SKU is in body
+
+    def test_customer_email_waits_for_commit(self):
+        from unittest import mock
+        order_data = {
+            'items': [{'product_id': str(self.product.id), 'quantity': 1}],
+            'total_amount': 1000.00, 'payment_method': 'pod', 'delivery_address': 'Test Address',
+        }
+        with mock.patch('threading.Thread') as thread:
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.assertEqual(self.client.post('/api/orders/', order_data, format='json').status_code, status.HTTP_201_CREATED)
+            # Nothing started while the order's transaction was open
+            thread.return_value.start.assert_not_called()
+            for callback in callbacks:
+                callback()
+            thread.return_value.start.assert_called_once()
+
+
+class TrackOrderConditionalTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        user = User.objects.create_user(username='buyer', password='password123')
+        self.order = Order.objects.create(user=user, payment_method='pod', total_amount=10, delivery_address='Here')
+
+    def test_etag_round_trip(self):
+        url = f'/api/orders/track/{self.order.id}/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('private', response['Cache-Control'])
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        etag = response['ETag']
+        self.order.status = 'shipped'
+        self.order.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+
+class OrderQueryCountTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.client = APIClient()
+        self.admin = User.objects.create_superuser(username='admin', email='a@x.com', password='x')
+        self.user = User.objects.create_user(username='buyer', password='x')
+        self.category = Category.objects.create(name='Kitchen', slug='kitchen')
+
+    def add_orders(self, count, items=3):
+        from apps.orders.models import OrderItem
+        for _ in range(count):
+            order = Order.objects.create(user=self.user, payment_method='pod', total_amount=10, delivery_address='Here')
+            for _ in range(items):
+                product = Product.objects.create(name='Pot', slug=f'pot-{Product.objects.count()}', category=self.category, price=10)
+                OrderItem.objects.create(order=order, product=product, price=10, quantity=1)
+
+    def count_queries(self, user, url):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        urls = [(self.user, '/api/orders/'), (self.admin, '/api/orders/admin/'), (self.admin, '/api/orders/stats/')]
+        self.add_orders(1, items=1)
+        before = [self.count_queries(user, url) for user, url in urls]
+        self.add_orders(5)
+        after = [self.count_queries(user, url) for user, url in urls]
+        self.assertEqual(before, after)
+
+    def test_order_lines_keep_purchase_price(self):
+        from apps.campaigns.models import Campaign
+        from django.utils import timezone
+        from datetime import timedelta
+        self.add_orders(1, items=1)
+        now = timezone.now()
+        Campaign.objects.create(
+            title='Sale', slug='sale', discount_percentage=50, product_selection_type='all',
+            start_time=now - timedelta(minutes=1), end_time=now + timedelta(days=1),
+        )
+        # As if the window opened after the price was stored
+        Product.objects.update(effective_price=10, price_valid_until=now - timedelta(seconds=1))
+
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/api/orders/')
+        # Lines render their purchase-time snapshot; a later campaign does not re-price them
+        product = response.data['results'][0]['items'][0]['product']
+        self.assertEqual(product['effective_price'], '10.00')
+
+
+class CheckoutStockTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='buyer', password='x')
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name='Kitchen', slug='kitchen')
+        self.products = [
+            Product.objects.create(name=f'Pot {i}', slug=f'pot-{i}', category=self.category, price=10, stock_quantity=5)
+            for i in range(5)
+        ]
+
+    def checkout(self, lines):
+        return self.client.post('/api/orders/', {
+            'items': [{'product_id': str(product.pk), 'quantity': quantity} for product, quantity in lines],
+            'total_amount': 100, 'payment_method': 'pod', 'delivery_address': 'Here',
+        }, format='json')
+
+    def stock(self):
+        return [product.stock_quantity for product in Product.objects.order_by('slug')]
+
+    def test_lines_reserve_stock_atomically(self):
+        first, second = self.products[:2]
+        response = self.checkout([(first, 2), (second, 1), (first, 3)])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.stock(), [0, 4, 5, 5, 5])
+        self.assertEqual(Order.objects.get().items.count(), 3)
+
+        # The second line cannot be served: nothing is taken and no order is written
+        response = self.checkout([(second, 1), (first, 1)])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Insufficient stock for Pot 0', str(response.data))
+        self.assertEqual(self.stock(), [0, 4, 5, 5, 5])
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_rejects_bad_quantities(self):
+        self.assertEqual(self.checkout([(self.products[0], 0)]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.checkout([]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.stock(), [5] * 5)
+
+    def test_query_count_does_not_grow_with_cart_size(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        counts = []
+        for products in (self.products[:1], self.products):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.checkout([(product, 1) for product in products]).status_code, status.HTTP_201_CREATED)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class FlashSaleHoldTests(TestCase):
+    def setUp(self):
+        from datetime import timedelta
+        from django.core.cache import cache
+        from django.utils import timezone
+        from apps.campaigns.models import Campaign
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='buyer', password='x')
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Phones', slug='phones')
+        self.product = Product.objects.create(name='Phone', slug='phone', category=category, price=1000, stock_quantity=3)
+        self.other = Product.objects.create(name='Case', slug='case', category=category, price=100, stock_quantity=10)
+        now = timezone.now()
+        self.campaign = Campaign.objects.create(
+            title='Flash', slug='flash', start_time=now - timedelta(minutes=1), end_time=now + timedelta(hours=1),
+            is_flash_sale=True, discount_percentage=50, hold_seconds=120,
+        )
+        self.campaign.products.add(self.product)
+
+    def hold(self, quantity=1, client=None):
+        return (client or self.client).post('/api/orders/holds/', {'product_id': str(self.product.pk), 'quantity': quantity}, format='json')
+
+    def checkout(self, lines):
+        return self.client.post('/api/orders/', {
+            'items': lines, 'total_amount': 600, 'payment_method': 'pod', 'delivery_address': 'Here',
+        }, format='json')
+
+    def stock(self):
+        self.product.refresh_from_db()
+        return self.product.stock_quantity
+
+    def test_hold_takes_stock_once(self):
+        response = self.hold(2)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['price'], '500.00')
+        self.assertEqual(self.stock(), 1)
+
+        # Asking again returns the live hold instead of taking more
+        again = self.hold(2)
+        self.assertEqual(again.status_code, status.HTTP_200_OK)
+        self.assertEqual(again.data['id'], response.data['id'])
+        self.assertEqual(self.stock(), 1)
+        self.assertEqual(len(self.client.get('/api/orders/holds/').data), 1)
+
+        self.assertEqual(self.hold(3).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sold_out(self):
+        self.hold(2)
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='late', password='x'))
+        self.assertEqual(self.hold(2, client).status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.stock(), 1)
+
+    def test_busy_asks_to_retry(self):
+        from django.test import override_settings
+        with override_settings(FLASH_SALE_ADMISSION_SLOTS=0):
+            response = self.hold()
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(self.stock(), 3)
+
+    def test_admission_slots_are_released(self):
+        from django.test import override_settings
+        from apps.orders.holds import Busy, admission
+        with override_settings(FLASH_SALE_ADMISSION_SLOTS=2):
+            with admission(self.product.pk), admission(self.product.pk):
+                with self.assertRaises(Busy):
+                    with admission(self.product.pk):
+                        pass
+            # Both slots are free again; nothing counts below zero
+            with admission(self.product.pk), admission(self.product.pk):
+                pass
+
+    def test_checkout_converts_hold(self):
+        from apps.orders.models import StockHold
+        from apps.products.inventory import reconcile
+        hold_id = self.hold(2).data['id']
+        response = self.checkout([
+            {'product_id': str(self.product.pk), 'hold_id': hold_id, 'quantity': 1},
+            {'product_id': str(self.other.pk), 'quantity': 1},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        prices = {item['product']['slug']: item['price'] for item in response.data['items']}
+        self.assertEqual(prices['phone'], '500.00')
+
+        hold = StockHold.objects.get(pk=hold_id)
+        self.assertEqual((hold.status, str(hold.order_id)), ('converted', response.data['id']))
+        # The unused held unit goes back; the hold cannot be checked out twice
+        self.assertEqual(self.stock(), 2)
+        self.assertEqual(self.checkout([{'product_id': str(self.product.pk), 'hold_id': hold_id, 'quantity': 1}]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(reconcile(), [])
+
+    def test_checkout_without_hold_is_refused(self):
+        response = self.checkout([{'product_id': str(self.product.pk), 'quantity': 1}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('reserve it', str(response.data))
+        self.assertEqual(self.stock(), 3)
+
+    def test_expired_holds_are_swept_back(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from apps.orders.holds import release_expired_holds
+        from apps.products.inventory import reconcile
+        hold_id = self.hold(2).data['id']
+        self.assertEqual(release_expired_holds(), 0)
+        self.assertEqual(release_expired_holds(timezone.now() + timedelta(seconds=121)), 1)
+        self.assertEqual(self.stock(), 3)
+        self.assertEqual(self.client.delete(f'/api/orders/holds/{hold_id}/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(reconcile(), [])
+
+    def test_release(self):
+        hold_id = self.hold().data['id']
+        self.assertEqual(self.client.delete(f'/api/orders/holds/{hold_id}/').status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.stock(), 3)
+
+
+class OrderStatusEventTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='x')
+        self.order = Order.objects.create(user=self.user, payment_method='pod', total_amount=10, delivery_address='Here')
+
+    def events(self):
+        return list(self.order.status_events.order_by('created_at', 'id').values_list('from_status', 'status'))
+
+    def test_saves_without_reselecting(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        self.assertEqual(self.events(), [(None, 'placed')])
+
+        order = Order.objects.get(pk=self.order.pk)
+        order.is_paid = True
+        with CaptureQueriesContext(connection) as queries:
+            order.save()
+        self.assertFalse([q for q in queries if q['sql'].startswith('SELECT')])
+        self.assertEqual(self.events(), [(None, 'placed')])
+
+    def test_status_changes_are_logged_and_notified(self):
+        from apps.communication.models import Notification
+        order = Order.objects.get(pk=self.order.pk)
+        order.status = 'shipped'
+        order.save()
+        order.save()
+        order.status = 'delivered'
+        order.save(update_fields=['status'])
+        self.assertEqual(self.events(), [(None, 'placed'), ('placed', 'shipped'), ('shipped', 'delivered')])
+        self.assertEqual(
+            list(Notification.objects.filter(user=self.user).order_by('created_at').values_list('type', flat=True)),
+            ['order_placed', 'order_shipped', 'order_delivered'],
+        )
+
+    def test_deferred_status_falls_back_to_log(self):
+        order = Order.objects.defer('status').get(pk=self.order.pk)
+        order.status = 'processing'
+        order.save()
+        self.assertEqual(self.events(), [(None, 'placed'), ('placed', 'processing')])
+
+    def test_tracking_timeline(self):
+        self.order.status = 'processing'
+        self.order.save()
+        response = APIClient().get(f'/api/orders/track/{self.order.id}/')
+        self.assertEqual(
+            [(event['status'], event['label']) for event in response.data['timeline']],
+            [('placed', 'Order Placed'), ('processing', 'Processing/Packing')],
+        )
+
+
+class OrderLineSnapshotTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='buyer', password='x')
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Tools', slug='tools')
+        self.products = [
+            Product.objects.create(name=f'Drill {i}', slug=f'drill-{i}', sku=f'DR-{i}', category=category,
+                                   price=200, discount_price=150, stock_quantity=10, image_main=f'/drill-{i}.jpg')
+            for i in range(3)
+        ]
+
+    def checkout(self, products):
+        response = self.client.post('/api/orders/', {
+            'items': [{'product_id': str(product.pk), 'quantity': 1} for product in products],
+            'total_amount': 450, 'payment_method': 'pod', 'delivery_address': 'Here',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response
+
+    def test_history_shows_product_as_sold(self):
+        line = self.checkout(self.products[:1]).data['items'][0]['product']
+        self.assertEqual((line['name'], line['sku'], line['price'], line['effective_price'], line['discount_percent']),
+                         ('Drill 0', 'DR-0', '200.00', '150.00', '25.00'))
+
+        product = self.products[0]
+        product.name, product.price, product.discount_price = 'Drill Pro', 300, None
+        product.save()
+        line = self.client.get('/api/orders/').data['results'][0]['items'][0]
+        self.assertEqual((line['price'], line['product']['name'], line['product']['image_main']), ('150.00', 'Drill 0', '/drill-0.jpg'))
+
+    def test_history_never_reads_products(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        self.checkout(self.products[:1])
+        counts = []
+        for products in (self.products[:1], self.products):
+            self.checkout(products)
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get('/api/orders/')
+            self.assertFalse([q for q in queries if 'products_product' in q['sql']])
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
@@ -1,9 +1,10 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import OrderViewSet, AdminOrderViewSet, AdminStatsView, TrackOrderView, StoreSettingsViewSet
+from .views import OrderViewSet, AdminOrderViewSet, AdminStatsView, TrackOrderView, StoreSettingsViewSet, StockHoldViewSet
 
 router = DefaultRouter()
 router.register(r'settings', StoreSettingsViewSet, basename='store-settings')
+router.register(r'holds', StockHoldViewSet, basename='stock-hold')
 router.register(r'admin', AdminOrderViewSet, basename='admin-order')
 router.register(r'', OrderViewSet, basename='order')
 
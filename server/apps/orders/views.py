@@ -1,23 +1,84 @@
 from rest_framework import viewsets, permissions
-from .models import Order
-from .serializers import OrderSerializer
+from rest_framework.response import Response
+from django.db.models import Prefetch
+from .models import Order, OrderStatusEvent, StockHold
+from .serializers import OrderSerializer, StockHoldSerializer
+from apps.products.pricing import refresh_prices_for_request
+from castle_core.pagination import KeysetPagination
+
+
+def with_order_relations(queryset):
+    """
+    Everything OrderSerializer renders in a fixed number of queries: the
+    user joined in and the items in one prefetch. Lines render from their
+    purchase-time snapshot, so no products are loaded or re-priced.
+    """
+    return queryset.select_related('user').prefetch_related('items')
 
 class OrderViewSet(viewsets.ModelViewSet):
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         # Users see their own orders, Admins see all (if we add IsAdminUser permission logic later)
         # For now, just own orders
-        return Order.objects.filter(user=self.request.user).order_by('-created_at')
+        return with_order_relations(Order.objects.filter(user=self.request.user).order_by('-created_at'))
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+class StockHoldViewSet(viewsets.GenericViewSet):
+    """
+    Flash-sale holds (apps.orders.holds): list the buyer's live holds, take
+    one (201, or 200 with the hold already held) and give one back.
+    """
+    serializer_class = StockHoldSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        from django.utils import timezone
+        from .holds import ACTIVE
+
+        refresh_prices_for_request(self.request)
+        return StockHold.objects.filter(
+            user=self.request.user, status=ACTIVE, expires_at__gt=timezone.now(),
+        ).select_related('product').order_by('expires_at')
+
+    def list(self, request):
+        return Response(self.get_serializer(self.get_queryset(), many=True).data)
+
+    def create(self, request):
+        from .holds import Busy, HoldError, create_hold
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            hold, created = create_hold(
+                request.user, serializer.validated_data['product_id'], serializer.validated_data['quantity'],
+            )
+        except HoldError as exc:
+            response = Response({'error': str(exc)}, status=exc.status_code)
+            if isinstance(exc, Busy):
+                response['Retry-After'] = str(exc.retry_after)
+            return response
+        return Response(self.get_serializer(hold).data, status=201 if created else 200)
+
+    def destroy(self, request, pk=None):
+        from .holds import release_holds
+
+        if not release_holds(self.get_queryset().filter(pk=pk), note='released'):
+            return Response({'error': 'Hold not found'}, status=404)
+        return Response(status=204)
+
 class AdminOrderViewSet(viewsets.ModelViewSet):
-    queryset = Order.objects.all().order_by('-created_at')
+    queryset = Order.objects.all().order_by('-created_at', '-id')
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAdminUser]
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        return with_order_relations(super().get_queryset())
 
     def update(self, request, *args, **kwargs):
         import logging
@@ -42,7 +103,6 @@ class AdminOrderViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 from rest_framework.views import APIView
-from rest_framework.response import Response
 from django.db.models import Sum, Count
 from django.contrib.auth import get_user_model
 from apps.products.models import Product
@@ -57,7 +117,8 @@ class AdminStatsView(APIView):
         total_products = Product.objects.count()
         
         # Recent orders
-        recent_orders = OrderSerializer(Order.objects.all().order_by('-created_at')[:5], many=True).data
+        recent = with_order_relations(Order.objects.all()).order_by('-created_at')[:5]
+        recent_orders = OrderSerializer(recent, many=True).data
         
         return Response({
             'total_orders': total_orders,
@@ -71,12 +132,37 @@ class TrackOrderView(APIView):
     permission_classes = [permissions.AllowAny]
 
     def get(self, request, pk):
-        try:
-            order = Order.objects.get(pk=pk)
-            return Response(OrderSerializer(order).data)
-        except Order.DoesNotExist:
+        from django.db.models import Count, Max
+        from django.utils.cache import get_conditional_response, patch_cache_control
+        from castle_core.conditional import make_etag, apply_validators
+
+        # Validators without loading the order: its updated_at plus its item count
+        state = Order.objects.filter(pk=pk).aggregate(
+            updated_at=Max('updated_at'), count=Count('pk', distinct=True), items=Count('items'),
+        )
+        if not state['count']:
             return Response({'error': 'Order not found'}, status=404)
 
+        etag = make_etag(str(state['updated_at']), state['items'], request.accepted_media_type)
+        last_modified = state['updated_at']
+        response = get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()))
+        if response is None:
+            from .serializers import OrderStatusEventSerializer
+
+            order = with_order_relations(Order.objects.all()).prefetch_related(
+                Prefetch('status_events', queryset=OrderStatusEvent.objects.order_by('created_at', 'id'))
+            ).get(pk=pk)
+            # Every status change is saved with the order, so updated_at above covers the timeline too
+            response = Response({
+                **OrderSerializer(order).data,
+                'timeline': OrderStatusEventSerializer(order.status_events.all(), many=True).data,
+            })
+
+        apply_validators(response, etag, last_modified)
+        # Tracking pages are per-customer; never stored by shared caches
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
 from math import radians, cos, sin, asin, sqrt
 from rest_framework.decorators import action
 from .models import StoreSettings
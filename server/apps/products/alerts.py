@@ -0,0 +1,180 @@
+"""
+Wishlist alerts: price drops, items back in stock and wishlisted items
+going on sale (Notification types price_drop, back_in_stock, wishlist_sale).
+
+Detection is cheap and happens wherever products are written: post_save,
+price recomputes (which is where campaign starts land) and catalog imports.
+Each change becomes a PendingAlert row, one per product and kind, inserted
+with ignore_conflicts. A burst of changes to the same product folds into
+the row that is already waiting and keeps the first baseline price.
+
+`dispatch_alerts` (the dispatch_alerts command, a cron job in render.yaml) handles the
+alerts that have waited ALERT_COALESCE_SECONDS:
+
+- It re-checks each one against the current product, so a price that went
+  back up sends nothing.
+- It matches them to wishlists in one query and bulk-creates the
+  notifications.
+- It sends one email per user, over one connection, in batches of
+  ALERT_EMAIL_BATCH.
+"""
+import logging
+from collections import namedtuple
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+PRICE_DROP = 'price_drop'
+BACK_IN_STOCK = 'back_in_stock'
+WISHLIST_SALE = 'wishlist_sale'
+# A product with several alerts due at once gets the first of these only
+PRIORITY = (WISHLIST_SALE, PRICE_DROP, BACK_IN_STOCK)
+BATCH_SIZE = 500
+
+AlertState = namedtuple('AlertState', ['effective_price', 'stock_quantity', 'discount_campaign_id'])
+
+# A field that was not loaded (deferred), as opposed to a NULL
+UNKNOWN = object()
+
+
+def coalesce_window():
+    return timedelta(seconds=getattr(settings, 'ALERT_COALESCE_SECONDS', 600))
+
+
+def alert_state_of(product):
+    return AlertState(*(product.__dict__.get(field, UNKNOWN) for field in AlertState._fields))
+
+
+def detect_alerts(old, new):
+    """[(kind, baseline_price), ...] for a product going from state `old` to `new`."""
+    alerts = []
+    if UNKNOWN not in (old.effective_price, new.effective_price) and None not in (old.effective_price, new.effective_price):
+        if new.effective_price < old.effective_price:
+            campaign_started = (
+                UNKNOWN not in (old.discount_campaign_id, new.discount_campaign_id)
+                and new.discount_campaign_id is not None
+                and new.discount_campaign_id != old.discount_campaign_id
+            )
+            alerts.append((WISHLIST_SALE if campaign_started else PRICE_DROP, old.effective_price))
+    if UNKNOWN not in (old.stock_quantity, new.stock_quantity) and old.stock_quantity <= 0 < new.stock_quantity:
+        alerts.append((BACK_IN_STOCK, None))
+    return alerts
+
+
+def queue_alerts(changes):
+    """
+    Queues the alerts for [(product_id, old_state, new_state), ...]. Alerts
+    already waiting for a product are kept as they are. Returns how many
+    alerts were detected.
+    """
+    from .models import PendingAlert
+
+    now = timezone.now()
+    rows = [
+        PendingAlert(product_id=product_id, kind=kind, baseline_price=baseline, detected_at=now)
+        for product_id, old, new in changes
+        for kind, baseline in detect_alerts(old, new)
+    ]
+    if rows:
+        PendingAlert.objects.bulk_create(rows, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    return len(rows)
+
+
+def still_applies(alert):
+    product = alert.product
+    if not product.is_active:
+        return False
+    if alert.kind == BACK_IN_STOCK:
+        return product.stock_quantity > 0
+    if alert.kind == WISHLIST_SALE and product.discount_campaign_id is None:
+        return False
+    return alert.baseline_price is None or product.effective_price < alert.baseline_price
+
+
+def describe(kind, product, baseline):
+    """(title, message) of a notification."""
+    if kind == PRICE_DROP:
+        return (
+            f'Price drop: {product.name}',
+            f'{product.name} on your wishlist is now KES {product.effective_price} (was KES {baseline}).',
+        )
+    if kind == WISHLIST_SALE:
+        return (
+            f'On sale: {product.name}',
+            f'{product.name} on your wishlist is {product.discount_percent.normalize():f}% off: '
+            f'KES {product.effective_price}.',
+        )
+    return f'Back in stock: {product.name}', f'{product.name} on your wishlist is back in stock.'
+
+
+def dispatch_alerts(now=None, send_emails=True):
+    """
+    Turns the alerts that have waited out the coalescing window into
+    notifications (and emails). Returns {'alerts', 'notifications', 'emails'}.
+    """
+    from django.db import transaction
+    from apps.communication.models import Notification
+    from .models import PendingAlert, Wishlist
+
+    now = now or timezone.now()
+    with transaction.atomic():
+        # skip_locked: overlapping runs split the work instead of sending twice
+        due = list(
+            PendingAlert.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(detected_at__lte=now - coalesce_window())
+            .select_related('product')
+        )
+        if not due:
+            return {'alerts': 0, 'notifications': 0, 'emails': 0}
+
+        chosen = {}
+        for alert in sorted(due, key=lambda alert: PRIORITY.index(alert.kind)):
+            if alert.product_id not in chosen and still_applies(alert):
+                chosen[alert.product_id] = alert
+
+        notifications, per_user = [], {}
+        matches = Wishlist.objects.filter(product_id__in=chosen).values_list(
+            'user_id', 'product_id', 'user__email', 'user__first_name',
+        )
+        for user_id, product_id, email, first_name in matches.iterator(chunk_size=BATCH_SIZE):
+            alert = chosen[product_id]
+            title, message = describe(alert.kind, alert.product, alert.baseline_price)
+            notifications.append(Notification(
+                user_id=user_id, type=alert.kind, title=title, message=message, link=f'/product/{product_id}',
+            ))
+            if email:
+                per_user.setdefault((email, first_name), []).append((title, message))
+
+        Notification.objects.bulk_create(notifications, batch_size=BATCH_SIZE)
+        PendingAlert.objects.filter(pk__in=[alert.pk for alert in due]).delete()
+
+    emails = send_alert_emails(per_user) if send_emails else 0
+    return {'alerts': len(chosen), 'notifications': len(notifications), 'emails': emails}
+
+
+def send_alert_emails(per_user):
+    """One email per user listing their alerts, sent in batches over one connection."""
+    from django.core.mail import EmailMultiAlternatives, get_connection
+    from django.template.loader import render_to_string
+    from django.utils.html import strip_tags
+
+    batch_size = getattr(settings, 'ALERT_EMAIL_BATCH', 100)
+    messages = []
+    for (email, first_name), alerts in per_user.items():
+        subject = alerts[0][0] if len(alerts) == 1 else f'{len(alerts)} updates on your wishlist'
+        html = render_to_string('email/wishlist_alerts.html', {'first_name': first_name, 'alerts': alerts})
+        message = EmailMultiAlternatives(subject, strip_tags(html), settings.DEFAULT_FROM_EMAIL, [email])
+        message.attach_alternative(html, 'text/html')
+        messages.append(message)
+
+    sent = 0
+    with get_connection() as connection:
+        for start in range(0, len(messages), batch_size):
+            try:
+                sent += connection.send_messages(messages[start:start + batch_size]) or 0
+            except Exception:
+                # The notifications exist either way; a failed batch is not retried
+                logger.exception('Failed to send a batch of wishlist alert emails')
+    return sent
@@ -0,0 +1,237 @@
+"""
+Delta sync: catalog rows changed since an opaque token.
+
+Categories, products, campaigns and banners are read in (updated_at, id)
+order from their (updated_at, id) indexes, and deletes come from Tombstone
+rows. The streams are merged into one sequence keyed by
+(timestamp, stream, id). The token is the key of the last change returned,
+so it only ever moves forward and paging never skips or repeats a row.
+
+Rows touched in the last CHANGES_LAG_SECONDS are held back until the next
+call. A transaction that commits after the token passed its updated_at
+would otherwise never be delivered.
+
+Inactive products, campaigns and banners are reported as deletes
+(reason "inactive"), just like rows that are gone.
+"""
+import base64
+import heapq
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 2000
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+def lag():
+    return timedelta(seconds=getattr(settings, 'CHANGES_LAG_SECONDS', 2))
+
+
+def tombstone_retention():
+    return timedelta(days=getattr(settings, 'CHANGES_TOMBSTONE_DAYS', 30))
+
+
+def _micros(value):
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def _from_micros(value):
+    return EPOCH + timedelta(microseconds=value)
+
+
+def encode_token(key, floor):
+    """
+    `key` is the position; `floor` is the point from which the client has seen
+    every delete (the start of its current round of paging).
+    """
+    moment, stream, pk = key
+    raw = json.dumps([_micros(moment), stream, pk, _micros(floor)], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_token(token):
+    """Returns ((moment, stream, pk), floor)."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        micros, stream, pk, floor = json.loads(raw)
+        return (_from_micros(int(micros)), int(stream), str(pk)), _from_micros(int(floor))
+    except (ValueError, TypeError):
+        raise InvalidToken('Invalid change token')
+
+
+class Stream:
+    """One source of changes; `rank` orders streams sharing a timestamp."""
+    kind = None
+    time_field = 'updated_at'
+
+    def __init__(self, rank):
+        self.rank = rank
+
+    def queryset(self):
+        raise NotImplementedError
+
+    def rows(self, position, until, limit):
+        moment, rank, pk = position
+        after = Q(**{f'{self.time_field}__gt': moment})
+        if rank < self.rank:
+            after |= Q(**{self.time_field: moment})
+        elif rank == self.rank and pk:
+            after |= Q(**{self.time_field: moment, 'pk__gt': pk})
+        queryset = self.queryset().filter(after, **{f'{self.time_field}__lt': until})
+        for row in queryset.order_by(self.time_field, 'pk')[:limit]:
+            yield (getattr(row, self.time_field), self.rank, self.key_id(row.pk)), row
+
+    def key_id(self, pk):
+        return str(pk)
+
+    def change(self, row):
+        if not getattr(row, 'is_active', True):
+            return {'type': self.kind, 'op': 'delete', 'id': str(row.pk), 'reason': 'inactive'}
+        return {'type': self.kind, 'op': 'upsert', 'id': str(row.pk), 'data': self.serialize(row)}
+
+    def serialize(self, row):
+        raise NotImplementedError
+
+
+class CategoryStream(Stream):
+    kind = 'category'
+
+    def queryset(self):
+        from .models import Category
+        return Category.objects.all()
+
+    def serialize(self, row):
+        from .serializers import CategorySerializer
+        return CategorySerializer(row).data
+
+
+class ProductStream(Stream):
+    kind = 'product'
+
+    def queryset(self):
+        from .models import Product
+        return Product.objects.all()
+
+    def serialize(self, row):
+        from .serializers import ProductListSerializer
+        return ProductListSerializer(row).data
+
+
+class CampaignStream(Stream):
+    kind = 'campaign'
+
+    def queryset(self):
+        from django.db.models import Prefetch
+        from apps.campaigns.models import Campaign
+        from .models import Product
+        return Campaign.objects.prefetch_related(Prefetch('products', queryset=Product.objects.only('pk')))
+
+    def serialize(self, row):
+        from apps.campaigns.serializers import CampaignListSerializer
+        data = CampaignListSerializer(row).data
+        data['product_ids'] = [str(product.pk) for product in row.products.all()]
+        return data
+
+
+class BannerStream(Stream):
+    kind = 'banner'
+
+    def queryset(self):
+        from apps.campaigns.models import CampaignBanner
+        return CampaignBanner.objects.all()
+
+    def serialize(self, row):
+        from apps.campaigns.serializers import CampaignBannerSerializer
+        return CampaignBannerSerializer(row).data
+
+
+class TombstoneStream(Stream):
+    kind = 'tombstone'
+    time_field = 'deleted_at'
+
+    def queryset(self):
+        from .models import Tombstone
+        return Tombstone.objects.all()
+
+    def rows(self, position, until, limit):
+        # Tombstone ids are integers; keys carry them zero-padded so they sort as strings too
+        moment, rank, pk = position
+        if rank == self.rank and pk:
+            position = (moment, rank, int(pk))
+        return super().rows(position, until, limit)
+
+    def key_id(self, pk):
+        return f'{pk:020d}'
+
+    def change(self, row):
+        return {'type': row.kind, 'op': 'delete', 'id': str(row.object_id), 'reason': 'deleted'}
+
+
+STREAMS = [CategoryStream(0), ProductStream(1), CampaignStream(2), BannerStream(3), TombstoneStream(4)]
+
+
+def changes_since(token=None, limit=DEFAULT_LIMIT, now=None):
+    """
+    Returns {'changes': [...], 'next': token, 'has_more': bool, 'reset': bool}.
+    Without a token every row is returned (an initial sync). 'reset' means the
+    token is older than the tombstones kept: the client must sync from scratch.
+    """
+    now = now or timezone.now()
+    until = now - lag()
+    if token:
+        position, floor = decode_token(token)
+    else:
+        # Rows deleted before an initial sync never reach the client: no older tombstones needed
+        position, floor = (EPOCH, -1, ''), until
+
+    if floor < now - tombstone_retention():
+        return {'changes': [], 'next': None, 'has_more': False, 'reset': True}
+
+    # Each stream yields at most `limit` + 1 rows; the merge keeps the first `limit` + 1
+    def tagged(stream):
+        for key, row in stream.rows(position, until, limit + 1):
+            yield key, stream, row
+
+    merged = heapq.merge(*(tagged(stream) for stream in STREAMS), key=lambda item: item[0])
+    page = []
+    for item in merged:
+        page.append(item)
+        if len(page) > limit:
+            break
+
+    has_more = len(page) > limit
+    page = page[:limit]
+    if has_more:
+        next_key = page[-1][0]
+    else:
+        # Everything before `until` has been delivered; the next round starts there
+        next_key = max(position, (until, -1, ''))
+        floor = next_key[0]
+
+    return {
+        'changes': [stream.change(row) for _, stream, row in page],
+        'next': encode_token(next_key, floor),
+        'has_more': has_more,
+        'reset': False,
+    }
+
+
+def record_tombstones(kind, pks):
+    from .models import Tombstone
+    Tombstone.objects.bulk_create([Tombstone(kind=kind, object_id=pk) for pk in pks])
+
+
+def prune_tombstones(now=None):
+    from .models import Tombstone
+    now = now or timezone.now()
+    deleted, _ = Tombstone.objects.filter(deleted_at__lt=now - tombstone_retention()).delete()
+    return deleted
@@ -0,0 +1,142 @@
+"""
+"Frequently bought together" index built from order lines.
+
+Every pair of distinct products in an order adds one to
+ProductCoPurchase(product, related) in both directions. New orders are
+added incrementally by `record_order`; `rebuild_copurchases` recounts
+everything by streaming OrderItem rows sorted by order and flushing the
+in-memory pair counts whenever they grow past `flush_pairs`, all in one
+transaction that replaces the index atomically.
+"""
+from collections import Counter
+from itertools import combinations, groupby
+from operator import itemgetter
+from django.db import connection, transaction
+from django.db.models import F
+
+# Orders with more distinct products than this (bulk/corporate buys) say
+# little about what goes together and would add O(n^2) pairs
+MAX_ORDER_PRODUCTS = 50
+FLUSH_PAIRS = 200_000
+BATCH_SIZE = 1000
+
+
+def order_pairs(product_ids):
+    """Unordered pairs (a < b) of the distinct products in one order."""
+    product_ids = sorted(set(product_ids))
+    if len(product_ids) < 2 or len(product_ids) > MAX_ORDER_PRODUCTS:
+        return []
+    return combinations(product_ids, 2)
+
+
+def record_order(order_id):
+    """
+    Adds one order to the index: an INSERT of the missing pairs followed by a
+    single UPDATE count = count + 1, so concurrent orders never lose counts.
+    """
+    from apps.orders.models import OrderItem
+    from .models import ProductCoPurchase
+
+    product_ids = set(OrderItem.objects.filter(order_id=order_id).values_list('product_id', flat=True))
+    pairs = list(order_pairs(product_ids))
+    if not pairs:
+        return 0
+
+    with transaction.atomic():
+        ProductCoPurchase.objects.bulk_create(
+            [ProductCoPurchase(product_id=a, related_id=b) for a, b in pairs]
+            + [ProductCoPurchase(product_id=b, related_id=a) for a, b in pairs],
+            ignore_conflicts=True, batch_size=BATCH_SIZE,
+        )
+        # Every ordered pair within the order's products, i.e. exactly the rows above
+        ProductCoPurchase.objects.filter(
+            product_id__in=product_ids, related_id__in=product_ids,
+        ).exclude(product_id=F('related_id')).update(count=F('count') + 1)
+
+    from castle_core.response_cache import invalidate
+    invalidate(*(f'copurchase:{pk}' for pk in product_ids))
+    return len(pairs)
+
+
+def _flush(counter):
+    """Adds `counter` ({(a, b): n} with a < b) onto the stored counts, both directions."""
+    from .models import ProductCoPurchase
+
+    items = sorted(counter.items())
+    for start in range(0, len(items), BATCH_SIZE):
+        batch = items[start:start + BATCH_SIZE]
+        deltas = {}
+        for (a, b), n in batch:
+            deltas[(a, b)] = n
+            deltas[(b, a)] = n
+
+        sources = {a for a, _ in deltas}
+        targets = {b for _, b in deltas}
+        existing = {
+            (row.product_id, row.related_id): row
+            for row in ProductCoPurchase.objects.filter(product_id__in=sources, related_id__in=targets)
+            if (row.product_id, row.related_id) in deltas
+        }
+
+        to_update, to_create = [], []
+        for (a, b), n in deltas.items():
+            row = existing.get((a, b))
+            if row is None:
+                to_create.append(ProductCoPurchase(product_id=a, related_id=b, count=n))
+            else:
+                row.count += n
+                to_update.append(row)
+        ProductCoPurchase.objects.bulk_update(to_update, ['count'], batch_size=BATCH_SIZE)
+        ProductCoPurchase.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+    counter.clear()
+
+
+def rebuild_copurchases(flush_pairs=FLUSH_PAIRS, chunk_size=5000):
+    """
+    Recounts the index from all order lines. Memory is bounded by
+    `flush_pairs` distinct pairs, not by the number of order lines.
+    Returns (orders, pairs) counted.
+    """
+    from apps.orders.models import OrderItem
+    from .models import ProductCoPurchase
+
+    from castle_core.response_cache import invalidate
+
+    # One transaction: readers keep seeing the old index until the new one commits
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            # Holds record_order's writes (not reads) until the rebuild commits. Orders committed
+            # after the lines below are read then add themselves once, on top of the new counts
+            with connection.cursor() as cursor:
+                cursor.execute(f'LOCK TABLE {ProductCoPurchase._meta.db_table} IN EXCLUSIVE MODE')
+        ProductCoPurchase.objects.all().delete()
+
+        lines = (
+            OrderItem.objects.order_by('order_id')
+            .values_list('order_id', 'product_id')
+            .iterator(chunk_size=chunk_size)
+        )
+        counter = Counter()
+        orders = pairs = 0
+        for _, group in groupby(lines, key=itemgetter(0)):
+            found = list(order_pairs(product_id for _, product_id in group))
+            orders += 1
+            pairs += len(found)
+            counter.update(found)
+            if len(counter) >= flush_pairs:
+                _flush(counter)
+        _flush(counter)
+    # Cached lists of any product may have changed
+    invalidate('products')
+    return orders, pairs
+
+
+def related_product_ids(product_id, limit):
+    """Most co-purchased products first; one index range scan."""
+    from .models import ProductCoPurchase
+
+    return list(
+        ProductCoPurchase.objects.filter(product_id=product_id, count__gt=0)
+        .order_by('-count')
+        .values_list('related_id', flat=True)[:limit]
+    )
@@ -0,0 +1,70 @@
+"""
+Sidebar facets for the product list: per-category counts, price-range
+buckets, and pay-on-delivery / on-sale counts, from one grouped query.
+
+Category counts ignore the category filter itself (so the sidebar still
+lists the other categories with their counts); every other facet is counted
+within the selected category only.
+"""
+from django.db.models import Count, Q
+
+# Upper bounds (exclusive) of the price ranges, on effective_price
+PRICE_BUCKET_BOUNDS = (1000, 2500, 5000, 10000, 25000, 50000)
+
+
+def price_buckets(bounds=PRICE_BUCKET_BOUNDS):
+    """[(min, max), ...] covering every price; the last range has no upper bound."""
+    lower = [0] + list(bounds)
+    upper = list(bounds) + [None]
+    return list(zip(lower, upper))
+
+
+def _bucket_q(low, high):
+    condition = Q(effective_price__gte=low)
+    if high is not None:
+        condition &= Q(effective_price__lt=high)
+    return condition
+
+
+def compute_facets(queryset, category_slug=None, bounds=PRICE_BUCKET_BOUNDS):
+    """
+    `queryset` has every list filter applied except the category one;
+    `category_slug` is that filter's value, if any.
+    """
+    buckets = price_buckets(bounds)
+    aggregates = {
+        'count': Count('pk'),
+        'allow_pod': Count('pk', filter=Q(allow_pod=True)),
+        'on_sale': Count('pk', filter=Q(discount_percent__gt=0)),
+    }
+    for index, (low, high) in enumerate(buckets):
+        aggregates[f'price_{index}'] = Count('pk', filter=_bucket_q(low, high))
+
+    rows = list(
+        queryset.order_by()
+        .values('category_id', 'category__slug', 'category__name')
+        .annotate(**aggregates)
+    )
+
+    selected = [row for row in rows if category_slug in (None, row['category__slug'])]
+    totals = {name: sum(row[name] for row in selected) for name in aggregates}
+
+    return {
+        'count': totals['count'],
+        'categories': [
+            {
+                'id': row['category_id'],
+                'slug': row['category__slug'],
+                'name': row['category__name'],
+                'count': row['count'],
+                'selected': row['category__slug'] == category_slug,
+            }
+            for row in sorted(rows, key=lambda row: (-row['count'], row['category__name']))
+        ],
+        'price_ranges': [
+            {'min': low, 'max': high, 'count': totals[f'price_{index}']}
+            for index, (low, high) in enumerate(buckets)
+        ],
+        'allow_pod': totals['allow_pod'],
+        'on_sale': totals['on_sale'],
+    }
@@ -0,0 +1,44 @@
+import django_filters
+from rest_framework import filters
+from .models import Product
+
+
+class ProductFilter(django_filters.FilterSet):
+    # Price filters work on the price customers actually pay
+    price__gte = django_filters.NumberFilter(field_name='effective_price', lookup_expr='gte')
+    price__lte = django_filters.NumberFilter(field_name='effective_price', lookup_expr='lte')
+    on_sale = django_filters.BooleanFilter(method='filter_on_sale')
+    rating__gte = django_filters.NumberFilter(field_name='rating_average', lookup_expr='gte')
+
+    class Meta:
+        model = Product
+        fields = {
+            'category__slug': ['exact'],
+            'allow_pod': ['exact'],
+        }
+
+    def filter_on_sale(self, queryset, name, value):
+        if value:
+            # Static and campaign discounts alike, from the sale index
+            return queryset.filter(discount_percent__gt=0)
+        return queryset
+
+
+class AliasedOrderingFilter(filters.OrderingFilter):
+    """
+    OrderingFilter that maps public ordering names onto model fields through
+    `view.ordering_aliases`, e.g. ?ordering=-price -> -effective_price.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        aliases = getattr(view, 'ordering_aliases', None)
+        if not ordering or not aliases:
+            return ordering
+
+        mapped = []
+        for term in ordering:
+            descending = term.startswith('-')
+            field = aliases.get(term.lstrip('-'), term.lstrip('-'))
+            mapped.append(f"-{field}" if descending else field)
+        return mapped
@@ -0,0 +1,51 @@
+"""
+Order-preserving gallery sync: images whose URL is still listed keep their
+row (and id), only their position is updated; new URLs are bulk-inserted and
+dropped ones bulk-deleted. Works for many products at once so the importer
+and the serializer share one path.
+"""
+from collections import defaultdict
+
+BATCH_SIZE = 1000
+
+
+def sync_images(images_by_product):
+    """
+    `images_by_product` maps product id -> ordered list of image URLs (the
+    full gallery). Returns (created, updated, deleted) row counts.
+    """
+    from .models import ProductImage
+
+    images_by_product = {pk: [str(url) for url in urls] for pk, urls in images_by_product.items()}
+    if not images_by_product:
+        return 0, 0, 0
+
+    # URL -> existing rows, in gallery order; a list so duplicate URLs each keep a row
+    existing = defaultdict(lambda: defaultdict(list))
+    for image in ProductImage.objects.filter(product_id__in=images_by_product).only('id', 'product_id', 'image', 'position'):
+        existing[image.product_id][image.image].append(image)
+
+    to_create, to_update, to_delete = [], [], []
+    for product_id, urls in images_by_product.items():
+        current = existing.get(product_id, {})
+        for position, url in enumerate(urls):
+            if current.get(url):
+                image = current[url].pop(0)
+                if image.position != position:
+                    image.position = position
+                    to_update.append(image)
+            else:
+                to_create.append(ProductImage(product_id=product_id, image=url[:500], position=position))
+        to_delete.extend(image.pk for rows in current.values() for image in rows)
+
+    if to_delete:
+        ProductImage.objects.filter(pk__in=to_delete).delete()
+    if to_update:
+        ProductImage.objects.bulk_update(to_update, ['position'], batch_size=BATCH_SIZE)
+    if to_create:
+        from castle_core.image_variants import queue_variants
+
+        ProductImage.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+        # bulk_create sends no post_save: queue the new images' variants here
+        queue_variants('product_image', [(image.pk, image.image) for image in to_create])
+    return len(to_create), len(to_update), len(to_delete)
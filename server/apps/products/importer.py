@@ -0,0 +1,326 @@
+"""
+Streaming catalog import: CSV or NDJSON rows upserted on `slug` in chunked
+bulk_create(update_conflicts=True) batches.
+
+Per chunk there is a fixed number of queries (existing slugs, SKU checks,
+the upsert, image rows, search index), whatever the chunk size. Pricing is
+computed in Python from one campaign index for the whole import. Bad rows
+are reported with their line number and skipped; the rest are written.
+
+Every row is a full product: name, category (slug) and price are required,
+other columns fall back to the model defaults. `images` sets the
+product's gallery when present (a JSON list, or URLs separated by "|" in
+CSV); unchanged images keep their rows.
+"""
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from django.core.validators import slug_re as SLUG_RE
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'f', ''}
+
+# Columns written on conflict; created_at and rating aggregates keep their stored values
+UPSERT_FIELDS = [
+    'name', 'category', 'description', 'price', 'discount_price', 'effective_price', 'price_valid_until',
+    'discount_percent', 'discount_source', 'discount_campaign', 'stock_quantity', 'image_main', 'is_active', 'allow_pod', 'options', 'sku', 'updated_at',
+]
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_rows(stream, format):
+    """Yields (line_number, dict) from a text stream without loading it whole."""
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif format == 'ndjson':
+        for line_number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                yield line_number, RowError(f'Invalid JSON: {exc}')
+                continue
+            yield line_number, row
+    else:
+        raise ValueError(f'Unsupported import format: {format}')
+
+
+def guess_format(filename):
+    return 'csv' if filename.lower().endswith('.csv') else 'ndjson'
+
+
+def _text(row, name, default=''):
+    value = row.get(name)
+    if value is None:
+        return default
+    return str(value).strip()
+
+
+def _decimal(row, name, required=False):
+    value = _text(row, name)
+    if value == '':
+        if required:
+            raise RowError(f'{name} is required')
+        return None
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        raise RowError(f'{name} is not a number: {value!r}')
+    if number < 0 or not number.is_finite():
+        raise RowError(f'{name} must be a positive number')
+    return number.quantize(Decimal('0.01'))
+
+
+def _bool(row, name, default):
+    value = row.get(name)
+    if value is None or isinstance(value, bool):
+        return default if value is None else value
+    value = str(value).strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise RowError(f'{name} must be true or false')
+
+
+def _int(row, name, default=0):
+    value = _text(row, name)
+    if value == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise RowError(f'{name} must be a whole number')
+
+
+def _json_list(row, name, separator=None):
+    """A list column: JSON in NDJSON or CSV, or `separator`-joined values in CSV."""
+    value = row.get(name)
+    if value is None or value == '':
+        return None
+    if isinstance(value, list):
+        return value
+    value = str(value).strip()
+    if separator and not value.startswith('['):
+        return [part.strip() for part in value.split(separator) if part.strip()]
+    try:
+        value = json.loads(value)
+    except ValueError:
+        raise RowError(f'{name} is not valid JSON')
+    if not isinstance(value, list):
+        raise RowError(f'{name} must be a list')
+    return value
+
+
+def parse_row(row, category_ids):
+    """Returns (field values, image urls or None) for a raw row."""
+    if isinstance(row, RowError):
+        raise row
+    if not isinstance(row, dict):
+        raise RowError('Row must be an object')
+
+    slug = _text(row, 'slug')
+    if not slug:
+        raise RowError('slug is required')
+    if len(slug) > 50 or not SLUG_RE.match(slug):
+        raise RowError(f'Invalid slug: {slug!r}')
+    name = _text(row, 'name')
+    if not name:
+        raise RowError('name is required')
+
+    category_slug = _text(row, 'category') or _text(row, 'category_slug')
+    if category_slug not in category_ids:
+        raise RowError(f'Unknown category: {category_slug!r}')
+
+    price = _decimal(row, 'price', required=True)
+    discount_price = _decimal(row, 'discount_price')
+    if discount_price is not None and discount_price >= price:
+        raise RowError('discount_price must be lower than price')
+
+    values = {
+        'slug': slug,
+        'name': name[:255],
+        'category_id': category_ids[category_slug],
+        'description': _text(row, 'description'),
+        'price': price,
+        'discount_price': discount_price,
+        'stock_quantity': _int(row, 'stock_quantity'),
+        'image_main': _text(row, 'image_main')[:500],
+        'is_active': _bool(row, 'is_active', True),
+        'allow_pod': _bool(row, 'allow_pod', True),
+        'options': _json_list(row, 'options') or [],
+        'sku': _text(row, 'sku')[:50] or None,
+    }
+    return values, _json_list(row, 'images', separator='|')
+
+
+class CatalogImporter:
+    """
+    importer = CatalogImporter()
+    importer.run(read_rows(stream, 'csv'))
+    importer.summary()  # {'created': .., 'updated': .., 'errors': [...]}
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        from .models import Category
+        from .pricing import load_campaign_index
+
+        self.batch_size = batch_size
+        self.now = timezone.now()
+        self.category_ids = dict(Category.objects.values_list('slug', 'id'))
+        self.campaigns, self.members = load_campaign_index(self.now)
+        self.created = 0
+        self.updated = 0
+        self.errors = []
+        self.error_count = 0
+
+    def error(self, line, slug, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'slug': slug, 'error': str(message)})
+
+    def run(self, rows):
+        chunk = {}
+        for line, raw in rows:
+            try:
+                values, images = parse_row(raw, self.category_ids)
+            except RowError as exc:
+                self.error(line, raw.get('slug') if isinstance(raw, dict) else None, exc)
+                continue
+            # A slug repeated in the file: the later row wins
+            chunk[values['slug']] = (line, values, images)
+            if len(chunk) >= self.batch_size:
+                self.write_chunk(chunk)
+                chunk = {}
+        if chunk:
+            self.write_chunk(chunk)
+        return self.summary()
+
+    def summary(self):
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+    def write_chunk(self, chunk):
+        from .models import Product, allocate_skus
+
+        from .alerts import AlertState
+
+        existing, before = {}, {}
+        rows = Product.objects.filter(slug__in=chunk).values_list('slug', 'pk', 'sku', *AlertState._fields)
+        for slug, pk, sku, *state in rows:
+            existing[slug] = (pk, sku)
+            before[pk] = AlertState(*state)
+
+        # SKUs given in the file must not belong to another product (or another row)
+        wanted = {}
+        for slug, (line, values, _) in list(chunk.items()):
+            if values['sku'] in wanted:
+                chunk.pop(slug)
+                self.error(line, slug, f"SKU {values['sku']} is used by another row")
+            elif values['sku']:
+                wanted[values['sku']] = slug
+        for sku, owner in Product.objects.filter(sku__in=wanted).values_list('sku', 'slug'):
+            slug = wanted[sku]
+            if owner != slug:
+                line = chunk.pop(slug)[0]
+                self.error(line, slug, f'SKU {sku} already belongs to {owner}')
+
+        missing = [slug for slug, (_, values, _) in chunk.items() if not values['sku'] and not existing.get(slug, (None, None))[1]]
+        new_skus = iter(allocate_skus(len(missing), exclude=wanted)) if missing else iter(())
+
+        products = []
+        for slug, (line, values, images) in chunk.items():
+            pk, sku = existing.get(slug, (None, None))
+            product = Product(**values)
+            if pk is not None:
+                product.pk = pk
+            if not product.sku:
+                product.sku = sku or next(new_skus)
+            self.price(product)
+            products.append(product)
+
+        try:
+            with transaction.atomic():
+                Product.objects.bulk_create(
+                    products, batch_size=self.batch_size,
+                    update_conflicts=True, unique_fields=['slug'], update_fields=UPSERT_FIELDS,
+                )
+                self.write_images({product.pk: chunk[product.slug][2] for product in products})
+                self.record_stock(before, products)
+        except DatabaseError as exc:
+            for slug, (line, _, _) in chunk.items():
+                self.error(line, slug, f'Batch failed: {exc}')
+            return
+
+        self.created += sum(1 for product in products if product.slug not in existing)
+        self.updated += sum(1 for product in products if product.slug in existing)
+        self.after_write([product.pk for product in products])
+        self.queue_alerts(before, products)
+
+    def price(self, product):
+        from .pricing import compute_effective_price, set_price_state
+
+        set_price_state(product, compute_effective_price(product, self.campaigns, self.members, self.now))
+
+    def write_images(self, images_by_product):
+        from .images import sync_images
+
+        sync_images({pk: urls for pk, urls in images_by_product.items() if urls is not None})
+
+    def after_write(self, product_ids):
+        # bulk_create sends no post_save: index and drop cached responses here
+        from . import search
+        from castle_core.response_cache import invalidate_products
+
+        search.index_products(product_ids)
+        invalidate_products(product_ids)
+        self.queue_image_variants(product_ids)
+
+    def record_stock(self, before, products):
+        from .inventory import record_stock_changes
+
+        record_stock_changes(
+            [(product.pk, before[product.pk].stock_quantity if product.pk in before else None, product.stock_quantity)
+             for product in products],
+            note='import',
+        )
+
+    def queue_alerts(self, before, products):
+        from .alerts import alert_state_of, queue_alerts
+
+        # Only rows that existed before the import can have dropped in price or come back in stock
+        queue_alerts([
+            (product.pk, before[product.pk], alert_state_of(product))
+            for product in products if product.pk in before
+        ])
+
+    def queue_image_variants(self, product_ids):
+        from .models import Product
+        from castle_core.image_variants import queue_variants
+
+        stale = [
+            (pk, image) for pk, image, manifest in
+            Product.objects.filter(pk__in=product_ids).values_list('pk', 'image_main', 'image_main_variants')
+            if image and (manifest or {}).get('source') != image
+        ]
+        queue_variants('product', stale)
+
+
+def import_catalog(stream, format, batch_size=BATCH_SIZE):
+    return CatalogImporter(batch_size=batch_size).run(read_rows(stream, format))
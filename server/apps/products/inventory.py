@@ -0,0 +1,288 @@
+"""
+Inventory ledger and sharded stock.
+
+Every stock change is appended to StockMovement. The kinds are:
+
+- sale: checkout
+- cancel: stock returned by a cancelled order
+- restock: new stock
+- adjustment: edits in the admin or imports
+- hold / release: flash-sale holds (apps.orders.holds) taking stock and
+  expired ones returning it. A hold that is checked out stays a hold.
+
+A product's ledger balance is its StockCheckpoint plus the movements after
+it. `compact_ledger` (the compact_stock_ledger command) folds new movements
+into the checkpoints periodically, so a balance never sums more than one
+interval's movements. The ledger is never rewritten.
+
+On-hand stock lives in Product.stock_quantity, except for hot products
+(stock_shards > 0). Their stock is split over that many StockShard rows.
+Checkout takes a line from one shard with a conditional UPDATE, starting at
+a random shard, so concurrent buyers of the same product lock different
+rows. Only when no single shard can cover a line are the product's shards
+locked together. stock_quantity of a hot product is a read-only total that
+`compact_ledger` refreshes, so it lags the shards by up to one run:
+compact_stock_ledger must run every minute (a cron job in render.yaml), and
+anything that needs exact stock of a hot product reads `on_hand()`.
+
+`reconcile` compares each product's ledger balance with its on-hand stock.
+"""
+import random
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Max, Q, Sum, When
+from django.utils import timezone
+
+SALE = 'sale'
+CANCEL = 'cancel'
+RESTOCK = 'restock'
+ADJUSTMENT = 'adjustment'
+HOLD = 'hold'
+RELEASE = 'release'
+BATCH_SIZE = 500
+
+
+def record_movements(entries):
+    """Appends [(product_id, kind, quantity, order_id, note), ...] to the ledger, skipping zero quantities."""
+    from .models import StockMovement
+
+    rows = [
+        StockMovement(product_id=product_id, kind=kind, quantity=quantity, order_id=order_id, note=note)
+        for product_id, kind, quantity, order_id, note in entries if quantity
+    ]
+    StockMovement.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+    return len(rows)
+
+
+def shard_totals(product_ids):
+    from .models import StockShard
+
+    totals = StockShard.objects.filter(product_id__in=product_ids).values('product_id').annotate(total=Sum('quantity'))
+    return {row['product_id']: row['total'] or 0 for row in totals}
+
+
+def on_hand(product_ids=None):
+    """{product_id: stock}: stock_quantity, or the shard total for hot products."""
+    from .models import Product
+
+    products = Product.objects.all() if product_ids is None else Product.objects.filter(pk__in=product_ids)
+    stock, hot = {}, []
+    for pk, quantity, shards in products.values_list('pk', 'stock_quantity', 'stock_shards').iterator(chunk_size=BATCH_SIZE):
+        stock[pk] = quantity
+        if shards:
+            hot.append(pk)
+    if hot:
+        totals = shard_totals(hot)
+        stock.update({pk: totals.get(pk, 0) for pk in hot})
+    return stock
+
+
+def take_from_shards(product_id, quantity, shards):
+    """
+    Takes `quantity` from a hot product's shards. Returns None when done, or
+    the stock available when there is not enough.
+    """
+    from .models import StockShard
+
+    rows = StockShard.objects.filter(product_id=product_id)
+    start = random.randrange(shards)
+    for offset in range(shards):
+        shard = (start + offset) % shards
+        if rows.filter(shard=shard, quantity__gte=quantity).update(quantity=F('quantity') - quantity):
+            return None
+
+    # No single shard covers the line: lock them all (in shard order) and take across them
+    locked = list(rows.select_for_update().order_by('shard'))
+    available = sum(row.quantity for row in locked)
+    if available < quantity:
+        return available
+    remaining = quantity
+    for row in sorted(locked, key=lambda row: -row.quantity):
+        take = min(row.quantity, remaining)
+        if take:
+            rows.filter(pk=row.pk).update(quantity=F('quantity') - take)
+            remaining -= take
+        if not remaining:
+            break
+    return None
+
+
+def _split(total, shards):
+    base, extra = divmod(max(total, 0), shards)
+    return [base + (1 if shard < extra else 0) for shard in range(shards)]
+
+
+def distribute(product_id, total, shards):
+    """Rewrites a product's shards to hold `total` between them (locks them first)."""
+    from .models import StockShard
+
+    list(StockShard.objects.select_for_update().filter(product_id=product_id).order_by('shard'))
+    StockShard.objects.filter(product_id=product_id).delete()
+    StockShard.objects.bulk_create([
+        StockShard(product_id=product_id, shard=shard, quantity=quantity)
+        for shard, quantity in enumerate(_split(total, shards))
+    ])
+
+
+@transaction.atomic
+def set_shards(product, shards):
+    """
+    Makes a product hot (its stock spread over `shards` shards) or, with 0,
+    folds its shards back into stock_quantity. Stock is unchanged.
+    """
+    from .models import Product, StockShard
+
+    product = Product.objects.select_for_update().get(pk=product.pk)
+    total = shard_totals([product.pk]).get(product.pk, 0) if product.stock_shards else product.stock_quantity
+    if shards:
+        distribute(product.pk, total, shards)
+    else:
+        StockShard.objects.filter(product_id=product.pk).delete()
+    Product.objects.filter(pk=product.pk).update(stock_shards=shards, stock_quantity=total, updated_at=timezone.now())
+    return total
+
+
+@transaction.atomic
+def add_stock(quantities, kind, order_id=None, note=''):
+    """
+    Adds {product_id: quantity} back to stock (cancellations, restocks) and
+    records the movements. Hot products get it on a random shard. Regular
+    products coming back from sold out queue their back-in-stock alerts,
+    as a save would.
+    """
+    from .alerts import UNKNOWN, AlertState, queue_alerts
+    from .models import Product, StockShard
+    from castle_core.response_cache import invalidate_products
+
+    quantities = {pk: quantity for pk, quantity in quantities.items() if quantity}
+    if not quantities:
+        return
+    hot = dict(Product.objects.filter(pk__in=quantities, stock_shards__gt=0).values_list('pk', 'stock_shards'))
+    regular = {pk: quantity for pk, quantity in quantities.items() if pk not in hot}
+    if regular:
+        # Only sold-out rows can come back in stock; locked so the before/after pair is exact
+        sold_out = dict(
+            Product.objects.select_for_update().filter(pk__in=regular, stock_quantity__lte=0)
+            .order_by('pk').values_list('pk', 'stock_quantity')
+        )
+        Product.objects.filter(pk__in=regular).update(
+            stock_quantity=Case(
+                *(When(pk=pk, then=F('stock_quantity') + quantity) for pk, quantity in regular.items()),
+                default=F('stock_quantity'),
+            ),
+            updated_at=timezone.now(),
+        )
+        # UPDATE sends no post_save
+        invalidate_products(list(regular))
+        queue_alerts([
+            (pk, AlertState(UNKNOWN, stock, UNKNOWN), AlertState(UNKNOWN, stock + regular[pk], UNKNOWN))
+            for pk, stock in sold_out.items()
+        ])
+    for pk, shards in hot.items():
+        StockShard.objects.filter(product_id=pk, shard=random.randrange(shards)).update(
+            quantity=F('quantity') + quantities[pk]
+        )
+    record_movements((pk, kind, quantity, order_id, note) for pk, quantity in quantities.items())
+
+
+def record_stock_changes(changes, note=''):
+    """
+    Records stock_quantity edits made by saves and imports,
+    [(product_id, old, new), ...], as movements. For hot products, `new`
+    is the new total: their shards are redistributed to hold it.
+    """
+    from .models import Product
+
+    changes = [(pk, old, new) for pk, old, new in changes if old != new]
+    if not changes:
+        return
+    hot = dict(Product.objects.filter(pk__in=[pk for pk, _, _ in changes], stock_shards__gt=0).values_list('pk', 'stock_shards'))
+    totals = shard_totals(list(hot)) if hot else {}
+    entries = []
+    for pk, old, new in changes:
+        if pk in hot:
+            # `old` is only the last rolled-up total; the shards hold the real stock
+            old = totals.get(pk, 0)
+            distribute(pk, new, hot[pk])
+        entries.append((pk, RESTOCK if old is None else ADJUSTMENT, new - (old or 0), None, note))
+    record_movements(entries)
+
+
+def compact_lag():
+    return timedelta(seconds=getattr(settings, 'INVENTORY_COMPACT_LAG_SECONDS', 60))
+
+
+def ledger_balances(product_ids=None):
+    """{product_id: checkpoint + newer movements}."""
+    from .models import StockCheckpoint, StockMovement
+
+    checkpoints = StockCheckpoint.objects.all()
+    movements = StockMovement.objects.filter(
+        Q(product__stock_checkpoint__isnull=True) | Q(pk__gt=F('product__stock_checkpoint__last_movement_id'))
+    )
+    if product_ids is not None:
+        checkpoints = checkpoints.filter(product_id__in=product_ids)
+        movements = movements.filter(product_id__in=product_ids)
+
+    balances = Counter(dict(checkpoints.values_list('product_id', 'quantity')))
+    for product_id, total in movements.values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total'):
+        balances[product_id] += total
+    return dict(balances)
+
+
+@transaction.atomic
+def compact_ledger(now=None):
+    """
+    Folds movements into the checkpoints and refreshes the stock_quantity
+    totals of hot products. Movements newer than INVENTORY_COMPACT_LAG_SECONDS
+    are left for the next run: a transaction still in flight may hold a lower
+    id. Returns the number of checkpoints moved.
+    """
+    from .models import Product, StockCheckpoint, StockMovement
+    from castle_core.response_cache import invalidate_products
+
+    now = now or timezone.now()
+    through = StockMovement.objects.filter(created_at__lte=now - compact_lag()).aggregate(last=Max('pk'))['last']
+    moved = 0
+    if through:
+        pending = StockMovement.objects.filter(pk__lte=through).filter(
+            Q(product__stock_checkpoint__isnull=True) | Q(pk__gt=F('product__stock_checkpoint__last_movement_id'))
+        ).values('product_id').annotate(total=Sum('quantity'))
+        deltas = {row['product_id']: row['total'] for row in pending}
+        current = dict(StockCheckpoint.objects.filter(product_id__in=deltas).values_list('product_id', 'quantity'))
+        StockCheckpoint.objects.bulk_create(
+            [
+                StockCheckpoint(product_id=pk, quantity=current.get(pk, 0) + delta, last_movement_id=through, updated_at=now)
+                for pk, delta in deltas.items()
+            ],
+            batch_size=BATCH_SIZE, update_conflicts=True,
+            unique_fields=['product'], update_fields=['quantity', 'last_movement_id', 'updated_at'],
+        )
+        moved = len(deltas)
+
+    hot = list(Product.objects.filter(stock_shards__gt=0).only('pk', 'stock_quantity'))
+    totals = shard_totals([product.pk for product in hot]) if hot else {}
+    stale = [product for product in hot if product.stock_quantity != totals.get(product.pk, 0)]
+    for product in stale:
+        product.stock_quantity = totals.get(product.pk, 0)
+        product.updated_at = now
+    if stale:
+        Product.objects.bulk_update(stale, ['stock_quantity', 'updated_at'], batch_size=BATCH_SIZE)
+        invalidate_products([product.pk for product in stale])
+    return moved
+
+
+def reconcile(fix=False):
+    """
+    [(product_id, ledger balance, on-hand stock), ...] for every product
+    where they differ. With `fix`, an adjustment brings the ledger in line
+    with the stock.
+    """
+    stock = on_hand()
+    balances = ledger_balances()
+    mismatches = [(pk, balances.get(pk, 0), quantity) for pk, quantity in stock.items() if balances.get(pk, 0) != quantity]
+    if fix:
+        record_movements((pk, ADJUSTMENT, quantity - balance, None, 'reconcile') for pk, balance, quantity in mismatches)
+    return mismatches
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from apps.products.snapshot import build_snapshot
+
+class Command(BaseCommand):
+    help = 'Writes the compressed NDJSON catalog snapshot and its manifest for static builds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild from scratch instead of from the previous snapshot')
+
+    def handle(self, *args, **options):
+        manifest = build_snapshot(full=options['full'])
+        kind = 'incremental' if manifest['incremental'] else 'full'
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {kind} snapshot: {manifest['products']} products, {manifest['categories']} categories, "
+            f"{manifest['files']['gzip']['bytes']} bytes gzip ({manifest['sha256'][:16]})"
+        ))
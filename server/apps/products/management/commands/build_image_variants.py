@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from castle_core.image_variants import TARGETS, build_variants, pending_jobs
+
+class Command(BaseCommand):
+    help = 'Builds resized image variants (srcset) for product, gallery and banner images that lack them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: one per CPU)')
+        parser.add_argument('--only', choices=sorted(TARGETS), action='append', help='Limit to these image kinds')
+        parser.add_argument('--force', action='store_true', help='Rebuild even up-to-date manifests')
+        parser.add_argument('--queued', action='store_true', help='Only images queued by saves and imports (no full scan)')
+        parser.add_argument('--interval', type=float, default=0, help='Keep running, checking for work every this many seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            for target in options['only'] or TARGETS:
+                # Collected up front: manifests are written while the pool runs
+                jobs = list(pending_jobs(target, force=options['force'], queued=options['queued']))
+                if not jobs:
+                    if not options['interval']:
+                        self.stdout.write(f'{target}: up to date')
+                    continue
+                built, failed = build_variants(jobs, workers=options['workers'])
+                style = self.style.SUCCESS if not failed else self.style.WARNING
+                self.stdout.write(style(f'{target}: {built} built, {failed} failed'))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
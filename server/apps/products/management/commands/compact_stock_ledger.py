@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from apps.products.inventory import compact_ledger
+
+class Command(BaseCommand):
+    help = 'Folds new inventory movements into the stock checkpoints and refreshes hot product stock totals'
+
+    def handle(self, *args, **options):
+        moved = compact_ledger()
+        self.stdout.write(self.style.SUCCESS(f'Compacted the ledger of {moved} products'))
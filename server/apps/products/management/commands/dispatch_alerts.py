@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from apps.products.alerts import dispatch_alerts
+
+class Command(BaseCommand):
+    help = 'Sends wishlist price-drop, sale and back-in-stock alerts that have waited out ALERT_COALESCE_SECONDS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-email', action='store_true', help='Create notifications only')
+
+    def handle(self, *args, **options):
+        result = dispatch_alerts(send_emails=not options['no_email'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['alerts']} alerts: {result['notifications']} notifications, {result['emails']} emails"
+        ))
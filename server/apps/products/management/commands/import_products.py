@@ -0,0 +1,35 @@
+import io
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from apps.products.importer import BATCH_SIZE, guess_format, import_catalog
+
+class Command(BaseCommand):
+    help = 'Upserts products (by slug) from a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or - for stdin')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or guess_format(path)
+
+        if path == '-':
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='')
+            result = import_catalog(stream, format, options['batch_size'])
+        else:
+            try:
+                with open(path, encoding='utf-8-sig', newline='') as stream:
+                    result = import_catalog(stream, format, options['batch_size'])
+            except OSError as exc:
+                raise CommandError(exc)
+
+        for error in result['errors']:
+            self.stderr.write(f"line {error['line']} ({error['slug'] or '-'}): {error['error']}")
+        if result['error_count'] > len(result['errors']):
+            self.stderr.write(f"... and {result['error_count'] - len(result['errors'])} more errors")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {result['created']}, updated {result['updated']}, {result['error_count']} rows with errors"
+        ))
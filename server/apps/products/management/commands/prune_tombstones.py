@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from apps.products.changes import prune_tombstones
+
+class Command(BaseCommand):
+    help = 'Deletes delta-sync tombstones older than CHANGES_TOMBSTONE_DAYS'
+
+    def handle(self, *args, **options):
+        deleted = prune_tombstones()
+        self.stdout.write(self.style.SUCCESS(f'Pruned {deleted} tombstones'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from apps.products.copurchase import FLUSH_PAIRS, rebuild_copurchases
+
+class Command(BaseCommand):
+    help = 'Recounts the "frequently bought together" index from all order lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--flush-pairs', type=int, default=FLUSH_PAIRS,
+                            help='Distinct pairs held in memory before writing them out')
+
+    def handle(self, *args, **options):
+        orders, pairs = rebuild_copurchases(flush_pairs=options['flush_pairs'])
+        self.stdout.write(self.style.SUCCESS(f'Counted {pairs} product pairs from {orders} orders'))
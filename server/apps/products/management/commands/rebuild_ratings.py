@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from apps.products.ratings import rebuild_rating_aggregates
+
+class Command(BaseCommand):
+    help = 'Rebuilds the stored rating aggregates on products from their reviews'
+
+    def handle(self, *args, **options):
+        changed = rebuild_rating_aggregates()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating aggregates, {changed} products changed'))
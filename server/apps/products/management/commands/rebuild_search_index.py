@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from apps.products.search import rebuild_index
+
+class Command(BaseCommand):
+    help = 'Rebuilds the product full-text search index'
+
+    def handle(self, *args, **options):
+        count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} products'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from apps.products.inventory import reconcile
+from apps.products.models import Product
+
+class Command(BaseCommand):
+    help = 'Checks every product\'s inventory ledger balance against its stock'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Record adjustments bringing the ledger in line with stock')
+
+    def handle(self, *args, **options):
+        mismatches = reconcile(fix=options['fix'])
+        names = dict(Product.objects.filter(pk__in=[pk for pk, _, _ in mismatches]).values_list('pk', 'slug'))
+        for pk, balance, stock in mismatches:
+            self.stdout.write(self.style.WARNING(f'{names.get(pk, pk)}: ledger {balance}, stock {stock}'))
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('Ledger matches stock for every product'))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(f'Recorded adjustments for {len(mismatches)} products'))
+        else:
+            self.stdout.write(self.style.ERROR(f'{len(mismatches)} products differ (use --fix to record adjustments)'))
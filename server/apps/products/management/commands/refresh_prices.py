@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from apps.products.pricing import recompute_effective_prices, refresh_stale_prices
+
+class Command(BaseCommand):
+    help = 'Recomputes materialized effective prices for campaign windows that opened or closed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Recompute the whole catalog instead of only stale rows')
+
+    def handle(self, *args, **options):
+        if options['all']:
+            changed = recompute_effective_prices()
+        else:
+            changed = refresh_stale_prices()
+
+        self.stdout.write(self.style.SUCCESS(f'Updated effective price for {len(changed)} products'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from apps.products.inventory import set_shards
+from apps.products.models import Product
+
+class Command(BaseCommand):
+    help = 'Splits a hot product\'s stock over N shards for checkout (0 folds them back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('slug', type=str)
+        parser.add_argument('shards', type=int)
+
+    def handle(self, *args, **options):
+        if not 0 <= options['shards'] <= 64:
+            raise CommandError('shards must be between 0 and 64')
+        try:
+            product = Product.objects.get(slug=options['slug'])
+        except Product.DoesNotExist:
+            raise CommandError(f"No product with slug {options['slug']}")
+        total = set_shards(product, options['shards'])
+        self.stdout.write(self.style.SUCCESS(f"{product.slug}: {total} in stock over {options['shards']} shards"))
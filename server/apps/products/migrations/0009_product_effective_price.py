@@ -0,0 +1,38 @@
+from django.db import migrations, models
+from django.db.models import F
+from django.utils import timezone
+
+
+def populate_effective_price(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+
+    Product.objects.filter(discount_price__isnull=False).update(effective_price=F('discount_price'))
+    Product.objects.filter(discount_price__isnull=True).update(effective_price=F('price'))
+    # Mark every row stale so campaign discounts are applied on the first refresh
+    Product.objects.update(price_valid_until=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_product_sku'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='price_valid_until',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, help_text='Next campaign start/end affecting this price', null=True),
+        ),
+        migrations.RunPython(populate_effective_price, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='effective_price',
+            field=models.DecimalField(db_index=True, decimal_places=2, editable=False, max_digits=10),
+        ),
+    ]
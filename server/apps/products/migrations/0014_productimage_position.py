@@ -0,0 +1,42 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:40
+
+from django.db import migrations, models
+
+
+def number_existing_images(apps, schema_editor):
+    ProductImage = apps.get_model('products', 'ProductImage')
+
+    # Keep the current (insertion) order as the gallery order
+    changed = []
+    last_product, position = None, 0
+    for image in ProductImage.objects.order_by('product_id', 'created_at').only('id', 'product_id'):
+        position = position + 1 if image.product_id == last_product else 0
+        last_product = image.product_id
+        if position:
+            image.position = position
+            changed.append(image)
+    ProductImage.objects.bulk_update(changed, ['position'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0013_category_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='productimage',
+            options={'ordering': ['position', 'created_at']},
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='position',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(number_existing_images, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='productimage',
+            index=models.Index(fields=['product', 'position'], name='productimage_position_idx'),
+        ),
+    ]
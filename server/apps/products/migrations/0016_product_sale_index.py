@@ -0,0 +1,43 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F
+from django.utils import timezone
+
+
+def expire_discounted_prices(apps, schema_editor):
+    # The sale columns are filled in by the next stale-price refresh
+    Product = apps.get_model('products', 'Product')
+    Product.objects.filter(effective_price__lt=F('price')).update(price_valid_until=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0006_campaignbanner_updated_at'),
+        ('products', '0015_productcopurchase'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='discount_campaign',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='campaigns.campaign'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='discount_percent',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=5),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='discount_source',
+            field=models.CharField(blank=True, choices=[('static', 'Discount price'), ('campaign', 'Campaign')], editable=False, max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['discount_percent', 'id'], name='product_discount_id_idx'),
+        ),
+        migrations.RunPython(expire_discounted_prices, migrations.RunPython.noop),
+    ]
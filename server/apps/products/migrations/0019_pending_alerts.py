@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:59
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0018_delta_sync'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('price_drop', 'Price Drop Alert'), ('back_in_stock', 'Back in Stock'), ('wishlist_sale', 'Wishlist Item on Sale')], max_length=20)),
+                ('baseline_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('detected_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pending_alerts', to='products.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('product', 'kind'), name='unique_pending_alert')],
+            },
+        ),
+    ]
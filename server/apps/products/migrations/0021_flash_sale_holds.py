@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 08:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0020_inventory_ledger'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stockmovement',
+            name='kind',
+            field=models.CharField(choices=[('sale', 'Sale'), ('cancel', 'Order Cancelled'), ('restock', 'Restock'), ('adjustment', 'Adjustment'), ('hold', 'Flash Sale Hold'), ('release', 'Hold Released')], max_length=20),
+        ),
+    ]
@@ -1,16 +1,45 @@
 from django.db import models
+from django.utils import timezone
 import uuid
 from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.contrib.postgres.search import SearchVectorField
+from .pricing import PRICE_STATE_FIELDS, PRICING_FIELDS, apply_effective_price
+from .alerts import alert_state_of
+
+def random_sku():
+    import random
+    import string
+    # Generate a random SKU like 'SKU-1A2B3C4D'
+    return "SKU-" + ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+
+
+def allocate_skus(count, exclude=()):
+    """
+    `count` unused SKUs, checked against the table with one query per round
+    (collisions are rare, so usually a single round).
+    """
+    skus = set()
+    taken = set(exclude)
+    while len(skus) < count:
+        candidates = {random_sku() for _ in range(count - len(skus))} - skus - taken
+        taken |= set(Product.objects.filter(sku__in=candidates).values_list('sku', flat=True))
+        skus |= candidates - taken
+    return list(skus)
+
 
 class Category(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=255)
     slug = models.SlugField(unique=True)
     image = models.CharField(max_length=500, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name_plural = 'Categories'
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='category_updated_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -23,8 +52,19 @@ class Product(models.Model):
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     discount_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    # Materialized price customers pay: discount_price/price or the best running campaign
+    effective_price = models.DecimalField(max_digits=10, decimal_places=2, editable=False, db_index=True)
+    price_valid_until = models.DateTimeField(blank=True, null=True, editable=False, db_index=True, help_text="Next campaign start/end affecting this price")
+    # Sale index, maintained with effective_price: 0 when not discounted
+    discount_percent = models.DecimalField(max_digits=5, decimal_places=2, default=0, editable=False)
+    discount_source = models.CharField(max_length=10, blank=True, editable=False, choices=(('static', 'Discount price'), ('campaign', 'Campaign')))
+    discount_campaign = models.ForeignKey('campaigns.Campaign', null=True, blank=True, editable=False, on_delete=models.SET_NULL, related_name='+')
     stock_quantity = models.IntegerField(default=0)
+    # Hot products keep their stock in this many StockShard rows (inventory.py); 0 = in stock_quantity
+    stock_shards = models.PositiveSmallIntegerField(default=0, editable=False)
     image_main = models.CharField(max_length=500)
+    # Resized copies of image_main (castle_core.image_variants)
+    image_main_variants = models.JSONField(default=dict, blank=True, editable=False)
     is_active = models.BooleanField(default=True)
     allow_pod = models.BooleanField(default=True, help_text="Allow Payment on Delivery")
     options = models.JSONField(default=list, blank=True, help_text="List of product options (e.g. Size, Color)")
@@ -34,37 +74,77 @@ class Product(models.Model):
     def __str__(self):
         return self.name
 
+    # Rating aggregates, maintained incrementally from Review saves/deletes
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_average = models.FloatField(default=0, editable=False, db_index=True)
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False)
+
     @property
     def average_rating(self):
-        reviews = self.reviews.all()
-        if reviews.exists():
-            return round(reviews.aggregate(models.Avg('rating'))['rating__avg'], 1)
-        return 0
+        return round(self.rating_average, 1)
 
-    review_count = property(lambda self: self.reviews.count())
+    review_count = property(lambda self: self.rating_count)
+
+    @property
+    def rating_histogram(self):
+        return {str(star): getattr(self, f'rating_{star}_count') for star in range(1, 6)}
 
     sku = models.CharField(max_length=50, unique=True, blank=True, null=True)
 
+    # Weighted name/description tsvector on PostgreSQL (GIN indexed in migration 0011);
+    # SQLite uses the products_product_fts FTS5 table instead. See search.py.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        # Composite keys for keyset pagination (castle_core.pagination) and delta sync (changes.py)
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='product_created_id_idx'),
+            models.Index(fields=['updated_at', 'id'], name='product_updated_id_idx'),
+            models.Index(fields=['effective_price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['discount_percent', 'id'], name='product_discount_id_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.sku:
-            import random
-            import string
-            while True:
-                # Generate a random SKU like 'SKU-123456'
-                random_string = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-                new_sku = f"SKU-{random_string}"
-                if not Product.objects.filter(sku=new_sku).exists():
-                    self.sku = new_sku
-                    break
+            self.sku = allocate_skus(1)[0]
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or PRICING_FIELDS.intersection(update_fields):
+            apply_effective_price(self)
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | set(PRICE_STATE_FIELDS)
         super().save(*args, **kwargs)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What wishlist alerts compare a save against (alerts.py); deferred fields stay None
+        instance._loaded_alert_state = alert_state_of(instance)
+        # Edits to stock_quantity are recorded in the inventory ledger (inventory.py)
+        instance._loaded_stock = instance.__dict__.get('stock_quantity')
+        return instance
+
 
 class ProductImage(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     product = models.ForeignKey(Product, related_name='images', on_delete=models.CASCADE)
     image = models.CharField(max_length=500)
+    variants = models.JSONField(default=dict, blank=True, editable=False)
+    # Gallery order; reordering only rewrites this column (see images.sync_images)
+    position = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        ordering = ['position', 'created_at']
+        indexes = [
+            models.Index(fields=['product', 'position'], name='productimage_position_idx'),
+        ]
+
     def __str__(self):
         return f"Image for {self.product.name}"
 
@@ -90,6 +170,140 @@ class Review(models.Model):
 
     class Meta:
         unique_together = ('user', 'product') # One review per product per user
+        indexes = [
+            models.Index(fields=['product', 'created_at', 'id'], name='review_product_created_id_idx'),
+            models.Index(fields=['created_at', 'id'], name='review_created_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user}'s review on {self.product}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what the product aggregates currently count for this review
+        instance._loaded_rating = (instance.__dict__.get('product_id'), instance.__dict__.get('rating'))
+        return instance
+
+
+class ProductCoPurchase(models.Model):
+    """
+    How many orders contained both `product` and `related`. Stored in both
+    directions so "bought together with X" is one index range scan on
+    (product, -count). Maintained by copurchase.py.
+    """
+    product = models.ForeignKey(Product, related_name='copurchases', on_delete=models.CASCADE)
+    related = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'related'], name='unique_copurchase_pair'),
+        ]
+        indexes = [
+            models.Index(fields=['product', '-count'], name='copurchase_product_count_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} + {self.related_id} ({self.count})"
+
+
+class Tombstone(models.Model):
+    """A deleted catalog row, kept for delta sync (changes.py) until pruned."""
+    kind = models.CharField(max_length=20)
+    object_id = models.UUIDField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['deleted_at', 'id'], name='tombstone_deleted_id_idx'),
+        ]
+
+
+class PendingAlert(models.Model):
+    """
+    A wishlist alert waiting to be sent (alerts.py). One row per product and
+    kind: further changes within the coalescing window fold into it, keeping
+    the price from before the first one as the baseline.
+    """
+    KIND_CHOICES = (
+        ('price_drop', 'Price Drop Alert'),
+        ('back_in_stock', 'Back in Stock'),
+        ('wishlist_sale', 'Wishlist Item on Sale'),
+    )
+
+    product = models.ForeignKey(Product, related_name='pending_alerts', on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    baseline_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    detected_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'kind'], name='unique_pending_alert'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} for {self.product_id}"
+
+
+class StockMovement(models.Model):
+    """
+    One entry of the append-only inventory ledger (inventory.py). `quantity`
+    is signed: negative for sales, positive for cancellations and restocks.
+    """
+    KIND_CHOICES = (
+        ('sale', 'Sale'),
+        ('cancel', 'Order Cancelled'),
+        ('restock', 'Restock'),
+        ('adjustment', 'Adjustment'),
+        ('hold', 'Flash Sale Hold'),
+        ('release', 'Hold Released'),
+    )
+
+    product = models.ForeignKey(Product, related_name='stock_movements', on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    quantity = models.IntegerField()
+    # The order behind a sale or cancellation (no FK: orders depend on products)
+    order_id = models.UUIDField(null=True, blank=True)
+    note = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'id'], name='stockmovement_product_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.quantity:+d} of {self.product_id}"
+
+
+class StockCheckpoint(models.Model):
+    """
+    A product's ledger balance through `last_movement_id`, so the balance is
+    this plus the (few) newer movements. Advanced by inventory.compact_ledger.
+    """
+    product = models.OneToOneField(Product, primary_key=True, related_name='stock_checkpoint', on_delete=models.CASCADE)
+    quantity = models.IntegerField(default=0)
+    last_movement_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.product_id}: {self.quantity} through #{self.last_movement_id}"
+
+
+class StockShard(models.Model):
+    """
+    Part of a hot product's stock. Checkout takes from one shard at a time, so
+    concurrent buyers of the same product wait on different rows.
+    """
+    product = models.ForeignKey(Product, related_name='stock_shard_rows', on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField()
+    quantity = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'shard'], name='unique_stock_shard'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}[{self.shard}] = {self.quantity}"
@@ -0,0 +1,193 @@
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+from django.utils import timezone
+
+TWO_PLACES = Decimal('0.01')
+BATCH_SIZE = 500
+
+# Fields whose change can move a product's effective price
+PRICING_FIELDS = {'price', 'discount_price', 'category', 'category_id'}
+
+# Materialized from the above plus campaigns; the last three are the sale index
+# (how deep the discount is and where it comes from) behind on_sale and deals
+PriceState = namedtuple('PriceState', [
+    'effective_price', 'price_valid_until', 'discount_percent', 'discount_source', 'discount_campaign_id',
+])
+PRICE_STATE_FIELDS = list(PriceState._fields)
+
+SOURCE_STATIC = 'static'
+SOURCE_CAMPAIGN = 'campaign'
+
+
+def _to_decimal(value):
+    if value is None or isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+def load_campaign_index(now, product_ids=None):
+    """
+    Campaigns that can affect prices from `now` onwards (running or scheduled),
+    plus the member product ids of manual campaigns.
+    """
+    from apps.campaigns.models import Campaign
+
+    campaigns = list(
+        Campaign.objects.filter(
+            is_active=True,
+            end_time__gte=now,
+            discount_percentage__gt=0,
+        ).only('id', 'start_time', 'end_time', 'product_selection_type', 'target_category_id', 'discount_percentage')
+    )
+
+    members = {}
+    manual_ids = [c.id for c in campaigns if c.product_selection_type == 'manual']
+    if manual_ids:
+        through = Campaign.products.through.objects.filter(campaign_id__in=manual_ids)
+        if product_ids is not None:
+            through = through.filter(product_id__in=product_ids)
+        for campaign_id, product_id in through.values_list('campaign_id', 'product_id'):
+            members.setdefault(campaign_id, set()).add(product_id)
+
+    return campaigns, members
+
+
+def campaign_targets(campaign, product, members):
+    if campaign.product_selection_type == 'all':
+        return True
+    if campaign.product_selection_type == 'category':
+        return product.category_id == campaign.target_category_id
+    if campaign.product_selection_type == 'manual':
+        return product.pk in members.get(campaign.id, ())
+    return False
+
+
+def compute_effective_price(product, campaigns, members, now):
+    """
+    Returns the PriceState for a product.
+
+    The effective price is the static discount_price (or price) unless a running
+    campaign gives a lower price. valid_until is the next campaign start/end that
+    touches this product, i.e. the moment the stored price must be recomputed.
+    discount_percent is effective_price's discount off the list price.
+    """
+    price = _to_decimal(product.price)
+    discount_price = _to_decimal(product.discount_price)
+    effective = discount_price if discount_price is not None else price
+
+    best_discount = Decimal('0')
+    best_campaign = None
+    valid_until = None
+    for campaign in campaigns:
+        if not campaign_targets(campaign, product, members):
+            continue
+        if campaign.start_time > now:
+            boundary = campaign.start_time
+        else:
+            boundary = campaign.end_time
+            discount = _to_decimal(campaign.discount_percentage)
+            if discount > best_discount:
+                best_discount, best_campaign = discount, campaign
+        if valid_until is None or boundary < valid_until:
+            valid_until = boundary
+
+    source, campaign_id = (SOURCE_STATIC, None) if discount_price is not None else ('', None)
+    if best_discount > 0:
+        campaign_price = (price * (100 - best_discount) / 100).quantize(TWO_PLACES, rounding=ROUND_HALF_UP)
+        if campaign_price < effective:
+            effective = campaign_price
+            source, campaign_id = SOURCE_CAMPAIGN, best_campaign.pk
+
+    effective = effective.quantize(TWO_PLACES, rounding=ROUND_HALF_UP)
+    if price and effective < price:
+        percent = ((price - effective) * 100 / price).quantize(TWO_PLACES, rounding=ROUND_HALF_UP)
+    else:
+        percent, source, campaign_id = Decimal('0.00'), '', None
+    return PriceState(effective, valid_until, percent, source, campaign_id)
+
+
+def apply_effective_price(product, now=None):
+    """Sets the PRICE_STATE_FIELDS on an instance about to be saved."""
+    now = now or timezone.now()
+    campaigns, members = load_campaign_index(now, product_ids=[product.pk])
+    set_price_state(product, compute_effective_price(product, campaigns, members, now))
+
+
+def set_price_state(product, state):
+    for field, value in zip(PRICE_STATE_FIELDS, state):
+        setattr(product, field, value)
+
+
+def price_state_of(product):
+    return PriceState(*(getattr(product, field) for field in PRICE_STATE_FIELDS))
+
+
+def recompute_effective_prices(product_ids=None, now=None):
+    """
+    Recomputes the stored effective price for the given products (or the whole
+    catalog) and writes only the rows that changed. Returns the changed ids.
+    """
+    from .alerts import alert_state_of, queue_alerts
+    from .models import Product
+
+    now = now or timezone.now()
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        if not product_ids:
+            return []
+
+    campaigns, members = load_campaign_index(now, product_ids)
+
+    queryset = Product.objects.only('id', 'category_id', 'price', 'discount_price', *PRICE_STATE_FIELDS)
+    if product_ids is not None:
+        queryset = queryset.filter(pk__in=product_ids)
+
+    changed, alert_changes = [], []
+    for product in queryset.iterator(chunk_size=BATCH_SIZE):
+        state = compute_effective_price(product, campaigns, members, now)
+        if state != price_state_of(product):
+            before = alert_state_of(product)
+            set_price_state(product, state)
+            product.updated_at = now
+            changed.append(product)
+            alert_changes.append((product.pk, before, alert_state_of(product)))
+
+    # Written after the read loop: SQLite gives no isolation between a running
+    # iterator and writes on the same connection.
+    if changed:
+        from castle_core.response_cache import invalidate_products
+
+        Product.objects.bulk_update(
+            changed, PRICE_STATE_FIELDS + ['updated_at'], batch_size=BATCH_SIZE
+        )
+        # bulk_update sends no post_save, so cached responses are dropped and alerts queued here
+        invalidate_products([product.pk for product in changed])
+        queue_alerts(alert_changes)
+    return [product.pk for product in changed]
+
+
+def refresh_stale_prices(now=None):
+    """
+    Recomputes products whose campaign window opened or closed since their
+    price was stored. A single indexed query when nothing is stale.
+    """
+    from .models import Product
+
+    now = now or timezone.now()
+    stale_ids = list(Product.objects.filter(price_valid_until__lte=now).values_list('pk', flat=True))
+    if not stale_ids:
+        return []
+    return recompute_effective_prices(stale_ids, now=now)
+
+
+def refresh_prices_for_request(request):
+    """
+    `refresh_stale_prices` at most once per request, however many views,
+    querysets and nested product serializers the request goes through.
+    Afterwards every stored effective_price is current and serializers can
+    read it straight off the rows.
+    """
+    request = getattr(request, '_request', request)
+    if not getattr(request, '_prices_refreshed', False):
+        refresh_stale_prices()
+        request._prices_refreshed = True
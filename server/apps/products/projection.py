@@ -0,0 +1,72 @@
+from rest_framework.permissions import SAFE_METHODS
+
+
+def parse_csv_param(request, name):
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    return [part.strip() for part in value.split(',') if part.strip()]
+
+
+class DynamicFieldsMixin:
+    """
+    Serializer mixin for ?fields= / ?expand= projection.
+
+    `fields` keeps only the named fields. `expandable_fields` maps a relation
+    name to a factory for its nested serializer; those relations are only
+    added (and therefore only queried) when named in `expand`.
+    """
+    expandable_fields = {}
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        expand = set(kwargs.pop('expand', None) or ())
+        super().__init__(*args, **kwargs)
+
+        for name in expand.intersection(self.expandable_fields):
+            self.fields[name] = self.expandable_fields[name]()
+
+        if fields:
+            keep = set(fields) | expand
+            for name in set(self.fields) - keep:
+                self.fields.pop(name)
+
+
+class ProjectionViewMixin:
+    """
+    ViewSet mixin passing ?fields= / ?expand= to the serializer on reads.
+    `select_related_for` / `prefetch_related_for` map a relation to the lookups
+    to load when (and only when) that relation is going to be serialized.
+    """
+    select_related_for = {}
+    prefetch_related_for = {}
+
+    def get_projection(self):
+        if self.request is None or self.request.method not in SAFE_METHODS:
+            return None, None
+        return parse_csv_param(self.request, 'fields'), parse_csv_param(self.request, 'expand')
+
+    def get_serializer(self, *args, **kwargs):
+        fields, expand = self.get_projection()
+        if fields:
+            kwargs.setdefault('fields', fields)
+        if expand:
+            kwargs.setdefault('expand', expand)
+        return super().get_serializer(*args, **kwargs)
+
+    def get_serialized_relations(self, default=()):
+        """Relations the response will contain: `default` plus ?expand=, narrowed by ?fields=."""
+        fields, expand = self.get_projection()
+        expand = set(expand or ())
+        relations = set(default) | expand
+        if fields:
+            relations &= set(fields) | expand
+        return relations
+
+    def with_relations(self, queryset, relations):
+        for name in relations:
+            if name in self.select_related_for:
+                queryset = queryset.select_related(*self.select_related_for[name])
+            if name in self.prefetch_related_for:
+                queryset = queryset.prefetch_related(*self.prefetch_related_for[name])
+        return queryset
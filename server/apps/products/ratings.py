@@ -0,0 +1,89 @@
+from django.db.models import Case, Count, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+STARS = range(1, 6)
+BATCH_SIZE = 500
+
+
+def _star_field(rating):
+    return f'rating_{rating}_count'
+
+
+def apply_rating_change(product_id, old_rating=None, new_rating=None):
+    """
+    Moves one review's contribution on the product aggregates in a single
+    UPDATE. old_rating=None means a new review, new_rating=None a deletion.
+    """
+    from .models import Product
+
+    if old_rating == new_rating:
+        return
+
+    sum_delta = (new_rating or 0) - (old_rating or 0)
+    count_delta = (new_rating is not None) - (old_rating is not None)
+
+    updates = {
+        'rating_sum': F('rating_sum') + sum_delta,
+        'rating_count': F('rating_count') + count_delta,
+        # SET expressions see the pre-update row, so the average uses the new totals
+        'rating_average': Case(
+            When(
+                rating_count__gt=-count_delta,
+                then=Cast(F('rating_sum') + sum_delta, FloatField()) / (F('rating_count') + count_delta),
+            ),
+            default=Value(0.0),
+            output_field=FloatField(),
+        ),
+        'updated_at': timezone.now(),
+    }
+    if old_rating is not None:
+        updates[_star_field(old_rating)] = F(_star_field(old_rating)) - 1
+    if new_rating is not None:
+        updates[_star_field(new_rating)] = F(_star_field(new_rating)) + 1
+
+    Product.objects.filter(pk=product_id).update(**updates)
+
+
+def rebuild_rating_aggregates(product_ids=None):
+    """Recounts aggregates from the Review table. Returns the number of products changed."""
+    from .models import Product, Review
+
+    reviews = Review.objects.all()
+    products = Product.objects.only(
+        'id', 'rating_count', 'rating_sum', 'rating_average', *[_star_field(star) for star in STARS]
+    )
+    if product_ids is not None:
+        reviews = reviews.filter(product_id__in=product_ids)
+        products = products.filter(pk__in=product_ids)
+
+    totals = {
+        row['product_id']: row
+        for row in reviews.values('product_id').annotate(
+            count=Count('id'),
+            total=Sum('rating'),
+            **{f'star_{star}': Count('id', filter=Q(rating=star)) for star in STARS}
+        )
+    }
+
+    now = timezone.now()
+    fields = ['rating_count', 'rating_sum', 'rating_average', 'updated_at'] + [_star_field(star) for star in STARS]
+    changed = []
+    for product in products.iterator(chunk_size=BATCH_SIZE):
+        row = totals.get(product.pk, {})
+        values = {
+            'rating_count': row.get('count', 0),
+            'rating_sum': row.get('total') or 0,
+            **{_star_field(star): row.get(f'star_{star}', 0) for star in STARS},
+        }
+        values['rating_average'] = values['rating_sum'] / values['rating_count'] if values['rating_count'] else 0
+
+        if any(getattr(product, field) != value for field, value in values.items()):
+            for field, value in values.items():
+                setattr(product, field, value)
+            product.updated_at = now
+            changed.append(product)
+
+    if changed:
+        Product.objects.bulk_update(changed, fields, batch_size=BATCH_SIZE)
+    return len(changed)
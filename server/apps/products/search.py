@@ -0,0 +1,153 @@
+"""
+Ranked product search.
+
+Production (PostgreSQL) keeps a weighted tsvector in Product.search_vector
+with a GIN index, plus a pg_trgm index on name for typo tolerance. Local
+SQLite keeps an FTS5 table (products_product_fts) ranked with bm25. Both are
+updated per product on save and queried through ProductSearchFilter.
+"""
+import re
+import uuid
+from django.db import connections
+from django.db.models import F, Q
+from rest_framework.filters import BaseFilterBackend
+
+FTS_TABLE = 'products_product_fts'
+SEARCH_CONFIG = 'english'
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+TRIGRAM_THRESHOLD = 0.3
+MAX_TERMS = 8
+
+INDEXED_FIELDS = {'name', 'description'}
+
+
+def tokenize(value):
+    # Only word characters reach tsquery/FTS5 syntax, so user input cannot inject operators
+    return re.findall(r'\w+', value.lower())[:MAX_TERMS]
+
+
+def _vendor(using='default'):
+    return connections[using].vendor
+
+
+def _search_vector():
+    from django.contrib.postgres.search import SearchVector
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='B', config=SEARCH_CONFIG)
+    )
+
+
+def index_products(product_ids, using='default'):
+    """(Re)indexes the given products."""
+    from .models import Product
+
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+
+    vendor = _vendor(using)
+    if vendor == 'postgresql':
+        Product.objects.using(using).filter(pk__in=product_ids).update(search_vector=_search_vector())
+    elif vendor == 'sqlite':
+        rows = Product.objects.using(using).filter(pk__in=product_ids).values_list('pk', 'name', 'description')
+        with connections[using].cursor() as cursor:
+            _delete_sqlite_rows(cursor, product_ids)
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (product_id, name, description) VALUES (%s, %s, %s)',
+                [(pk.hex, name, description) for pk, name, description in rows]
+            )
+
+
+def remove_products(product_ids, using='default'):
+    # tsvector rows disappear with the product; only the FTS5 table needs cleanup
+    if _vendor(using) == 'sqlite':
+        with connections[using].cursor() as cursor:
+            _delete_sqlite_rows(cursor, list(product_ids))
+
+
+def _delete_sqlite_rows(cursor, product_ids, batch_size=500):
+    # product_id is UNINDEXED, so each statement scans the table: batch the ids
+    hex_ids = [uuid.UUID(str(pk)).hex for pk in product_ids]
+    for start in range(0, len(hex_ids), batch_size):
+        batch = hex_ids[start:start + batch_size]
+        cursor.execute(
+            f"DELETE FROM {FTS_TABLE} WHERE product_id IN ({', '.join(['%s'] * len(batch))})",
+            batch
+        )
+
+
+def rebuild_index(using='default', batch_size=1000):
+    from .models import Product
+
+    vendor = _vendor(using)
+    if vendor == 'sqlite':
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+
+    ids = list(Product.objects.using(using).values_list('pk', flat=True))
+    for start in range(0, len(ids), batch_size):
+        index_products(ids[start:start + batch_size], using=using)
+    return len(ids)
+
+
+def search_products(queryset, value):
+    """Filters `queryset` to matches for `value`, annotated with search_rank (higher is better)."""
+    terms = tokenize(value)
+    if not terms:
+        return queryset
+
+    vendor = _vendor(queryset.db)
+    if vendor == 'postgresql':
+        return _search_postgres(queryset, value, terms)
+    if vendor == 'sqlite':
+        return _search_sqlite(queryset, terms)
+    return queryset.filter(Q(name__icontains=value) | Q(description__icontains=value))
+
+
+def _search_postgres(queryset, value, terms):
+    from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+
+    # Every term as a prefix match: "chaf dish" -> chaf:* & dish:*
+    query = SearchQuery(' & '.join(f'{term}:*' for term in terms), search_type='raw', config=SEARCH_CONFIG)
+    # Both conditions are indexable (GIN tsvector, gin_trgm `%`), so Postgres can OR two bitmap scans.
+    # `%` uses pg_trgm.similarity_threshold, whose default is TRIGRAM_THRESHOLD; similarity() is only
+    # computed for the rows that match, to rank them
+    return (
+        queryset
+        .filter(Q(search_vector=query) | Q(name__trigram_similar=value))
+        .annotate(
+            search_rank=SearchRank(F('search_vector'), query, weights=[0.0, 0.0, DESCRIPTION_WEIGHT / NAME_WEIGHT, 1.0])
+            + TrigramSimilarity('name', value),
+        )
+        .order_by('-search_rank', '-created_at')
+    )
+
+
+def _search_sqlite(queryset, terms):
+    # The FTS table is joined into the query, so the view's other filters apply to every match
+    # (nothing is capped before them) and bm25 ranks what is left
+    match = ' '.join(f'"{term}"*' for term in terms)
+    product_table = queryset.model._meta.db_table
+    return queryset.extra(
+        tables=[FTS_TABLE],
+        where=[f'{FTS_TABLE}.product_id = {product_table}.id', f'{FTS_TABLE} MATCH %s'],
+        params=[match],
+        select={'search_rank': f'-bm25({FTS_TABLE}, 0.0, %s, %s)'},
+        select_params=[NAME_WEIGHT, DESCRIPTION_WEIGHT],
+    ).order_by('-search_rank')
+
+
+class ProductSearchFilter(BaseFilterBackend):
+    """
+    Replaces SearchFilter's icontains scan with the ranked index above.
+    Uses the same ?search= parameter; an explicit ?ordering= still wins.
+    """
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        value = request.query_params.get(self.search_param, '').strip()
+        if not value:
+            return queryset
+        return search_products(queryset, value)
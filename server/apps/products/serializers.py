@@ -1,15 +1,26 @@
 from rest_framework import serializers
 from .models import Product, Category, Wishlist, ProductImage, Review
+from .projection import DynamicFieldsMixin
+from .images import sync_images
+from castle_core.image_variants import srcsets
 
 class CategorySerializer(serializers.ModelSerializer):
+    # Active products; only present where the queryset annotates it (category endpoints)
+    product_count = serializers.IntegerField(read_only=True)
+
     class Meta:
         model = Category
         fields = '__all__'
 
 class ProductImageSerializer(serializers.ModelSerializer):
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = ProductImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'srcset', 'position']
+
+    def get_srcset(self, obj):
+        return srcsets(obj.variants, obj.image)
 
 class ReviewSerializer(serializers.ModelSerializer):
     user = serializers.StringRelatedField(read_only=True)
@@ -43,7 +54,53 @@ class ReviewSerializer(serializers.ModelSerializer):
         validated_data['user'] = user
         return super().create(validated_data)
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductListSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """
+    Compact product card for grids, carousels, wishlists and order lines.
+    category/images/reviews are only included with ?expand=.
+    """
+    category_id = serializers.UUIDField(read_only=True)
+    average_rating = serializers.FloatField(read_only=True)
+    review_count = serializers.IntegerField(read_only=True)
+    # {format: "url 320w, url 640w, ..."} once variants exist, else null
+    image_srcset = serializers.SerializerMethodField()
+
+    expandable_fields = {
+        'category': lambda: CategorySerializer(read_only=True),
+        'images': lambda: ProductImageSerializer(many=True, read_only=True),
+        'reviews': lambda: ReviewSerializer(many=True, read_only=True),
+    }
+
+    class Meta:
+        model = Product
+        fields = ['id', 'category_id', 'name', 'slug', 'price', 'discount_price', 'effective_price',
+                  'discount_percent', 'discount_source', 'stock_quantity', 'image_main', 'image_srcset',
+                  'is_active', 'allow_pod', 'created_at',
+                  'average_rating', 'review_count', 'options', 'sku']
+
+    def get_image_srcset(self, obj):
+        return srcsets(obj.image_main_variants, obj.image_main)
+
+    def to_representation(self, instance):
+        ret = super().to_representation(instance)
+
+        # For admin editing, ?raw=true shows the stored discount_price untouched
+        if self.context.get('raw_pricing') or 'discount_price' not in ret:
+            return ret
+
+        # discount_price is what the storefront shows as the sale price: the
+        # materialized effective price whenever it differs from the list price
+        effective_price = instance.effective_price
+        if effective_price is None:
+            return ret
+        if instance.discount_price is None and effective_price >= instance.price:
+            ret['discount_price'] = None
+        else:
+            ret['discount_price'] = self.fields['discount_price'].to_representation(effective_price)
+
+        return ret
+
+class ProductSerializer(ProductListSerializer):
     category = CategorySerializer(read_only=True)
     category_id = serializers.UUIDField(write_only=True)
     images = ProductImageSerializer(many=True, read_only=True)
@@ -52,23 +109,25 @@ class ProductSerializer(serializers.ModelSerializer):
         write_only=True,
         required=False
     )
-    average_rating = serializers.FloatField(read_only=True)
-    review_count = serializers.IntegerField(read_only=True)
+    rating_histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
     reviews = ReviewSerializer(many=True, read_only=True)
 
+    expandable_fields = {}
+
     class Meta:
         model = Product
         fields = ['id', 'category', 'category_id', 'name', 'slug', 'description', 
-                  'price', 'discount_price', 'stock_quantity', 'image_main', 
+                  'price', 'discount_price', 'effective_price', 'discount_percent', 'discount_source',
+                  'discount_campaign_id', 'stock_quantity', 'image_main', 'image_srcset', 
                   'is_active', 'allow_pod', 'created_at', 'images', 'uploaded_images',
-                  'average_rating', 'review_count', 'reviews', 'options', 'sku']
+                  'average_rating', 'review_count', 'rating_histogram', 'reviews', 'options', 'sku']
 
     def create(self, validated_data):
         uploaded_images = validated_data.pop('uploaded_images', [])
         product = Product.objects.create(**validated_data)
         
-        for image_url in uploaded_images:
-            ProductImage.objects.create(product=product, image=image_url)
+        if uploaded_images:
+            sync_images({product.pk: uploaded_images})
             
         return product
 
@@ -80,72 +139,39 @@ class ProductSerializer(serializers.ModelSerializer):
             setattr(instance, attr, value)
         instance.save()
         
-        # Update images if provided
+        # Update images if provided: unchanged images keep their rows and ids
         if uploaded_images is not None:
-            instance.images.all().delete()
-            for image_url in uploaded_images:
-                ProductImage.objects.create(product=instance, image=image_url)
+            sync_images({instance.pk: uploaded_images})
                 
         return instance
 
-    def to_representation(self, instance):
-        ret = super().to_representation(instance)
-        
-        # Calculate campaign discount
-        active_campaigns = self.context.get('active_campaigns')
-        
-        if active_campaigns is None:
-            # Fallback if context not set (e.g. other views)
-            from django.utils import timezone
-            from apps.campaigns.models import Campaign
-            now = timezone.now()
-            active_campaigns = Campaign.objects.filter(
-                start_time__lte=now,
-                end_time__gte=now,
-                is_active=True
-            ).prefetch_related('products')
-
-        best_discount = 0
-        
-        for campaign in active_campaigns:
-            is_included = False
-            if campaign.product_selection_type == 'all':
-                is_included = True
-            elif campaign.product_selection_type == 'category':
-                if instance.category_id == campaign.target_category_id:
-                    is_included = True
-            elif campaign.product_selection_type == 'manual':
-                # Use prefetched products to avoid N+1
-                try:
-                    # Ensure we are comparing UUIDs correctly
-                    # campaign.products.all() returns Product instances
-                    if instance.id in [p.id for p in campaign.products.all()]:
-                        is_included = True
-                except Exception:
-                    pass # Fail safe if something goes wrong with prefetch or ID access
-            
-            if is_included:
-                if campaign.discount_percentage > best_discount:
-                    best_discount = campaign.discount_percentage
-        
-        if best_discount > 0:
-            original_price = float(instance.price)
-            discount_amount = original_price * (float(best_discount) / 100)
-            new_price = original_price - discount_amount
-            
-            # Check against existing discount_price
-            current_discount_price = float(ret['discount_price']) if ret['discount_price'] else None
-            
-            if current_discount_price is None or new_price < current_discount_price:
-                ret['discount_price'] = "{:.2f}".format(new_price)
-                
-        return ret
-
-class WishlistSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
+class WishlistSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    product = ProductListSerializer(read_only=True)
     product_id = serializers.UUIDField(write_only=True)
 
     class Meta:
         model = Wishlist
         fields = ['id', 'user', 'product', 'product_id', 'added_at']
         read_only_fields = ['user', 'added_at']
+
+# Product ids accepted by one wishlist sync, per list
+WISHLIST_SYNC_LIMIT = 500
+
+class WishlistSyncSerializer(serializers.Serializer):
+    """
+    Either `product_ids`, the complete wishlist (anything else is removed), or
+    `add` / `remove` sets applied to the current one.
+    """
+    product_ids = serializers.ListField(child=serializers.UUIDField(), required=False, max_length=WISHLIST_SYNC_LIMIT)
+    add = serializers.ListField(child=serializers.UUIDField(), required=False, max_length=WISHLIST_SYNC_LIMIT)
+    remove = serializers.ListField(child=serializers.UUIDField(), required=False, max_length=WISHLIST_SYNC_LIMIT)
+
+    def validate(self, attrs):
+        if 'product_ids' in attrs and ('add' in attrs or 'remove' in attrs):
+            raise serializers.ValidationError('Send either product_ids or add/remove, not both.')
+        if not attrs:
+            raise serializers.ValidationError('product_ids, add or remove is required.')
+        return attrs
+
+class WishlistDetailSerializer(WishlistSerializer):
+    product = ProductSerializer(read_only=True)
@@ -0,0 +1,102 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from apps.products.models import Product, ProductImage, Category, Review
+from apps.products.ratings import apply_rating_change
+from apps.products import search
+from castle_core.response_cache import invalidate, invalidate_products
+from castle_core.image_variants import pending_manifest, queue_variants, source_of, variants_updated
+
+@receiver(post_save, sender=Review)
+def update_rating_on_save(sender, instance, created, **kwargs):
+    old_product_id, old_rating = getattr(instance, '_loaded_rating', (None, None))
+
+    if created or old_product_id is None:
+        apply_rating_change(instance.product_id, new_rating=instance.rating)
+    elif old_product_id != instance.product_id:
+        apply_rating_change(old_product_id, old_rating=old_rating)
+        apply_rating_change(instance.product_id, new_rating=instance.rating)
+    elif old_rating != instance.rating:
+        apply_rating_change(instance.product_id, old_rating=old_rating, new_rating=instance.rating)
+    else:
+        # Comment-only edit: still changes the product detail, so move its validators
+        Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+
+    instance._loaded_rating = (instance.product_id, instance.rating)
+
+@receiver(post_delete, sender=Review)
+def update_rating_on_delete(sender, instance, **kwargs):
+    product_id, rating = getattr(instance, '_loaded_rating', (instance.product_id, instance.rating))
+    apply_rating_change(product_id, old_rating=rating)
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not search.INDEXED_FIELDS.intersection(update_fields):
+        return
+    search.index_products([instance.pk], using=kwargs.get('using', 'default'))
+
+@receiver(post_delete, sender=Product)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.remove_products([instance.pk], using=kwargs.get('using', 'default'))
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_responses(sender, instance, **kwargs):
+    invalidate_products([instance.pk])
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_responses(sender, instance, **kwargs):
+    invalidate('categories', f'category:{instance.pk}')
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_review_responses(sender, instance, **kwargs):
+    # Aggregates are written with UPDATE, so no Product signal fires for them
+    invalidate('reviews', f'product:{instance.product_id}')
+
+@receiver(post_save, sender=Product)
+def build_main_image_variants(sender, instance, **kwargs):
+    source = source_of(instance, 'image_main')
+    if source and instance.image_main_variants.get('source') != source:
+        queue_variants('product', [(instance.pk, source)])
+        # A later save of this instance must not write the old manifest back over the queued one
+        instance.image_main_variants = pending_manifest(source)
+
+@receiver(variants_updated, sender=Product)
+@receiver(variants_updated, sender=ProductImage)
+def touch_products_with_new_variants(sender, pks, **kwargs):
+    # Manifests are written with UPDATE: move the product validators and drop cached responses
+    product_ids = pks if sender is Product else list(
+        ProductImage.objects.filter(pk__in=pks).values_list('product_id', flat=True).distinct()
+    )
+    Product.objects.filter(pk__in=product_ids).update(updated_at=timezone.now())
+    invalidate_products(product_ids)
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Category)
+def record_catalog_tombstone(sender, instance, **kwargs):
+    from apps.products.changes import record_tombstones
+    record_tombstones(sender._meta.model_name, [instance.pk])
+
+@receiver(post_save, sender=Product)
+def queue_wishlist_alerts(sender, instance, created, **kwargs):
+    from apps.products.alerts import alert_state_of, queue_alerts
+
+    state = alert_state_of(instance)
+    loaded = getattr(instance, '_loaded_alert_state', None)
+    if not created and loaded is not None:
+        queue_alerts([(instance.pk, loaded, state)])
+    instance._loaded_alert_state = state
+
+@receiver(post_save, sender=Product)
+def record_stock_edit(sender, instance, created, update_fields=None, **kwargs):
+    from apps.products.inventory import record_stock_changes
+
+    if update_fields is not None and 'stock_quantity' not in update_fields:
+        return
+    if created:
+        record_stock_changes([(instance.pk, None, instance.stock_quantity)])
+    elif getattr(instance, '_loaded_stock', None) is not None:
+        record_stock_changes([(instance.pk, instance._loaded_stock, instance.stock_quantity)])
+    instance._loaded_stock = instance.stock_quantity
@@ -0,0 +1,252 @@
+"""
+Whole-catalog snapshot for static builds: one compressed NDJSON file with
+every category and active product, plus a manifest pointing at it.
+
+    {"type": "category", "data": {...CategorySerializer...}}
+    {"type": "product", "data": {...ProductListSerializer + images...}}
+
+Products are written in id order, so an incremental run can merge the
+previous file with the products changed since it was generated in a
+single pass. Deactivated and deleted products drop out; categories are
+always rewritten because they are few. Files are named after their
+content hash and are never overwritten, and the manifest
+(snapshots/manifest.json) always names the newest file. The manifest is
+written under a temporary name and renamed over the old one, so readers
+never find it missing or half-written.
+
+Builds run in the build_catalog_snapshot command, or on a background thread
+when an admin asks for one through the API (`build_snapshot_in_background`).
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Count, Q
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = 'snapshots'
+MANIFEST_NAME = f'{SNAPSHOT_DIR}/manifest.json'
+CHUNK_SIZE = 1000
+# Older snapshot files kept for clients still downloading them
+KEEP_PREVIOUS = 2
+# Held while an API-requested build runs; expires in case its process dies
+BUILD_LOCK = 'catalog-snapshot:building'
+BUILD_LOCK_TIMEOUT = 30 * 60
+
+
+def load_manifest():
+    if not default_storage.exists(MANIFEST_NAME):
+        return None
+    with default_storage.open(MANIFEST_NAME, 'rb') as file:
+        return json.loads(file.read())
+
+
+def _line(kind, data):
+    return (json.dumps({'type': kind, 'data': data}, cls=JSONEncoder, separators=(',', ':')) + '\n').encode()
+
+
+def _product_serializer():
+    from .serializers import ProductListSerializer
+    # Same shape as the list endpoint, with the gallery the product page needs
+    return ProductListSerializer(expand=['images'])
+
+
+def _products(queryset):
+    """Yields (id, line) for `queryset` in id order, streamed with a server-side cursor."""
+    serializer = _product_serializer()
+    queryset = queryset.order_by('pk').prefetch_related('images')
+    for product in queryset.iterator(chunk_size=CHUNK_SIZE):
+        yield str(product.pk), _line('product', serializer.to_representation(product))
+
+
+def _previous_products(manifest):
+    """Yields (id, line) for the product lines of the previous snapshot file."""
+    with default_storage.open(manifest['files']['gzip']['name'], 'rb') as raw, gzip.GzipFile(fileobj=raw) as file:
+        for line in file:
+            if line.startswith(b'{"type":"product"'):
+                yield json.loads(line)['data']['id'], line
+
+
+def _merge(previous, changed, active_ids):
+    """Merge-join of two id-ordered streams: changed rows win, inactive ids drop out."""
+    previous, changed = iter(previous), iter(changed)
+    old, new = next(previous, None), next(changed, None)
+    while old is not None or new is not None:
+        if new is not None and (old is None or new[0] <= old[0]):
+            if old is not None and old[0] == new[0]:
+                old = next(previous, None)
+            yield new
+            new = next(changed, None)
+        else:
+            if old[0] in active_ids:
+                yield old
+            old = next(previous, None)
+
+
+class _Writer:
+    """Writes the stream once into gzip (and brotli when installed), hashing as it goes."""
+
+    def __init__(self):
+        self.gzip_file = tempfile.TemporaryFile()
+        self.gzip = gzip.GzipFile(fileobj=self.gzip_file, mode='wb', compresslevel=6, mtime=0)
+        self.brotli_file = tempfile.TemporaryFile() if brotli else None
+        self.brotli = brotli.Compressor(quality=9) if brotli else None
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        self.gzip.write(data)
+        if self.brotli:
+            self.brotli_file.write(self.brotli.process(data))
+
+    def close(self):
+        self.gzip.close()
+        if self.brotli:
+            self.brotli_file.write(self.brotli.finish())
+
+    def save(self):
+        digest = self.sha256.hexdigest()
+        files = {}
+        outputs = [('gzip', 'gz', self.gzip_file)]
+        if self.brotli:
+            outputs.append(('brotli', 'br', self.brotli_file))
+        for encoding, extension, file in outputs:
+            name = f'{SNAPSHOT_DIR}/catalog-{digest[:16]}.ndjson.{extension}'
+            file.seek(0, os.SEEK_END)
+            size = file.tell()
+            file.seek(0)
+            if not default_storage.exists(name):
+                default_storage.save(name, File(file, name=os.path.basename(name)))
+            file.close()
+            files[encoding] = {'name': name, 'url': default_storage.url(name), 'bytes': size}
+        return digest, files
+
+
+def build_snapshot(full=False):
+    """
+    Writes a new snapshot and manifest, incrementally from the previous one
+    unless `full`. Returns the manifest.
+    """
+    from .models import Category, Product
+    from .pricing import refresh_stale_prices
+    from .serializers import CategorySerializer
+
+    refresh_stale_prices()
+    started = timezone.now()
+    previous = None if full else load_manifest()
+    active = Product.objects.filter(is_active=True)
+
+    writer = _Writer()
+    categories = Category.objects.annotate(
+        product_count=Count('products', filter=Q(products__is_active=True))
+    ).order_by('name')
+    for category in categories:
+        writer.write(_line('category', CategorySerializer(category).data))
+
+    if previous:
+        active_ids = {str(pk) for pk in active.values_list('pk', flat=True)}
+        since = datetime.fromisoformat(previous['generated_at'])
+        rows = _merge(_previous_products(previous), _products(active.filter(updated_at__gte=since)), active_ids)
+    else:
+        active_ids, rows = None, _products(active)
+
+    written = set()
+    for product_id, line in rows:
+        written.add(product_id)
+        writer.write(line)
+    writer.close()
+
+    if active_ids is not None and written != active_ids:
+        # The previous file is missing products (e.g. hand-edited rows); start over
+        return build_snapshot(full=True)
+
+    digest, files = writer.save()
+    manifest = {
+        'generated_at': started.isoformat(),
+        'incremental': bool(previous),
+        'sha256': digest,
+        'bytes': writer.size,
+        'categories': len(categories),
+        'products': len(written),
+        'files': files,
+    }
+    _publish(manifest)
+    return manifest
+
+
+def build_snapshot_in_background(full=False):
+    """
+    Starts build_snapshot on a background thread, so the request returns at
+    once. Returns False when a build started this way is still running.
+    """
+    import threading
+    from django.core.cache import cache
+    from django.db import connection
+
+    if not cache.add(BUILD_LOCK, True, BUILD_LOCK_TIMEOUT):
+        return False
+
+    def build():
+        try:
+            build_snapshot(full=full)
+        except Exception:
+            logger.exception('Catalog snapshot build failed')
+        finally:
+            cache.delete(BUILD_LOCK)
+            connection.close()
+
+    threading.Thread(target=build, daemon=True).start()
+    return True
+
+
+def _write_manifest(manifest):
+    data = json.dumps(manifest, indent=2).encode()
+    try:
+        path = default_storage.path(MANIFEST_NAME)
+    except NotImplementedError:
+        # Remote storage: no rename, so replace the object in place
+        if default_storage.exists(MANIFEST_NAME):
+            default_storage.delete(MANIFEST_NAME)
+        default_storage.save(MANIFEST_NAME, ContentFile(data))
+        return
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory, prefix='.manifest-', delete=False) as file:
+        file.write(data)
+    os.chmod(file.name, default_storage.file_permissions_mode or 0o644)
+    os.replace(file.name, path)
+
+
+def _publish(manifest):
+    _write_manifest(manifest)
+
+    # Prune old files, keeping the newest few
+    try:
+        _, names = default_storage.listdir(SNAPSHOT_DIR)
+    except FileNotFoundError:
+        return
+    current = {entry['name'].rsplit('/', 1)[-1] for entry in manifest['files'].values()}
+    old = sorted(
+        (name for name in names if name.startswith('catalog-') and name not in current),
+        key=lambda name: default_storage.get_modified_time(f'{SNAPSHOT_DIR}/{name}'),
+        reverse=True,
+    )
+    per_snapshot = len(manifest['files'])
+    for name in old[KEEP_PREVIOUS * per_snapshot:]:
+        default_storage.delete(f'{SNAPSHOT_DIR}/{name}')
@@ -2,8 +2,15 @@ from django.test import TestCase
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
-from .models import Product, Category
+from .models import Product, Category, Review
+from .ratings import rebuild_rating_aggregates
+from .pricing import refresh_stale_prices
+from apps.campaigns.models import Campaign
+from django.utils import timezone
+from django.contrib.auth import get_user_model
+from datetime import timedelta
 from decimal import Decimal
+import io
 
 class ProductTests(TestCase):
     def setUp(self):
@@ -28,32 +35,1236 @@ class ProductTests(TestCase):
     def test_get_all_products(self):
         response = self.client.get('/api/products/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data['results']), 2)
 
     def test_filter_by_category(self):
         response = self.client.get('/api/products/', {'category__slug': 'kitchen'})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data['results']), 2)
 
         response = self.client.get('/api/products/', {'category__slug': 'non-existent'})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 0)
+        self.assertEqual(len(response.data['results']), 0)
 
     def test_filter_by_on_sale(self):
         response = self.client.get('/api/products/', {'on_sale': 'true'})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['id'], str(self.product2.id))
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['id'], str(self.product2.id))
 
     def test_filter_by_price_range(self):
         # Test price__lte
         response = self.client.get('/api/products/', {'price__lte': '50'})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['id'], str(self.product2.id))
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['id'], str(self.product2.id))
 
         # Test price__gte
         response = self.client.get('/api/products/', {'price__gte': '50'})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['id'], str(self.product1.id))
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['id'], str(self.product1.id))
+
+class EffectivePriceTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.kitchen = Category.objects.create(name='Kitchen', slug='kitchen')
+        self.fashion = Category.objects.create(name='Fashion', slug='fashion')
+        self.pot = Product.objects.create(
+            name='Pot', slug='pot', category=self.kitchen, price=Decimal('100.00')
+        )
+        self.pan = Product.objects.create(
+            name='Pan', slug='pan', category=self.kitchen, price=Decimal('80.00'), discount_price=Decimal('75.00')
+        )
+        self.dress = Product.objects.create(
+            name='Dress', slug='dress', category=self.fashion, price=Decimal('60.00')
+        )
+
+    def create_campaign(self, slug, percentage, selection='all', start=None, end=None, **kwargs):
+        now = timezone.now()
+        return Campaign.objects.create(
+            title=slug, slug=slug,
+            start_time=start or now - timedelta(hours=1),
+            end_time=end or now + timedelta(hours=1),
+            product_selection_type=selection,
+            discount_percentage=Decimal(percentage),
+            **kwargs
+        )
+
+    def test_static_discount_is_effective_price(self):
+        self.assertEqual(self.pot.effective_price, Decimal('100.00'))
+        self.assertEqual(self.pan.effective_price, Decimal('75.00'))
+
+    def test_campaign_discount_applies_best_price(self):
+        self.create_campaign('kitchen-sale', '10', selection='category', target_category=self.kitchen)
+        self.pot.refresh_from_db()
+        self.pan.refresh_from_db()
+        self.dress.refresh_from_db()
+        self.assertEqual(self.pot.effective_price, Decimal('90.00'))
+        # 10% of 80 is 72, better than the static 75
+        self.assertEqual(self.pan.effective_price, Decimal('72.00'))
+        self.assertEqual(self.dress.effective_price, Decimal('60.00'))
+
+        response = self.client.get(f'/api/products/{self.pot.id}/')
+        self.assertEqual(response.data['discount_price'], '90.00')
+
+    def test_manual_campaign_follows_membership(self):
+        campaign = self.create_campaign('dress-sale', '50', selection='manual')
+        campaign.products.add(self.dress)
+        self.dress.refresh_from_db()
+        self.assertEqual(self.dress.effective_price, Decimal('30.00'))
+
+        campaign.products.remove(self.dress)
+        self.dress.refresh_from_db()
+        self.assertEqual(self.dress.effective_price, Decimal('60.00'))
+
+    def test_product_price_change_recomputes(self):
+        self.create_campaign('all-sale', '20')
+        self.dress.refresh_from_db()
+        self.dress.price = Decimal('50.00')
+        self.dress.save()
+        self.assertEqual(self.dress.effective_price, Decimal('40.00'))
+
+    def test_campaign_window_opens_and_closes(self):
+        now = timezone.now()
+        campaign = self.create_campaign('later', '50', start=now + timedelta(hours=1), end=now + timedelta(hours=2))
+        self.dress.refresh_from_db()
+        self.assertEqual(self.dress.effective_price, Decimal('60.00'))
+        self.assertEqual(self.dress.price_valid_until, campaign.start_time)
+
+        refresh_stale_prices(now=now + timedelta(minutes=90))
+        self.dress.refresh_from_db()
+        self.assertEqual(self.dress.effective_price, Decimal('30.00'))
+        self.assertEqual(self.dress.price_valid_until, campaign.end_time)
+
+    def test_filters_and_ordering_use_effective_price(self):
+        self.create_campaign('fashion-sale', '50', selection='category', target_category=self.fashion)
+
+        response = self.client.get('/api/products/', {'price__lte': '40'})
+        self.assertEqual([p['id'] for p in response.data['results']], [str(self.dress.id)])
+
+        response = self.client.get('/api/products/', {'on_sale': 'true'})
+        self.assertEqual(
+            {p['id'] for p in response.data['results']},
+            {str(self.pan.id), str(self.dress.id)}
+        )
+
+        response = self.client.get('/api/products/', {'ordering': 'price'})
+        self.assertEqual(
+            [p['id'] for p in response.data['results']],
+            [str(self.dress.id), str(self.pan.id), str(self.pot.id)]
+        )
+
+    def test_sale_index_tracks_discount_source(self):
+        self.assertEqual((self.pan.discount_percent, self.pan.discount_source), (Decimal('6.25'), 'static'))
+        self.assertEqual((self.pot.discount_percent, self.pot.discount_source), (Decimal('0'), ''))
+
+        now = timezone.now()
+        campaign = self.create_campaign('kitchen-sale', '10', selection='category', target_category=self.kitchen,
+                                        end=now + timedelta(hours=1))
+        self.pan.refresh_from_db()
+        self.assertEqual(self.pan.discount_percent, Decimal('10.00'))
+        self.assertEqual((self.pan.discount_source, self.pan.discount_campaign_id), ('campaign', campaign.id))
+
+        # Window closes: back to the static discount
+        refresh_stale_prices(now=now + timedelta(hours=2))
+        self.pan.refresh_from_db()
+        self.assertEqual((self.pan.discount_percent, self.pan.discount_source), (Decimal('6.25'), 'static'))
+        self.assertIsNone(self.pan.discount_campaign_id)
+
+    def test_deals_and_discount_ordering(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.create_campaign('dress-sale', '50', selection='manual').products.add(self.dress)
+
+        response = self.client.get('/api/products/deals/')
+        self.assertEqual([p['slug'] for p in response.data], ['dress', 'pan'])
+        self.assertEqual(response.data[0]['discount_percent'], '50.00')
+        response = self.client.get('/api/products/deals/', {'limit': 1, 'category__slug': 'kitchen'})
+        self.assertEqual([p['slug'] for p in response.data], ['pan'])
+
+        response = self.client.get('/api/products/', {'ordering': '-discount'})
+        self.assertEqual([p['slug'] for p in response.data['results']], ['dress', 'pan', 'pot'])
+
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        User = get_user_model()
+        self.alice = User.objects.create_user(username='alice', password='password123')
+        self.bob = User.objects.create_user(username='bob', password='password123')
+        self.category = Category.objects.create(name='Kitchen', slug='kitchen')
+        self.pot = Product.objects.create(name='Pot', slug='pot', category=self.category, price=Decimal('100.00'))
+        self.pan = Product.objects.create(name='Pan', slug='pan', category=self.category, price=Decimal('80.00'))
+
+    def test_create_edit_delete_update_aggregates(self):
+        review = Review.objects.create(product=self.pot, user=self.alice, rating=5, comment='Great')
+        Review.objects.create(product=self.pot, user=self.bob, rating=2, comment='Meh')
+        self.pot.refresh_from_db()
+        self.assertEqual((self.pot.rating_count, self.pot.rating_sum), (2, 7))
+        self.assertEqual(self.pot.average_rating, 3.5)
+        self.assertEqual(self.pot.rating_histogram, {'1': 0, '2': 1, '3': 0, '4': 0, '5': 1})
+
+        review = Review.objects.get(pk=review.pk)
+        review.rating = 4
+        review.save()
+        self.pot.refresh_from_db()
+        self.assertEqual((self.pot.rating_count, self.pot.rating_sum), (2, 6))
+        self.assertEqual((self.pot.rating_4_count, self.pot.rating_5_count), (1, 0))
+
+        review.delete()
+        self.pot.refresh_from_db()
+        self.assertEqual((self.pot.rating_count, self.pot.rating_sum, self.pot.average_rating), (1, 2, 2.0))
+
+    def test_rebuild_matches_incremental(self):
+        Review.objects.create(product=self.pot, user=self.alice, rating=5, comment='Great')
+        Product.objects.filter(pk=self.pot.pk).update(rating_count=0, rating_sum=0, rating_average=0, rating_5_count=0)
+
+        self.assertEqual(rebuild_rating_aggregates(), 1)
+        self.pot.refresh_from_db()
+        self.assertEqual((self.pot.rating_count, self.pot.rating_5_count, self.pot.average_rating), (1, 1, 5.0))
+
+    def test_ordering_and_filtering_by_rating(self):
+        Review.objects.create(product=self.pot, user=self.alice, rating=3, comment='Ok')
+        Review.objects.create(product=self.pan, user=self.alice, rating=5, comment='Great')
+
+        response = self.client.get('/api/products/', {'ordering': '-rating'})
+        self.assertEqual([p['id'] for p in response.data['results']], [str(self.pan.id), str(self.pot.id)])
+
+        response = self.client.get('/api/products/', {'rating__gte': '4'})
+        self.assertEqual([p['id'] for p in response.data['results']], [str(self.pan.id)])
+
+    def test_product_detail_needs_no_rating_queries(self):
+        Review.objects.create(product=self.pot, user=self.alice, rating=4, comment='Good')
+        product = Product.objects.get(pk=self.pot.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual((product.average_rating, product.review_count), (4.0, 1))
+
+
+class ProjectionTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Kitchen', slug='kitchen')
+        for i in range(3):
+            product = Product.objects.create(
+                name=f'Item {i}', slug=f'item-{i}', category=self.category, price=Decimal('10.00')
+            )
+            product.images.create(image=f'http://example.com/{i}.jpg')
+        self.product = product
+
+    def test_list_is_compact(self):
+        response = self.client.get('/api/products/')
+        row = response.data['results'][0]
+        self.assertEqual(row['category_id'], str(self.category.id))
+        for relation in ('category', 'images', 'reviews', 'description'):
+            self.assertNotIn(relation, row)
+
+    def test_expand_and_fields(self):
+        response = self.client.get('/api/products/', {'expand': 'category,images', 'fields': 'id,name'})
+        row = response.data['results'][0]
+        self.assertEqual(set(row), {'id', 'name', 'category', 'images'})
+        self.assertEqual(row['category']['slug'], 'kitchen')
+        self.assertEqual(len(row['images']), 1)
+
+    def test_unrequested_relations_are_not_queried(self):
+        with self.assertNumQueries(4):
+            # stale price check, ETag aggregate, page (keyset pages skip the count), campaign boundary
+            self.client.get('/api/products/')
+        with self.assertNumQueries(4):
+            # boundary is memoized; + one prefetch for images, category joined into the page query
+            self.client.get('/api/products/', {'expand': 'category,images'})
+
+    def test_detail_is_full(self):
+        response = self.client.get(f'/api/products/{self.product.id}/')
+        self.assertEqual(response.data['category']['slug'], 'kitchen')
+        self.assertEqual(len(response.data['images']), 1)
+        self.assertEqual(response.data['reviews'], [])
+
+        response = self.client.get(f'/api/products/{self.product.id}/', {'fields': 'id,price'})
+        self.assertEqual(set(response.data), {'id', 'price'})
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Catering', slug='catering')
+        self.chafing = Product.objects.create(
+            name='Gold Chafing Dish', slug='gold-chafing-dish', category=self.category,
+            price=Decimal('4500.00'), description='Keeps buffet food warm'
+        )
+        self.server = Product.objects.create(
+            name='Buffet Server', slug='buffet-server', category=self.category,
+            price=Decimal('3000.00'), description='Pairs well with a chafing dish'
+        )
+        self.kettle = Product.objects.create(
+            name='Electric Kettle', slug='electric-kettle', category=self.category,
+            price=Decimal('2000.00'), description='Boils water fast'
+        )
+
+    def search(self, term):
+        response = self.client.get('/api/products/', {'search': term})
+        return [p['id'] for p in response.data['results']]
+
+    def test_name_matches_rank_above_description(self):
+        self.assertEqual(self.search('chafing'), [str(self.chafing.id), str(self.server.id)])
+
+    def test_prefix_matching(self):
+        self.assertEqual(self.search('kett'), [str(self.kettle.id)])
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(self.search('buffet server'), [str(self.server.id)])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.kettle.name = 'Cordless Jug'
+        self.kettle.save()
+        self.assertEqual(self.search('kettle'), [])
+        self.assertEqual(self.search('cordless'), [str(self.kettle.id)])
+
+        self.kettle.delete()
+        self.assertEqual(self.search('cordless'), [])
+
+    def test_operator_characters_are_ignored(self):
+        self.assertEqual(self.search('"chafing*" ('), [str(self.chafing.id), str(self.server.id)])
+
+    def test_filters_apply_to_every_match(self):
+        from .search import index_products
+        # More better-ranked matches elsewhere than any pre-filter cap would keep
+        other = Category.objects.create(name='Lighting', slug='lighting')
+        lamps = Product.objects.bulk_create([
+            Product(name=f'Dish Lamp {i}', slug=f'dish-lamp-{i}', category=other, price=Decimal('10.00'), effective_price=Decimal('10.00'))
+            for i in range(600)
+        ])
+        index_products([lamp.pk for lamp in lamps])
+        response = self.client.get('/api/products/', {'search': 'dish', 'category__slug': 'catering'})
+        self.assertEqual([p['id'] for p in response.data['results']], [str(self.chafing.id), str(self.server.id)])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        category = Category.objects.create(name='Kitchen', slug='kitchen')
+        for index in range(5):
+            # Equal prices, so paging by price relies on the id tiebreaker
+            Product.objects.create(
+                name=f'Item {index}', slug=f'item-{index}', category=category,
+                price=Decimal('10.00') if index < 3 else Decimal('20.00'),
+            )
+
+    def _walk(self, params):
+        seen = []
+        response = self.client.get('/api/products/', params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(item['slug'] for item in response.data['results'])
+            if not response.data['next']:
+                return seen, response
+            response = self.client.get(response.data['next'])
+
+    def test_cursor_walk_visits_every_product_once(self):
+        seen, _ = self._walk({'page_size': 2})
+        self.assertEqual(sorted(seen), [f'item-{index}' for index in range(5)])
+
+        by_price, _ = self._walk({'page_size': 2, 'ordering': 'price'})
+        self.assertEqual(len(set(by_price)), 5)
+        self.assertEqual(set(by_price[3:]), {'item-3', 'item-4'})
+
+    def test_previous_link_returns_previous_page(self):
+        first = self.client.get('/api/products/', {'page_size': 2})
+        self.assertIsNone(first.data['previous'])
+        self.assertNotIn('count', first.data)
+
+        second = self.client.get(first.data['next'])
+        previous = self.client.get(second.data['previous'])
+        self.assertEqual(
+            [item['slug'] for item in previous.data['results']],
+            [item['slug'] for item in first.data['results']]
+        )
+
+    def test_count_only_on_request(self):
+        response = self.client.get('/api/products/', {'count': 'exact'})
+        self.assertEqual(response.data['count'], 5)
+        response = self.client.get('/api/products/', {'count': 'estimate'})
+        self.assertEqual(response.data['count'], 5)
+
+    def test_page_param_keeps_page_number_pagination(self):
+        response = self.client.get('/api/products/', {'page': 1})
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual(len(response.data['results']), 5)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/products/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Kitchen', slug='kitchen')
+        self.other_category = Category.objects.create(name='Garden', slug='garden')
+        self.product = Product.objects.create(name='Pot', slug='pot', category=self.category, price=Decimal('10.00'))
+
+    def test_anonymous_reads_are_served_from_cache(self):
+        self.assertEqual(self.client.get('/api/products/')['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/products/', {'unused': ''})
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.json()['results'][0]['slug'], 'pot')
+
+    def test_invalidation_during_build_is_not_stored(self):
+        from unittest import mock
+        from castle_core.response_cache import invalidate_products
+        from apps.products.views import ProductViewSet
+        tags_of = ProductViewSet.get_cache_tags
+
+        def racing_tags(view, data):
+            # A save lands after the body was read from the database
+            Product.objects.filter(pk=self.product.pk).update(name='Pan')
+            invalidate_products([self.product.pk])
+            return tags_of(view, data)
+
+        detail = f'/api/products/{self.product.id}/'
+        with mock.patch.object(ProductViewSet, 'get_cache_tags', racing_tags):
+            self.assertEqual(self.client.get(detail).json()['name'], 'Pot')
+        response = self.client.get(detail)
+        self.assertEqual((response['X-Cache'], response.json()['name']), ('MISS', 'Pan'))
+        self.assertEqual(self.client.get(detail)['X-Cache'], 'HIT')
+
+    def test_saves_invalidate_affected_entries_only(self):
+        detail = f'/api/products/{self.product.id}/'
+        self.client.get(detail)
+        self.client.get('/api/products/categories/')
+
+        Review.objects.create(product=self.product, user=get_user_model().objects.create_user('r', password='x'), rating=4, comment='ok')
+        self.assertEqual(self.client.get(detail)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get('/api/products/categories/')['X-Cache'], 'HIT')
+
+        self.other_category.name = 'Yard'
+        self.other_category.save()
+        self.assertEqual(self.client.get(detail)['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get('/api/products/categories/')['X-Cache'], 'MISS')
+
+        self.category.save()
+        self.assertEqual(self.client.get(detail)['X-Cache'], 'MISS')
+
+    def test_campaign_changes_invalidate_repriced_products(self):
+        self.client.get('/api/products/')
+        now = timezone.now()
+        Campaign.objects.create(
+            title='Sale', slug='sale', product_selection_type='all', discount_percentage=Decimal('50'),
+            start_time=now - timedelta(hours=1), end_time=now + timedelta(hours=1),
+        )
+        response = self.client.get('/api/products/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['discount_price'], '5.00')
+
+    def test_staff_and_raw_requests_bypass_cache(self):
+        self.client.get('/api/products/')
+        staff = get_user_model().objects.create_user('staff', password='x', is_staff=True)
+        self.client.force_authenticate(staff)
+        self.assertFalse(self.client.get('/api/products/').has_header('X-Cache'))
+        self.client.force_authenticate(None)
+        self.assertFalse(self.client.get('/api/products/', {'raw': 'true'}).has_header('X-Cache'))
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Kitchen', slug='kitchen')
+        self.product = Product.objects.create(name='Pot', slug='pot', category=self.category, price=Decimal('10.00'))
+        self.detail = f'/api/products/{self.product.id}/'
+
+    def test_matching_etag_returns_304(self):
+        response = self.client.get(self.detail)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn(f'product:{self.product.id}', response['Surrogate-Key'].split())
+
+        # Served from the response cache: no database work at all
+        with self.assertNumQueries(0):
+            response = self.client.get(self.detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        from django.core.cache import cache
+        cache.clear()
+        with self.assertNumQueries(3):
+            # stale price check, validator aggregate, campaign boundary for s-maxage; nothing is serialized
+            response = self.client.get(self.detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_changes_move_the_etag(self):
+        list_etag = self.client.get('/api/products/')['ETag']
+        detail_etag = self.client.get(self.detail)['ETag']
+
+        self.category.name = 'Cookware'
+        self.category.save()
+        self.assertEqual(self.client.get(self.detail, HTTP_IF_NONE_MATCH=detail_etag).status_code, status.HTTP_200_OK)
+
+        Product.objects.create(name='Pan', slug='pan', category=self.category, price=Decimal('5.00'))
+        self.assertEqual(self.client.get('/api/products/', HTTP_IF_NONE_MATCH=list_etag).status_code, status.HTTP_200_OK)
+
+    def test_query_string_is_part_of_the_etag(self):
+        etag = self.client.get('/api/products/')['ETag']
+        response = self.client.get('/api/products/', {'fields': 'id'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_authenticated_responses_are_private(self):
+        staff = get_user_model().objects.create_user('staff', password='x', is_staff=True)
+        self.client.force_authenticate(staff)
+        response = self.client.get(self.detail)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertFalse(response.has_header('Surrogate-Key'))
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.client = APIClient()
+        kitchen = Category.objects.create(name='Kitchen', slug='kitchen')
+        garden = Category.objects.create(name='Garden', slug='garden')
+        Product.objects.create(name='Pot', slug='pot', category=kitchen, price=Decimal('800.00'))
+        Product.objects.create(name='Pan', slug='pan', category=kitchen, price=Decimal('3000.00'),
+                               discount_price=Decimal('2000.00'), allow_pod=False)
+        Product.objects.create(name='Hose', slug='hose', category=garden, price=Decimal('60000.00'))
+        Product.objects.create(name='Old', slug='old', category=garden, price=Decimal('10.00'), is_active=False)
+
+    def test_facets_in_one_query(self):
+        with self.assertNumQueries(3):
+            # stale price check, grouped facet query, campaign boundary for the cache timeout
+            response = self.client.get('/api/products/facets/')
+        data = response.data
+        self.assertEqual(data['count'], 3)
+        self.assertEqual([(c['slug'], c['count']) for c in data['categories']], [('kitchen', 2), ('garden', 1)])
+        self.assertEqual([r['count'] for r in data['price_ranges']], [1, 1, 0, 0, 0, 0, 1])
+        self.assertEqual(data['allow_pod'], 2)
+        self.assertEqual(data['on_sale'], 1)
+
+        with self.assertNumQueries(0):
+            self.client.get('/api/products/facets/')
+
+    def test_category_filter_narrows_other_facets_only(self):
+        data = self.client.get('/api/products/facets/', {'category__slug': 'kitchen', 'price__lte': 5000}).data
+        self.assertEqual(data['count'], 2)
+        self.assertEqual({c['slug']: c['count'] for c in data['categories']}, {'kitchen': 2})
+        self.assertTrue(data['categories'][0]['selected'])
+        self.assertEqual(data['on_sale'], 1)
+
+    def test_cache_invalidated_by_product_save(self):
+        self.client.get('/api/products/facets/')
+        Product.objects.create(name='Rake', slug='rake', category=Category.objects.get(slug='garden'), price=Decimal('500.00'))
+        self.assertEqual(self.client.get('/api/products/facets/').data['count'], 4)
+
+    def test_category_product_count(self):
+        counts = {c['slug']: c['product_count'] for c in self.client.get('/api/products/categories/').data['results']}
+        self.assertEqual(counts, {'kitchen': 2, 'garden': 1})
+
+
+class CatalogImportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Kitchen', slug='kitchen')
+        self.existing = Product.objects.create(name='Pot', slug='pot', category=self.category, price=Decimal('10.00'))
+        self.admin = get_user_model().objects.create_user('admin', password='x', is_staff=True)
+
+    def _import(self, content, format):
+        import io
+        from .importer import import_catalog
+        return import_catalog(io.StringIO(content), format, batch_size=2)
+
+    def test_csv_upsert(self):
+        result = self._import(
+            'slug,name,category,price,discount_price,images\n'
+            'pot,Big Pot,kitchen,12.00,,http://x/1.jpg|http://x/2.jpg\n'
+            'pan,Pan,kitchen,20.00,15.00,\n'
+            'lid,Lid,kitchen,5.00,,\n',
+            'csv'
+        )
+        self.assertEqual((result['created'], result['updated'], result['error_count']), (2, 1, 0))
+
+        pot = Product.objects.get(slug='pot')
+        self.assertEqual((pot.pk, pot.sku), (self.existing.pk, self.existing.sku))
+        self.assertEqual((pot.name, pot.price), ('Big Pot', Decimal('12.00')))
+        self.assertEqual(pot.images.count(), 2)
+
+        pan = Product.objects.get(slug='pan')
+        self.assertEqual(pan.effective_price, Decimal('15.00'))
+        self.assertTrue(pan.sku.startswith('SKU-'))
+        self.assertEqual(len(set(Product.objects.values_list('sku', flat=True))), 3)
+
+    def test_row_errors_are_reported_and_skipped(self):
+        result = self._import(
+            '{"slug": "pan", "name": "Pan", "category": "kitchen", "price": "20"}\n'
+            '{"slug": "bad", "name": "Bad", "category": "garden", "price": "20"}\n'
+            'not json\n'
+            '{"slug": "cheap", "name": "Cheap", "category": "kitchen", "price": "x"}\n'
+            '{"slug": "dup", "name": "Dup", "category": "kitchen", "price": "1", "sku": "%s"}\n' % self.existing.sku,
+            'ndjson'
+        )
+        self.assertEqual(result['created'], 1)
+        self.assertEqual([error['line'] for error in result['errors']], [2, 3, 4, 5])
+        self.assertIn('Unknown category', result['errors'][0]['error'])
+
+    def test_imported_products_are_searchable_and_priced_by_campaigns(self):
+        now = timezone.now()
+        Campaign.objects.create(
+            title='Sale', slug='sale', product_selection_type='all', discount_percentage=Decimal('10'),
+            start_time=now - timedelta(hours=1), end_time=now + timedelta(hours=1),
+        )
+        self._import('slug,name,category,price\nwok,Carbon Wok,kitchen,100\n', 'csv')
+        self.assertEqual(Product.objects.get(slug='wok').effective_price, Decimal('90.00'))
+        response = self.client.get('/api/products/', {'search': 'wok'})
+        self.assertEqual([item['slug'] for item in response.data['results']], ['wok'])
+
+    def test_admin_endpoint(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        upload = SimpleUploadedFile('catalog.csv', b'slug,name,category,price\npan,Pan,kitchen,20\n')
+
+        response = self.client.post('/api/products/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.client.force_authenticate(self.admin)
+        upload.seek(0)
+        response = self.client.post('/api/products/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 1)
+
+    def test_admin_endpoint_format_override(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        self.client.force_authenticate(self.admin)
+        upload = SimpleUploadedFile('catalog.txt', b'{"slug": "lid", "name": "Lid", "category": "kitchen", "price": 5}\n')
+        response = self.client.post('/api/products/import/?file_format=ndjson', {'file': upload}, format='multipart')
+        self.assertEqual((response.status_code, response.data['created']), (status.HTTP_200_OK, 1))
+
+        upload = SimpleUploadedFile('catalog.txt', b'slug,name,category,price\ncup,Cup,kitchen,3\n')
+        response = self.client.post('/api/products/import/', {'file': upload, 'file_format': 'csv'}, format='multipart')
+        self.assertEqual((response.status_code, response.data['created']), (status.HTTP_200_OK, 1))
+
+
+class ImageSyncTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user('admin', password='x', is_staff=True))
+        self.category = Category.objects.create(name='Kitchen', slug='kitchen')
+        response = self.client.post('/api/products/', {
+            'name': 'Pot', 'slug': 'pot', 'category_id': str(self.category.id), 'price': '10.00',
+            'image_main': 'http://x/main.jpg', 'uploaded_images': ['http://x/a.jpg', 'http://x/b.jpg', 'http://x/c.jpg'],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.product = Product.objects.get(slug='pot')
+
+    def gallery(self):
+        return list(self.product.images.values_list('image', 'position'))
+
+    def test_create_sets_positions(self):
+        self.assertEqual(self.gallery(), [('http://x/a.jpg', 0), ('http://x/b.jpg', 1), ('http://x/c.jpg', 2)])
+
+    def test_update_keeps_unchanged_rows(self):
+        ids = dict(self.product.images.values_list('image', 'id'))
+        response = self.client.patch(f'/api/products/{self.product.id}/', {
+            'uploaded_images': ['http://x/c.jpg', 'http://x/a.jpg', 'http://x/d.jpg'],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([image['image'] for image in response.data['images']], ['http://x/c.jpg', 'http://x/a.jpg', 'http://x/d.jpg'])
+
+        self.assertEqual(self.gallery(), [('http://x/c.jpg', 0), ('http://x/a.jpg', 1), ('http://x/d.jpg', 2)])
+        current = dict(self.product.images.values_list('image', 'id'))
+        self.assertEqual(current['http://x/a.jpg'], ids['http://x/a.jpg'])
+        self.assertEqual(current['http://x/c.jpg'], ids['http://x/c.jpg'])
+
+    def test_unchanged_gallery_writes_nothing(self):
+        from .images import sync_images
+        with self.assertNumQueries(1):
+            result = sync_images({self.product.pk: ['http://x/a.jpg', 'http://x/b.jpg', 'http://x/c.jpg']})
+        self.assertEqual(result, (0, 0, 0))
+
+class CoPurchaseTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('buyer', password='x')
+        self.category = Category.objects.create(name='Kitchen', slug='kitchen')
+        self.pot, self.pan, self.lid, self.cup = [
+            Product.objects.create(name=name, slug=name.lower(), category=self.category, price=10, stock_quantity=50)
+            for name in ('Pot', 'Pan', 'Lid', 'Cup')
+        ]
+
+    def order(self, *products):
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/orders/', {
+                'items': [{'product_id': str(product.id), 'quantity': 1} for product in products],
+                'total_amount': 10 * len(products), 'payment_method': 'paystack',
+                'delivery_address': 'Somewhere', 'shipping_cost': 0,
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.client.force_authenticate(None)
+
+    def counts(self):
+        from .models import ProductCoPurchase
+        return {
+            (row.product.name, row.related.name): row.count
+            for row in ProductCoPurchase.objects.select_related('product', 'related')
+        }
+
+    def test_orders_update_pair_counts(self):
+        self.order(self.pot, self.lid)
+        self.order(self.pot, self.lid, self.pan)
+        counts = self.counts()
+        self.assertEqual(counts[('Pot', 'Lid')], 2)
+        self.assertEqual(counts[('Lid', 'Pot')], 2)
+        self.assertEqual(counts[('Pot', 'Pan')], 1)
+        self.assertEqual(len(counts), 6)
+
+    def test_rebuild_matches_incremental_counts(self):
+        from .copurchase import rebuild_copurchases
+        self.order(self.pot, self.lid)
+        self.order(self.pot, self.lid, self.pan)
+        self.order(self.cup)
+        incremental = self.counts()
+
+        # A tiny flush threshold exercises merging partial counts
+        self.assertEqual(rebuild_copurchases(flush_pairs=1), (3, 4))
+        self.assertEqual(self.counts(), incremental)
+
+    def test_failed_rebuild_keeps_the_old_index(self):
+        from unittest import mock
+        from .copurchase import rebuild_copurchases
+        self.order(self.pot, self.lid)
+        before = self.counts()
+        with mock.patch('apps.products.copurchase._flush', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                rebuild_copurchases()
+        self.assertEqual(self.counts(), before)
+
+    def test_related_endpoint(self):
+        self.order(self.pot, self.lid)
+        self.order(self.pot, self.lid, self.pan)
+        response = self.client.get(f'/api/products/{self.pot.id}/related/', {'limit': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Most bought together first, then the same category
+        self.assertEqual([row['name'] for row in response.data], ['Lid', 'Pan', 'Cup'])
+
+        self.order(self.pot, self.cup)
+        self.order(self.pot, self.cup)
+        self.order(self.pot, self.cup)
+        response = self.client.get(f'/api/products/{self.pot.id}/related/', {'limit': 1})
+        self.assertEqual([row['name'] for row in response.data], ['Cup'])
+
+class NestedPricingQueryTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from apps.campaigns.models import Campaign
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('shopper', password='x')
+        self.category = Category.objects.create(name='Kitchen', slug='kitchen')
+        now = timezone.now()
+        self.campaign = Campaign.objects.create(
+            title='Sale', slug='sale', discount_percentage=10, product_selection_type='manual',
+            start_time=now - timedelta(hours=1), end_time=now + timedelta(days=1),
+        )
+
+    def add_products(self, count):
+        from .models import Wishlist
+        for _ in range(count):
+            product = Product.objects.create(
+                name='Pan', slug=f'pan-{Product.objects.count()}', category=self.category, price=20,
+            )
+            Wishlist.objects.create(user=self.user, product=product)
+            self.campaign.products.add(product)
+
+    def count_queries(self, url, user=None):
+        from django.core.cache import cache
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        cache.clear()
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        campaign_url = f'/api/campaigns/{self.campaign.id}/'
+        self.add_products(1)
+        before = (self.count_queries('/api/products/wishlist/', self.user), self.count_queries(campaign_url))
+        self.add_products(6)
+        after = (self.count_queries('/api/products/wishlist/', self.user), self.count_queries(campaign_url))
+        self.assertEqual(before, after)
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        overrides = override_settings(
+            MEDIA_ROOT=media.name, IMAGE_VARIANT_WIDTHS=(32, 64), IMAGE_VARIANT_FORMATS=('webp', 'jpeg'),
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.category = Category.objects.create(name='Kitchen', slug='kitchen')
+        self.product = Product.objects.create(
+            name='Pot', slug='pot', category=self.category, price=10, image_main=self.upload('pot.png', 100, 50),
+        )
+
+    def upload(self, name, width, height):
+        import io
+        from PIL import Image
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import default_storage
+        buffer = io.BytesIO()
+        Image.new('RGBA', (width, height), (200, 40, 40, 128)).save(buffer, format='PNG')
+        return '/media/' + default_storage.save(f'originals/{name}', ContentFile(buffer.getvalue()))
+
+    def test_build_writes_manifest_and_srcset(self):
+        from django.core.files.storage import default_storage
+        from castle_core.image_variants import build_variants, pending_jobs
+
+        jobs = list(pending_jobs('product'))
+        self.assertEqual(jobs, [('product', self.product.pk, self.product.image_main)])
+        self.assertEqual(build_variants(jobs, workers=1), (1, 0))
+
+        self.product.refresh_from_db()
+        manifest = self.product.image_main_variants
+        self.assertEqual((manifest['width'], manifest['height']), (100, 50))
+        self.assertEqual([v['width'] for v in manifest['formats']['webp']], [32, 64])
+        self.assertEqual(manifest['formats']['jpeg'][0]['height'], 16)
+        for variant in manifest['formats']['jpeg']:
+            self.assertTrue(default_storage.exists(variant['url'][len('/media/'):].split('?')[0]))
+        self.assertEqual(list(pending_jobs('product')), [])
+
+        response = APIClient().get(f'/api/products/{self.product.id}/')
+        srcset = response.data['image_srcset']['webp']
+        self.assertRegex(srcset, r'/32\.webp\?v=\w+ 32w, .*/64\.webp\?v=\w+ 64w$')
+
+        # A new original makes the manifest stale until it is rebuilt
+        self.product.image_main = self.upload('pot-2.png', 20, 20)
+        self.product.save()
+        response = APIClient().get(f'/api/products/{self.product.id}/')
+        self.assertIsNone(response.data['image_srcset'])
+
+    def test_process_pool_backfill(self):
+        from django.core.management import call_command
+        from .images import sync_images
+        sync_images({self.product.pk: [self.upload('a.png', 80, 80), 'http://127.0.0.1:9/missing.jpg']})
+
+        with self.assertLogs('castle_core.image_variants', 'WARNING'):
+            call_command('build_image_variants', workers=2, stdout=io.StringIO())
+        self.product.refresh_from_db()
+        self.assertIn('webp', self.product.image_main_variants['formats'])
+        first, missing = self.product.images.all()
+        self.assertEqual([v['width'] for v in first.variants['formats']['jpeg']], [32, 64])
+        # Broken images are recorded rather than retried on every run
+        self.assertIn('error', missing.variants)
+
+    def test_saving_a_new_image_queues_variants(self):
+        from django.core.management import call_command
+        from castle_core.image_variants import pending_jobs
+        # Nothing is built (or scheduled) by the save itself
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.product.image_main = self.upload('pan.png', 40, 40)
+            self.product.save()
+            self.product.save()
+        self.assertEqual(callbacks, [])
+        self.assertTrue(Product.objects.get(pk=self.product.pk).image_main_variants['pending'])
+        self.assertEqual(list(pending_jobs('product', queued=True)), [('product', self.product.pk, self.product.image_main)])
+
+        call_command('build_image_variants', queued=True, workers=1, stdout=io.StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual([v['width'] for v in self.product.image_main_variants['formats']['webp']], [32])
+        self.assertEqual(list(pending_jobs('product', queued=True)), [])
+
+        # Up to date: other saves queue nothing
+        self.product.save()
+        self.assertEqual(list(pending_jobs('product')), [])
+
+class CatalogSnapshotTests(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        overrides = override_settings(MEDIA_ROOT=media.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.category = Category.objects.create(name='Kitchen', slug='kitchen')
+        self.products = {
+            slug: Product.objects.create(name=slug.title(), slug=slug, category=self.category, price=10)
+            for slug in ('pot', 'pan', 'lid')
+        }
+
+    def read(self, manifest):
+        import gzip
+        import json
+        from django.core.files.storage import default_storage
+        with default_storage.open(manifest['files']['gzip']['name'], 'rb') as file:
+            lines = [json.loads(line) for line in gzip.decompress(file.read()).splitlines()]
+        return {line['data']['slug']: line['data'] for line in lines if line['type'] == 'product'}
+
+    def test_incremental_snapshot_matches_a_full_one(self):
+        from .snapshot import build_snapshot
+        manifest = build_snapshot()
+        self.assertFalse(manifest['incremental'])
+        self.assertEqual(set(self.read(manifest)), {'pot', 'pan', 'lid'})
+
+        self.products['pot'].price = 8
+        self.products['pot'].save()
+        self.products['lid'].is_active = False
+        self.products['lid'].save()
+        Product.objects.create(name='Cup', slug='cup', category=self.category, price=3)
+        self.products['pan'].delete()
+
+        incremental = build_snapshot()
+        self.assertTrue(incremental['incremental'])
+        products = self.read(incremental)
+        self.assertEqual(set(products), {'pot', 'cup'})
+        self.assertEqual(products['pot']['effective_price'], '8.00')
+
+        full = build_snapshot(full=True)
+        self.assertEqual(full['sha256'], incremental['sha256'])
+
+    def test_manifest_endpoint(self):
+        from .snapshot import build_snapshot
+        client = APIClient()
+        self.assertEqual(client.get('/api/products/snapshot/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(client.post('/api/products/snapshot/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+        manifest = build_snapshot()
+        response = client.get('/api/products/snapshot/')
+        self.assertEqual(response.data['sha256'], manifest['sha256'])
+        self.assertEqual(response.data['products'], 3)
+        self.assertIn('?v=', response.data['files']['gzip']['url'])
+        response = client.get('/api/products/snapshot/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_admin_rebuild_runs_in_the_background(self):
+        from unittest import mock
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user('staff', password='x', is_staff=True))
+        with mock.patch('apps.products.snapshot.build_snapshot_in_background', return_value=True) as build:
+            response = client.post('/api/products/snapshot/?full=true')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        build.assert_called_once_with(full=True)
+        with mock.patch('apps.products.snapshot.build_snapshot_in_background', return_value=False):
+            response = client.post('/api/products/snapshot/')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+class DeltaSyncTests(TestCase):
+    def setUp(self):
+        from django.test import override_settings
+        overrides = override_settings(CHANGES_LAG_SECONDS=0)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Kitchen', slug='kitchen')
+        self.pot, self.pan, self.lid = [
+            Product.objects.create(name=slug, slug=slug, category=self.category, price=10)
+            for slug in ('pot', 'pan', 'lid')
+        ]
+        now = timezone.now()
+        self.campaign = Campaign.objects.create(
+            title='Sale', slug='sale', start_time=now, end_time=now + timedelta(days=1), discount_percentage=10,
+        )
+
+    def sync(self, token=None, limit=500):
+        changes = []
+        while True:
+            params = {'limit': limit}
+            if token:
+                params['since'] = token
+            response = self.client.get('/api/products/changes/', params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            changes += response.data['changes']
+            token = response.data['next']
+            if not response.data['has_more']:
+                return changes, token
+
+    def test_paged_initial_sync_then_deltas(self):
+        changes, token = self.sync(limit=2)
+        self.assertEqual(
+            sorted((change['type'], change['op']) for change in changes),
+            [('campaign', 'upsert'), ('category', 'upsert')] + [('product', 'upsert')] * 3,
+        )
+        self.assertEqual(self.sync(token)[0], [])
+
+        self.pot.price = 12
+        self.pot.save()
+        self.lid.is_active = False
+        self.lid.save()
+        pan_id = str(self.pan.id)
+        self.pan.delete()
+        self.campaign.products.add(self.pot)
+
+        changes, token = self.sync(token)
+        by_id = {(change['type'], change['id']): change for change in changes}
+        self.assertEqual(by_id[('product', str(self.pot.id))]['data']['price'], '12.00')
+        self.assertEqual(by_id[('product', str(self.lid.id))]['reason'], 'inactive')
+        self.assertEqual(by_id[('product', pan_id)], {'type': 'product', 'op': 'delete', 'id': pan_id, 'reason': 'deleted'})
+        self.assertEqual(by_id[('campaign', str(self.campaign.id))]['data']['product_ids'], [str(self.pot.id)])
+        self.assertEqual(self.sync(token)[0], [])
+
+    def test_old_token_asks_for_a_resync(self):
+        from .changes import changes_since
+        token = changes_since()['next']
+        result = changes_since(token, now=timezone.now() + timedelta(days=31))
+        self.assertTrue(result['reset'])
+
+        response = self.client.get('/api/products/changes/', {'since': 'not-a-token'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class BatchLookupTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        category = Category.objects.create(name='Garden', slug='garden')
+        self.rake, self.hose, self.spade = [
+            Product.objects.create(name=slug, slug=slug, category=category, price=20, sku=f'SKU-{slug}')
+            for slug in ('rake', 'hose', 'spade')
+        ]
+        self.hidden = Product.objects.create(name='hidden', slug='hidden', category=category, price=5, is_active=False)
+        Campaign.objects.create(
+            title='Garden week', slug='garden-week', discount_percentage=10,
+            start_time=timezone.now() - timedelta(hours=1), end_time=timezone.now() + timedelta(days=1),
+        ).products.add(self.hose)
+
+    def test_mixed_identifiers_in_request_order(self):
+        params = {
+            'ids': f'{self.hose.pk},{self.hidden.pk},not-a-uuid',
+            'slugs': 'spade,hose,nope',
+            'skus': 'SKU-rake',
+        }
+        # One query for the products (plus the price refresh check)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/products/batch/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['slug'] for row in response.data['results']], ['hose', 'spade', 'rake'])
+        self.assertEqual(response.data['results'][0]['effective_price'], '18.00')
+        self.assertEqual(response.data['missing'], {
+            'ids': [str(self.hidden.pk), 'not-a-uuid'], 'slugs': ['nope'], 'skus': [],
+        })
+
+    def test_limits(self):
+        self.assertEqual(self.client.get('/api/products/batch/').status_code, status.HTTP_400_BAD_REQUEST)
+        slugs = ','.join(f'p{i}' for i in range(101))
+        response = self.client.get('/api/products/batch/', {'slugs': slugs})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_detail_by_slug(self):
+        response = self.client.get('/api/products/spade/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['id'], str(self.spade.pk))
+        self.assertIn('ETag', response)
+        self.assertEqual(self.client.get(f'/api/products/{self.spade.pk}/').data['slug'], 'spade')
+        self.assertEqual(self.client.get('/api/products/hidden/').status_code, status.HTTP_404_NOT_FOUND)
+
+class WishlistSyncTests(TestCase):
+    def setUp(self):
+        from .models import Wishlist
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('shopper', password='x')
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Bath', slug='bath')
+        self.towel, self.soap, self.mat = [
+            Product.objects.create(name=slug, slug=slug, category=category, price=8)
+            for slug in ('towel', 'soap', 'mat')
+        ]
+        self.hidden = Product.objects.create(name='hidden', slug='hidden', category=category, price=8, is_active=False)
+        Wishlist.objects.create(user=self.user, product=self.towel)
+
+    def synced_slugs(self, payload):
+        response = self.client.post('/api/products/wishlist/sync/', payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(item['product']['slug'] for item in response.data)
+
+    def test_add_merges_guest_items(self):
+        ids = [str(self.towel.pk), str(self.soap.pk), str(self.hidden.pk), '00000000-0000-0000-0000-000000000000']
+        self.assertEqual(self.synced_slugs({'add': ids}), ['soap', 'towel'])
+        self.assertEqual(self.synced_slugs({'add': [str(self.mat.pk)], 'remove': [str(self.towel.pk)]}), ['mat', 'soap'])
+
+    def test_full_list_replaces(self):
+        self.assertEqual(self.synced_slugs({'product_ids': [str(self.mat.pk)]}), ['mat'])
+        self.assertEqual(self.synced_slugs({'product_ids': []}), [])
+
+    def test_rejects_mixed_payloads(self):
+        response = self.client.post(
+            '/api/products/wishlist/sync/', {'product_ids': [], 'add': [str(self.mat.pk)]}, format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class WishlistAlertTests(TestCase):
+    def setUp(self):
+        from .models import Wishlist
+        User = get_user_model()
+        self.category = Category.objects.create(name='Tools', slug='tools')
+        self.drill = Product.objects.create(name='Drill', slug='drill', category=self.category, price=100)
+        Product.objects.create(name='Saw', slug='saw', category=self.category, price=50)
+        for name in ('ann', 'ben'):
+            user = User.objects.create_user(name, email=f'{name}@example.com', password='x')
+            Wishlist.objects.create(user=user, product=self.drill)
+        self.later = timezone.now() + timedelta(hours=1)
+
+    def update(self, **values):
+        product = Product.objects.get(pk=self.drill.pk)
+        for field, value in values.items():
+            setattr(product, field, value)
+        product.save()
+
+    def dispatch(self, now=None):
+        from .alerts import dispatch_alerts
+        return dispatch_alerts(now=now or self.later)
+
+    def test_price_drops_are_coalesced(self):
+        from django.core import mail
+        from apps.communication.models import Notification
+        self.update(price=90)
+        self.update(price=80)
+        self.update(name='Cordless drill')
+
+        # Still inside the coalescing window
+        self.assertEqual(self.dispatch(timezone.now())['alerts'], 0)
+        self.assertEqual(self.dispatch(), {'alerts': 1, 'notifications': 2, 'emails': 2})
+        messages = set(Notification.objects.filter(type='price_drop').values_list('message', flat=True))
+        self.assertEqual(messages, {'Cordless drill on your wishlist is now KES 80.00 (was KES 100.00).'})
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['ann@example.com', 'ben@example.com'])
+        self.assertEqual(self.dispatch()['alerts'], 0)
+
+    def test_price_back_up_sends_nothing(self):
+        from apps.communication.models import Notification
+        self.update(price=90)
+        self.update(price=120)
+        self.assertEqual(self.dispatch()['notifications'], 0)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_back_in_stock(self):
+        from apps.communication.models import Notification
+        self.update(stock_quantity=5)
+        self.dispatch()
+        self.assertEqual(Notification.objects.filter(type='back_in_stock').count(), 2)
+
+    def test_campaign_start_is_a_sale_alert(self):
+        from apps.communication.models import Notification
+        start = timezone.now() + timedelta(minutes=5)
+        campaign = Campaign.objects.create(
+            title='Tool week', slug='tool-week', discount_percentage=25, product_selection_type='manual',
+            start_time=start, end_time=start + timedelta(days=2),
+        )
+        campaign.products.add(self.drill)
+        refresh_stale_prices(now=start + timedelta(seconds=1))
+
+        self.dispatch(start + timedelta(hours=1))
+        self.assertEqual(
+            set(Notification.objects.values_list('type', 'message')),
+            {('wishlist_sale', 'Drill on your wishlist is 25% off: KES 75.00.')},
+        )
+
+class InventoryLedgerTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('buyer', password='x')
+        self.admin = get_user_model().objects.create_superuser('boss', email='boss@example.com', password='x')
+        self.category = Category.objects.create(name='Paint', slug='paint')
+        self.product = Product.objects.create(
+            name='Paint', slug='paint', category=self.category, price=10, stock_quantity=10,
+        )
+        self.later = timezone.now() + timedelta(hours=1)
+
+    def checkout(self, quantity):
+        self.client.force_authenticate(self.user)
+        return self.client.post('/api/orders/', {
+            'items': [{'product_id': str(self.product.pk), 'quantity': quantity}],
+            'total_amount': 10, 'payment_method': 'pod', 'delivery_address': 'Here',
+        }, format='json')
+
+    def movements(self):
+        from .models import StockMovement
+        return list(StockMovement.objects.order_by('id').values_list('kind', 'quantity'))
+
+    def test_every_stock_change_is_in_the_ledger(self):
+        from apps.orders.models import Order
+        from .inventory import compact_ledger, ledger_balances, reconcile
+        product = Product.objects.get(pk=self.product.pk)
+        product.stock_quantity = 12
+        product.save()
+        self.assertEqual(self.checkout(3).status_code, status.HTTP_201_CREATED)
+        order = Order.objects.get()
+        order.status = 'cancelled'
+        order.save()
+        self.client.force_authenticate(self.admin)
+        response = self.client.post(f'/api/products/{self.product.pk}/restock/', {'quantity': 5}, format='json')
+        self.assertEqual(response.data['stock_quantity'], 17)
+
+        self.assertEqual(self.movements(), [
+            ('restock', 10), ('adjustment', 2), ('sale', -3), ('cancel', 3), ('restock', 5),
+        ])
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 17)
+        self.assertEqual(reconcile(), [])
+
+        self.assertEqual(compact_ledger(now=self.later), 1)
+        self.assertEqual(self.product.stock_checkpoint.quantity, 17)
+        self.checkout(2)
+        self.assertEqual(ledger_balances([self.product.pk]), {self.product.pk: 15})
+        self.assertEqual(reconcile(), [])
+
+    def test_restocking_sold_out_product_queues_alert(self):
+        from .models import PendingAlert
+        self.assertEqual(self.checkout(10).status_code, status.HTTP_201_CREATED)
+        self.assertFalse(PendingAlert.objects.exists())
+        self.client.force_authenticate(self.admin)
+        self.client.post(f'/api/products/{self.product.pk}/restock/', {'quantity': 5}, format='json')
+        self.assertEqual(list(PendingAlert.objects.values_list('product_id', 'kind')), [(self.product.pk, 'back_in_stock')])
+
+        # Still in stock: nothing more to announce
+        PendingAlert.objects.all().delete()
+        self.client.post(f'/api/products/{self.product.pk}/restock/', {'quantity': 5}, format='json')
+        self.assertFalse(PendingAlert.objects.exists())
+
+    def test_reopened_order_is_restocked_once(self):
+        from apps.orders.models import Order
+        from .inventory import reconcile
+        self.assertEqual(self.checkout(2).status_code, status.HTTP_201_CREATED)
+        order = Order.objects.get()
+        for state in ('cancelled', 'processing', 'cancelled'):
+            order.status = state
+            order.save()
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 10)
+        self.assertEqual(self.movements(), [('restock', 10), ('sale', -2), ('cancel', 2)])
+        self.assertEqual(reconcile(), [])
+
+    def test_reconcile_finds_untracked_changes(self):
+        from .inventory import reconcile
+        Product.objects.filter(pk=self.product.pk).update(stock_quantity=4)
+        self.assertEqual(reconcile(fix=True), [(self.product.pk, 10, 4)])
+        self.assertEqual(reconcile(), [])
+
+    def test_hot_product_sells_from_shards(self):
+        from .inventory import compact_ledger, reconcile, set_shards
+        from .models import StockShard
+        set_shards(self.product, 4)
+        shards = lambda: sorted(StockShard.objects.filter(product=self.product).values_list('quantity', flat=True))
+        self.assertEqual(shards(), [2, 2, 3, 3])
+
+        self.assertEqual(self.checkout(2).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(sum(shards()), 8)
+        self.assertEqual(self.checkout(9).status_code, status.HTTP_400_BAD_REQUEST)
+        # No single shard holds 8: taken across all of them
+        self.assertEqual(self.checkout(8).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(shards(), [0, 0, 0, 0])
+        self.assertEqual(reconcile(), [])
+
+        compact_ledger(now=self.later)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 0)
+
+        # An admin edit of a hot product's stock refills its shards
+        product = Product.objects.get(pk=self.product.pk)
+        product.stock_quantity = 6
+        product.save()
+        self.assertEqual(sum(shards()), 6)
+        self.assertEqual(reconcile(), [])
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ProductViewSet, CategoryViewSet, WishlistViewSet, ReviewViewSet
+from .views import ProductViewSet, CategoryViewSet, WishlistViewSet, ReviewViewSet, ChangesView
 
 router = DefaultRouter()
 router.register(r'categories', CategoryViewSet)
@@ -9,5 +9,6 @@ router.register(r'reviews', ReviewViewSet)
 router.register(r'', ProductViewSet) # This will be api/products/
 
 urlpatterns = [
+    path('changes/', ChangesView.as_view(), name='catalog-changes'),
     path('', include(router.urls)),
 ]
@@ -1,12 +1,39 @@
-from rest_framework import viewsets, permissions, filters
+from rest_framework import viewsets, permissions, status
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
+from rest_framework.response import Response
+import uuid
+from django.db.models import Count, Q
+from django.shortcuts import get_object_or_404
+from django_filters.utils import translate_validation
 from django_filters.rest_framework import DjangoFilterBackend
 from .models import Product, Category, Wishlist
-from .serializers import ProductSerializer, CategorySerializer, WishlistSerializer
+from .serializers import (
+    ProductSerializer, ProductListSerializer, CategorySerializer,
+    WishlistSerializer, WishlistDetailSerializer, WishlistSyncSerializer,
+)
+from .projection import ProjectionViewMixin, parse_csv_param
+from .filters import ProductFilter, AliasedOrderingFilter
+from .pricing import refresh_prices_for_request
+from .search import ProductSearchFilter
+from .facets import compute_facets
+from castle_core.pagination import KeysetPagination
+from castle_core.response_cache import CachedResponseMixin, get_or_build, iter_rows
+from castle_core.conditional import ConditionalGetMixin
 
-class CategoryViewSet(viewsets.ModelViewSet):
-    queryset = Category.objects.all()
+class CategoryViewSet(CachedResponseMixin, ConditionalGetMixin, viewsets.ModelViewSet):
+    queryset = Category.objects.annotate(
+        product_count=Count('products', filter=Q(products__is_active=True))
+    )
     serializer_class = CategorySerializer
     lookup_field = 'slug'
+    cache_collection_tag = 'categories'
+    cache_entity_prefix = 'category'
+    # product_count moves with product saves
+    validator_relations = ('products',)
+
+    def get_cache_tags(self, data):
+        return super().get_cache_tags(data) | {'products'}
     
 
 
@@ -15,66 +42,334 @@ class CategoryViewSet(viewsets.ModelViewSet):
             return [permissions.AllowAny()]
         return [permissions.IsAdminUser()]
 
-class ProductViewSet(viewsets.ModelViewSet):
+# Query parameters that change the facet counts (the list's filters and search)
+FACET_PARAMS = set(ProductFilter.base_filters) | {'search'}
+
+RELATED_LIMIT = 8
+MAX_RELATED_LIMIT = 24
+DEALS_LIMIT = 12
+MAX_DEALS_LIMIT = 48
+# Identifiers accepted by one batch lookup (ids, slugs and SKUs together)
+BATCH_LIMIT = 100
+
+# Relations nested in the full product representation
+PRODUCT_DETAIL_RELATIONS = ('category', 'images', 'reviews')
+
+class ProductViewSet(CachedResponseMixin, ConditionalGetMixin, ProjectionViewMixin, viewsets.ModelViewSet):
     queryset = Product.objects.filter(is_active=True)
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    filterset_fields = {
-        'category__slug': ['exact'],
-        'allow_pod': ['exact'],
-        'price': ['gte', 'lte'],
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, AliasedOrderingFilter]
+    filterset_class = ProductFilter
+    pagination_class = KeysetPagination
+    # Cursor key when no ?ordering= is given; ?ordering=price pages on (effective_price, id)
+    keyset_ordering = ('-created_at', '-id')
+    ordering_fields = ['price', 'created_at', 'rating', 'review_count', 'discount']
+    ordering_aliases = {
+        'price': 'effective_price', 'rating': 'rating_average', 'review_count': 'rating_count',
+        'discount': 'discount_percent',
     }
-    search_fields = ['name', 'description']
-    ordering_fields = ['price', 'created_at']
+    cache_collection_tag = 'products'
+    cache_entity_prefix = 'product'
+    # Review and image changes touch Product.updated_at; the nested category has its own
+    validator_relations = ('category',)
+    select_related_for = {'category': ['category']}
+    prefetch_related_for = {'images': ['images'], 'reviews': ['reviews__user']}
 
     def get_permissions(self):
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'facets', 'related', 'deals', 'batch']:
+            return [permissions.AllowAny()]
+        if self.action == 'snapshot' and self.request.method == 'GET':
             return [permissions.AllowAny()]
         return [permissions.IsAdminUser()]
 
     def get_queryset(self):
-        queryset = Product.objects.filter(is_active=True)
-        
-        # Filter by on_sale status
-        on_sale = self.request.query_params.get('on_sale', None)
-        if on_sale == 'true':
-            queryset = queryset.filter(discount_price__isnull=False)
-            
+        # Apply campaign windows that opened or closed since prices were stored (once per request)
+        refresh_prices_for_request(self.request)
+
         if self.request.user.is_staff:
-            return Product.objects.all()
-            
-        return queryset
+            queryset = Product.objects.all()
+        else:
+            queryset = Product.objects.filter(is_active=True)
+
+        # Only load the relations this response will actually render
+        default = () if self.action in ('list', 'facets', 'related', 'deals', 'batch') else PRODUCT_DETAIL_RELATIONS
+        return self.with_relations(queryset, self.get_serialized_relations(default))
+
+    def get_serializer_class(self):
+        if self.action in ('list', 'batch'):
+            return ProductListSerializer
+        return ProductSerializer
+
+    def get_lookup_filter(self):
+        # Detail URLs take the product id or its slug
+        value = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        try:
+            return {'pk': uuid.UUID(str(value))}
+        except ValueError:
+            return {'slug': value}
+
+    def get_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        product = get_object_or_404(queryset, **self.get_lookup_filter())
+        self.check_object_permissions(self.request, product)
+        return product
+
+    def get_cache_tags(self, data):
+        tags = super().get_cache_tags(data)
+        for row in iter_rows(data):
+            # Compact rows carry category_id, full ones the nested category
+            category = row.get('category')
+            category_id = category.get('id') if isinstance(category, dict) else row.get('category_id')
+            if category_id:
+                tags.add(f'category:{category_id}')
+        ordering = self.request.query_params.get('ordering', '')
+        if 'rating' in ordering or 'review_count' in ordering:
+            # Reviews reorder rating-sorted lists without touching their rows
+            tags.add('reviews')
+        return tags
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """Sidebar counts for the current list filters (same parameters as the list)."""
+        params = request.query_params.copy()
+        category_slug = params.pop('category__slug', [None])[-1] or None
+
+        signature = sorted(
+            (key, value) for key, values in params.lists() for value in values
+            if key in FACET_PARAMS and value != ''
+        )
+        cache_key = repr(('facets', signature, category_slug, request.user.is_staff))
+
+        def build():
+            filterset = self.filterset_class(params, queryset=self.get_queryset(), request=request)
+            if not filterset.is_valid():
+                raise translate_validation(filterset.errors)
+            queryset = ProductSearchFilter().filter_queryset(request, filterset.qs, self)
+            return compute_facets(queryset, category_slug)
+
+        return Response(get_or_build(cache_key, ('products', 'categories'), build))
+
+    @action(detail=False, methods=['get'])
+    def deals(self, request):
+        """
+        Top deals: the deepest discounts first, static or campaign, read off
+        the (discount_percent, id) index. ?category__slug= narrows it down.
+        """
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', DEALS_LIMIT)), MAX_DEALS_LIMIT))
+        except ValueError:
+            limit = DEALS_LIMIT
+        category_slug = request.query_params.get('category__slug') or None
+        cache_key = repr(('deals', limit, category_slug, request.user.is_staff))
+
+        def build():
+            queryset = self.get_queryset().filter(discount_percent__gt=0)
+            if category_slug:
+                queryset = queryset.filter(category__slug=category_slug)
+            products = queryset.order_by('-discount_percent', '-id')[:limit]
+            return ProductListSerializer(products, many=True, context=self.get_serializer_context()).data
+
+        # Entries expire at the next campaign start/end; price recomputes drop them too
+        return Response(get_or_build(cache_key, ('products',), build))
+
+    @action(detail=False, methods=['get'])
+    def batch(self, request):
+        """
+        Compact cards for many products in one query, for cart and wishlist
+        hydration: ?ids=, ?slugs= and/or ?skus= (comma separated, up to
+        BATCH_LIMIT in total). Results follow the requested order; unknown or
+        inactive identifiers are listed under `missing`.
+        """
+        requested = {name: parse_csv_param(request, name) or [] for name in ('ids', 'slugs', 'skus')}
+        total = sum(len(values) for values in requested.values())
+        if not total:
+            return Response({'error': 'ids, slugs or skus is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if total > BATCH_LIMIT:
+            return Response(
+                {'error': f'At most {BATCH_LIMIT} products can be looked up at once'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        ids = {}
+        for value in requested['ids']:
+            try:
+                ids[value] = uuid.UUID(value)
+            except ValueError:
+                pass
+        products = list(self.get_queryset().filter(
+            Q(pk__in=ids.values()) | Q(slug__in=requested['slugs']) | Q(sku__in=requested['skus'])
+        ))
+        by_key = {
+            'ids': {product.pk: product for product in products},
+            'slugs': {product.slug: product for product in products},
+            'skus': {product.sku: product for product in products if product.sku},
+        }
+
+        ordered, seen, missing = [], set(), {name: [] for name in requested}
+        for name, values in requested.items():
+            for value in values:
+                product = by_key[name].get(ids.get(value) if name == 'ids' else value)
+                if product is None:
+                    missing[name].append(value)
+                elif product.pk not in seen:
+                    seen.add(product.pk)
+                    ordered.append(product)
+
+        serializer = self.get_serializer(ordered, many=True)
+        return Response({'results': serializer.data, 'missing': missing})
+
+    @action(detail=True, methods=['get'])
+    def related(self, request, pk=None):
+        """
+        "Frequently bought together": the products most often ordered with
+        this one, topped up from the same category when there are too few.
+        """
+        product = self.get_object()
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', RELATED_LIMIT)), MAX_RELATED_LIMIT))
+        except ValueError:
+            limit = RELATED_LIMIT
+        cache_key = repr(('related', str(product.pk), limit, request.user.is_staff))
+
+        def build():
+            from .copurchase import related_product_ids
+
+            # Over-fetch a little: some of the related products may be inactive
+            ids = related_product_ids(product.pk, limit * 2)
+            queryset = self.get_queryset()
+            by_id = queryset.in_bulk(ids)
+            products = [by_id[pk] for pk in ids if pk in by_id][:limit]
+            if len(products) < limit:
+                exclude = [product.pk] + [item.pk for item in products]
+                products += list(
+                    queryset.filter(category_id=product.category_id).exclude(pk__in=exclude)
+                    .order_by('-rating_count', '-created_at')[:limit - len(products)]
+                )
+            return ProductListSerializer(products, many=True, context=self.get_serializer_context()).data
+
+        return Response(get_or_build(cache_key, ('products', f'copurchase:{product.pk}'), build))
+
+    @action(detail=True, methods=['post'])
+    def restock(self, request, pk=None):
+        """Admin: adds {"quantity": n, "note": ""} to stock, recorded in the inventory ledger."""
+        from .inventory import RESTOCK, add_stock, on_hand
+
+        product = self.get_object()
+        try:
+            quantity = int(request.data.get('quantity'))
+        except (TypeError, ValueError):
+            quantity = 0
+        if quantity < 1:
+            return Response({'error': 'quantity must be a positive integer'}, status=status.HTTP_400_BAD_REQUEST)
+        add_stock({product.pk: quantity}, RESTOCK, note=str(request.data.get('note', ''))[:255])
+        return Response({'id': str(product.pk), 'stock_quantity': on_hand([product.pk])[product.pk]})
+
+    @action(detail=False, methods=['get', 'post'])
+    def snapshot(self, request):
+        """
+        GET: manifest of the latest whole-catalog snapshot (file URLs, hashes).
+        POST (admin): regenerate it in the background, incrementally unless ?full=true.
+        """
+        from django.utils.cache import get_conditional_response
+        from .snapshot import build_snapshot_in_background, load_manifest
+
+        if request.method == 'POST':
+            if not build_snapshot_in_background(full=request.query_params.get('full') == 'true'):
+                return Response({'error': 'A snapshot build is already running'}, status=status.HTTP_409_CONFLICT)
+            return Response({'status': 'building'}, status=status.HTTP_202_ACCEPTED)
+        manifest = load_manifest()
+        if manifest is None:
+            return Response({'error': 'No snapshot has been built yet'}, status=status.HTTP_404_NOT_FOUND)
+        etag = f'"{manifest["sha256"]}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = Response(manifest)
+        response['ETag'] = etag
+        return response
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def bulk_import(self, request):
+        """
+        Admin upload of a CSV/NDJSON catalog file (multipart field "file"),
+        upserted by slug. file_format=csv|ndjson (query or form field)
+        overrides the file extension; `format` is DRF's renderer override.
+        """
+        import io
+        from .importer import guess_format, import_catalog
+
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'file is required'}, status=status.HTTP_400_BAD_REQUEST)
+        format = request.query_params.get('file_format') or request.data.get('file_format') or guess_format(upload.name)
+        if format not in ('csv', 'ndjson'):
+            return Response({'error': 'file_format must be csv or ndjson'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Read from the upload in chunks rather than into memory
+        stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+        try:
+            result = import_catalog(stream, format)
+        except UnicodeDecodeError:
+            return Response({'error': 'File must be UTF-8 encoded'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result)
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
         
-        # For admin editing, allow bypassing campaign calculations to see raw DB values
+        # For admin editing, allow bypassing campaign pricing to see raw DB values
         if self.request.user.is_staff and self.request.query_params.get('raw') == 'true':
-            context['active_campaigns'] = []
-            return context
-
-        # Fetch active campaigns once per request to avoid N+1 in serializer
-        from apps.campaigns.models import Campaign
-        from django.utils import timezone
-        now = timezone.now()
-        active_campaigns = Campaign.objects.filter(
-            is_active=True, 
-            start_time__lte=now, 
-            end_time__gte=now
-        ).prefetch_related('products') # Prefetch related for faster checking
-        context['active_campaigns'] = active_campaigns
+            context['raw_pricing'] = True
         return context
 
-class WishlistViewSet(viewsets.ModelViewSet):
+class WishlistViewSet(ProjectionViewMixin, viewsets.ModelViewSet):
     serializer_class = WishlistSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Wishlist.objects.filter(user=self.request.user)
+        refresh_prices_for_request(self.request)
+        return Wishlist.objects.filter(user=self.request.user).select_related('product')
+
+    def get_serializer_class(self):
+        if self.action == 'retrieve':
+            return WishlistDetailSerializer
+        return WishlistSerializer
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    @action(detail=False, methods=['post'])
+    def sync(self, request):
+        """
+        Applies a whole wishlist at once (e.g. a guest's list on login): one
+        INSERT that skips items already saved and one DELETE. Unknown or
+        inactive products are ignored. Returns the resulting wishlist.
+        """
+        from django.db import transaction
+
+        payload = WishlistSyncSerializer(data=request.data)
+        payload.is_valid(raise_exception=True)
+        data = payload.validated_data
+        user = request.user
+        items = Wishlist.objects.filter(user=user)
+
+        with transaction.atomic():
+            if 'product_ids' in data:
+                wanted, unwanted = set(data['product_ids']), None
+            else:
+                wanted, unwanted = set(data.get('add', ())), set(data.get('remove', ())) - set(data.get('add', ()))
+
+            if wanted:
+                product_ids = Product.objects.filter(pk__in=wanted, is_active=True).values_list('pk', flat=True)
+                Wishlist.objects.bulk_create(
+                    [Wishlist(user=user, product_id=pk) for pk in product_ids], ignore_conflicts=True,
+                )
+            if unwanted is None:
+                items.exclude(product_id__in=wanted).delete()
+            elif unwanted:
+                items.filter(product_id__in=unwanted).delete()
+
+        serializer = self.get_serializer(self.get_queryset().order_by('-added_at'), many=True)
+        return Response(serializer.data)
+
 from .models import Review
 from .serializers import ReviewSerializer
 
@@ -82,6 +377,8 @@ class ReviewViewSet(viewsets.ModelViewSet):
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
         # Filter reviews by product if product_id is provided in query params
@@ -95,3 +392,27 @@ class ReviewViewSet(viewsets.ModelViewSet):
         # but the serializer logic handles the complex validation.
         # We just need to ensure the user is passed in context, which it is by default.
         serializer.save(user=self.request.user)
+
+from rest_framework.views import APIView
+
+class ChangesView(APIView):
+    """
+    GET /api/products/changes/?since=<token>&limit=
+    Catalog upserts and deletes since `since` (all rows without it), in change
+    order. Keep calling with `next` while `has_more`; on `reset` start over
+    without a token.
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        from .changes import DEFAULT_LIMIT, MAX_LIMIT, InvalidToken, changes_since
+
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', DEFAULT_LIMIT)), MAX_LIMIT))
+        except ValueError:
+            limit = DEFAULT_LIMIT
+        refresh_prices_for_request(request)
+        try:
+            return Response(changes_since(request.query_params.get('since') or None, limit=limit))
+        except InvalidToken as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
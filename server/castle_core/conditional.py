@@ -0,0 +1,109 @@
+"""
+Conditional GET (ETag / Last-Modified) for read endpoints.
+
+Validators come from one aggregate over the rows a response would contain:
+Max(updated_at) and Count, plus the same for nested relations listed in
+`validator_relations`. A matching If-None-Match / If-Modified-Since is
+answered with 304 before anything is serialized.
+"""
+import hashlib
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from castle_core.response_cache import shared_max_age
+
+
+def make_etag(*parts):
+    return '"%s"' % hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def apply_validators(response, etag, last_modified):
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    ViewSet mixin adding ETag / Last-Modified / Cache-Control to `list` and
+    `retrieve`, and answering conditional requests with 304.
+
+    `validator_relations` names relations nested in the representation whose
+    own updated_at / row count must change the validators too.
+    """
+    validator_relations = ()
+    conditional_actions = ('list', 'retrieve')
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def get_validator_queryset(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.action == 'retrieve':
+            queryset = queryset.filter(**self.get_lookup_filter())
+        return queryset.order_by()
+
+    def get_lookup_filter(self):
+        """Filter kwargs selecting the row of a detail URL; views with extra lookups override it."""
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        return {self.lookup_field: self.kwargs[lookup_url_kwarg]}
+
+    def get_validators(self, request):
+        """Returns (etag, last_modified); (None, None) when the response will be a 404."""
+        aggregates = {'modified': Max('updated_at'), 'count': Count('pk', distinct=True)}
+        for relation in self.validator_relations:
+            aggregates[f'{relation}_modified'] = Max(f'{relation}__updated_at')
+            aggregates[f'{relation}_count'] = Count(relation, distinct=True)
+        values = self.get_validator_queryset().aggregate(**aggregates)
+
+        if self.action == 'retrieve' and not values['count']:
+            return None, None
+
+        modified = [value for key, value in values.items() if key.endswith('_modified') or key == 'modified']
+        modified = [value for value in modified if value is not None]
+        last_modified = max(modified) if modified else None
+
+        # The same rows render differently per query string, media type and staff view
+        query = sorted((key, value) for key, values in request.query_params.lists() for value in values)
+        etag = make_etag(
+            sorted((key, str(value)) for key, value in values.items()),
+            request.path, query, request.accepted_media_type,
+            bool(request.user and request.user.is_staff),
+        )
+        return etag, last_modified
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        self._validators = None
+        if self.action not in self.conditional_actions or request.method not in ('GET', 'HEAD'):
+            return handler(request, *args, **kwargs)
+
+        etag, last_modified = self.get_validators(request)
+        if etag:
+            self._validators = (etag, last_modified)
+            not_modified = get_conditional_response(
+                request, etag=etag,
+                last_modified=int(last_modified.timestamp()) if last_modified else None,
+            )
+            if not_modified is not None:
+                return not_modified
+        return handler(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        validators = getattr(self, '_validators', None)
+        if validators is None or response.status_code not in (200, 304):
+            return response
+
+        apply_validators(response, *validators)
+        if request.user and request.user.is_authenticated:
+            patch_cache_control(response, private=True, no_cache=True)
+        else:
+            # Browsers revalidate every time (cheap with the ETag); edge caches may hold it briefly
+            patch_cache_control(response, public=True, max_age=0, must_revalidate=True, s_maxage=shared_max_age())
+        return response
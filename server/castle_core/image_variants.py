@@ -0,0 +1,295 @@
+"""
+Resized image variants (srcset) for product and banner images.
+
+Each original is decoded once with Pillow and written out at fixed widths in
+every configured format, under a content-hashed path in default_storage:
+
+    variants/ab/ab12…/320.webp
+
+Saves and imports only queue an image (a pending manifest, see
+`queue_variants`). The build_image_variants command builds them in a worker
+process, resizing in a process pool (it is CPU-bound and holds the GIL), so
+Pillow never runs in request workers. In production it runs with --queued
+--interval next to gunicorn (render.yaml), since media is on the web
+instance's disk. The result is a manifest stored on the
+row next to the original:
+
+    {'source': <original>, 'hash': 'ab12…', 'width': 1600, 'height': 1200,
+     'formats': {'webp': [{'width': 320, 'height': 240, 'url': ...}, ...], ...}}
+
+A manifest whose `source` no longer matches the row's image is stale and is
+ignored by `srcsets()` until it is rebuilt.
+"""
+import hashlib
+import io
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from django.apps import apps
+from django.conf import settings
+from django.dispatch import Signal
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WIDTHS = (160, 320, 640, 1024, 1600)
+DEFAULT_FORMATS = ('avif', 'webp', 'jpeg')
+MAX_SOURCE_BYTES = 25 * 1024 * 1024
+EXTENSIONS = {'avif': 'avif', 'webp': 'webp', 'jpeg': 'jpg'}
+SAVE_OPTIONS = {
+    'avif': {'quality': 55},
+    'webp': {'quality': 80, 'method': 4},
+    'jpeg': {'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+# name -> (model label, image field, manifest field)
+TARGETS = {
+    'product': ('products.Product', 'image_main', 'image_main_variants'),
+    'product_image': ('products.ProductImage', 'image', 'variants'),
+    'banner': ('campaigns.CampaignBanner', 'image', 'image_variants'),
+}
+
+# Sent with the model class and the pks whose manifests were just written
+# (with UPDATE, so no post_save); apps drop cached responses from it
+variants_updated = Signal()
+
+
+def variant_widths():
+    return tuple(sorted(getattr(settings, 'IMAGE_VARIANT_WIDTHS', DEFAULT_WIDTHS)))
+
+
+def variant_formats():
+    """Configured formats this Pillow build can encode (AVIF needs Pillow 11.2+ or a plugin)."""
+    from PIL import Image
+
+    Image.init()
+    wanted = getattr(settings, 'IMAGE_VARIANT_FORMATS', DEFAULT_FORMATS)
+    return tuple(format for format in wanted if format.upper() in Image.SAVE)
+
+
+def source_of(instance, field):
+    """The image's storage name or URL as a string ('' when there is none)."""
+    value = getattr(instance, field)
+    return (getattr(value, 'name', value) or '').strip()
+
+
+def read_source(source):
+    """Bytes of an original: a default_storage name, a MEDIA_URL path or a remote URL."""
+    from django.core.files.storage import default_storage
+
+    if source.startswith(('http://', 'https://')):
+        import requests
+
+        with requests.get(source, timeout=15, stream=True) as response:
+            response.raise_for_status()
+            data = io.BytesIO()
+            for chunk in response.iter_content(64 * 1024):
+                data.write(chunk)
+                if data.tell() > MAX_SOURCE_BYTES:
+                    raise ValueError('Image is too large')
+            return data.getvalue()
+
+    name = source[len(settings.MEDIA_URL):] if source.startswith(settings.MEDIA_URL) else source
+    with default_storage.open(name.lstrip('/'), 'rb') as file:
+        return file.read(MAX_SOURCE_BYTES + 1)
+
+
+def _encode(image, format):
+    if format == 'jpeg' and image.mode != 'RGB':
+        from PIL import Image
+
+        # JPEG has no alpha: flatten onto white
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+        image = background
+    buffer = io.BytesIO()
+    image.save(buffer, format=format.upper(), **SAVE_OPTIONS.get(format, {}))
+    return buffer.getvalue()
+
+
+def render_variants(source, widths, formats):
+    """
+    Builds every variant of one original and returns its manifest. Runs in a
+    pool worker: it touches storage but never the database.
+    """
+    from PIL import Image, ImageOps
+    from django.core.files.base import ContentFile
+    from django.core.files.storage import default_storage
+
+    data = read_source(source)
+    if len(data) > MAX_SOURCE_BYTES:
+        raise ValueError('Image is too large')
+    digest = hashlib.sha256(data).hexdigest()[:32]
+
+    with Image.open(io.BytesIO(data)) as original:
+        original = ImageOps.exif_transpose(original)
+        if original.mode not in ('RGB', 'RGBA'):
+            original = original.convert('RGBA' if 'transparency' in original.info or 'A' in original.getbands() else 'RGB')
+        width, height = original.size
+
+        # Never upscale; an image narrower than every width gets one variant at its own size
+        targets = [w for w in widths if w < width] or [width]
+        manifest = {'source': source, 'hash': digest, 'width': width, 'height': height, 'formats': {}}
+        for target in targets:
+            resized = original if target == width else original.resize(
+                (target, max(1, round(height * target / width))), Image.LANCZOS
+            )
+            for format in formats:
+                name = f'variants/{digest[:2]}/{digest}/{target}.{EXTENSIONS[format]}'
+                # Content-addressed: an existing file is already the right bytes
+                if not default_storage.exists(name):
+                    default_storage.save(name, ContentFile(_encode(resized, format)))
+                manifest['formats'].setdefault(format, []).append(
+                    {'width': target, 'height': resized.height, 'url': default_storage.url(name)}
+                )
+    return manifest
+
+
+def _render_or_error(source, widths, formats):
+    try:
+        return render_variants(source, widths, formats)
+    except Exception as exc:
+        # Recorded so the same broken image is not retried on every save
+        return {'source': source, 'error': f'{type(exc).__name__}: {exc}'[:500], 'formats': {}}
+
+
+def store_manifests(target, manifests):
+    """
+    Writes {pk: manifest} onto the rows, skipping rows whose image changed
+    while the variants were being built. Returns the pks written.
+    """
+    label, image_field, manifest_field = TARGETS[target]
+    model = apps.get_model(label)
+    written = []
+    for pk, manifest in manifests.items():
+        rows = model.objects.filter(pk=pk, **{image_field: manifest['source']})
+        if rows.update(**{manifest_field: manifest}):
+            written.append(pk)
+    if written:
+        variants_updated.send(sender=model, pks=written)
+    return written
+
+
+def _pool(workers):
+    import django
+
+    # django.setup in each worker so storage works under the spawn start method too
+    return ProcessPoolExecutor(max_workers=workers, initializer=django.setup)
+
+
+def build_variants(jobs, workers=None, on_result=None):
+    """
+    Renders [(target, pk, source), ...] in a process pool and stores each
+    manifest as soon as it is ready. Returns (built, failed).
+    """
+    widths, formats = variant_widths(), variant_formats()
+    workers = workers or getattr(settings, 'IMAGE_VARIANT_WORKERS', None) or os.cpu_count() or 1
+    built = failed = 0
+
+    def finish(target, pk, manifest):
+        nonlocal built, failed
+        store_manifests(target, {pk: manifest})
+        if manifest.get('error'):
+            failed += 1
+            logger.warning('Image variants failed for %s %s: %s', target, pk, manifest['error'])
+        else:
+            built += 1
+        if on_result:
+            on_result(target, pk, manifest)
+
+    if workers == 1:
+        for target, pk, source in jobs:
+            finish(target, pk, _render_or_error(source, widths, formats))
+        return built, failed
+
+    with _pool(workers) as pool:
+        # Bounded in-flight work so a large backfill is not queued (and held) all at once
+        limit = workers * 4
+        futures = {}
+        for target, pk, source in jobs:
+            futures[pool.submit(_render_or_error, source, widths, formats)] = (target, pk)
+            if len(futures) >= limit:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(*futures.pop(future), future.result())
+        for future in as_completed(futures):
+            finish(*futures[future], future.result())
+    return built, failed
+
+
+def pending_manifest(source):
+    """The manifest marking `source` as queued for a build; srcsets() ignores it."""
+    return {'source': source, 'pending': True, 'formats': {}}
+
+
+def pending_jobs(target, force=False, queued=False, chunk_size=1000):
+    """
+    Yields (target, pk, source) for rows whose manifest is missing, stale or
+    queued. With `queued`, only rows queued by saves and imports are read.
+    """
+    label, image_field, manifest_field = TARGETS[target]
+    model = apps.get_model(label)
+    rows = model.objects.only('pk', image_field, manifest_field)
+    if queued:
+        rows = rows.filter(**{f'{manifest_field}__pending': True})
+    for row in rows.order_by('pk').iterator(chunk_size=chunk_size):
+        source = source_of(row, image_field)
+        manifest = getattr(row, manifest_field) or {}
+        if source and (force or manifest.get('pending') or manifest.get('source') != source):
+            yield target, row.pk, source
+
+
+def queue_variants(target, pks_and_sources):
+    """
+    Marks freshly saved images as queued for the build_image_variants
+    command, in the caller's transaction. Pillow never runs in the request.
+    Only with IMAGE_VARIANTS_ON_SAVE (local development) are they also built
+    after commit, one at a time on a background thread.
+    """
+    from django.db import transaction
+    from django.db.models import Case, JSONField, Q, Value, When
+
+    jobs = [(target, pk, source) for pk, source in pks_and_sources if source]
+    if not jobs:
+        return
+    label, image_field, manifest_field = TARGETS[target]
+    model = apps.get_model(label)
+    # Only rows still showing the image: a newer save queues its own
+    match = Q()
+    for _, pk, source in jobs:
+        match |= Q(pk=pk, **{image_field: source})
+    model.objects.filter(match).update(**{manifest_field: Case(
+        *(When(pk=pk, then=Value(pending_manifest(source), output_field=JSONField())) for _, pk, source in jobs),
+        default=manifest_field,
+    )})
+
+    if getattr(settings, 'IMAGE_VARIANTS_ON_SAVE', False):
+        transaction.on_commit(lambda: _build_in_background(jobs))
+
+
+def _build_in_background(jobs):
+    import threading
+    from django.db import connection
+
+    def build():
+        try:
+            build_variants(jobs, workers=1)
+        except Exception:
+            logger.exception('Image variant build failed')
+        finally:
+            connection.close()
+
+    threading.Thread(target=build, daemon=True).start()
+
+
+def srcsets(manifest, source):
+    """
+    {'webp': 'url 320w, url 640w', ...} for a current manifest, or None when
+    there is none (yet) for `source`.
+    """
+    source = getattr(source, 'name', source) or ''
+    if not manifest or manifest.get('source') != source or not manifest.get('formats'):
+        return None
+    return {
+        format: ', '.join(f"{variant['url']} {variant['width']}w" for variant in variants)
+        for format, variants in manifest['formats'].items()
+    }
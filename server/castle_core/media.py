@@ -0,0 +1,173 @@
+"""
+Media (MEDIA_ROOT) serving without tying up workers on byte copying.
+
+URLs from `HashedMediaStorage` carry the file's content hash (?v=...).
+Requests whose ?v= matches the file on disk are cacheable for a year
+(immutable). Any other request gets a short max-age. Every response has
+an ETag and Last-Modified, and conditional requests are answered with
+304. Range requests get a single-range 206 (or a 416).
+
+The bytes themselves are handed off where possible:
+
+- MEDIA_SENDFILE = 'nginx': an empty response with X-Accel-Redirect to
+  MEDIA_ACCEL_PREFIX + path. nginx serves the file, including ranges.
+- MEDIA_SENDFILE = 'sendfile': X-Sendfile with the absolute path (Apache
+  mod_xsendfile, lighttpd).
+- Otherwise FileResponse, which gunicorn sends through wsgi.file_wrapper
+  (sendfile(2)). Ranges are streamed from the file offset.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def content_hash(path, stat=None):
+    """Short content hash of a file, memoized per (path, size, mtime)."""
+    stat = stat or os.stat(path)
+    key = 'media:hash:' + hashlib.sha1(f'{path}|{stat.st_size}|{stat.st_mtime_ns}'.encode()).hexdigest()
+    digest = cache.get(key)
+    if digest is None:
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+                hasher.update(chunk)
+        digest = hasher.hexdigest()[:16]
+        cache.set(key, digest, timeout=None)
+    return digest
+
+
+class HashedMediaStorage(FileSystemStorage):
+    """FileSystemStorage whose URLs carry the content hash, so they can be cached as immutable."""
+
+    def url(self, name):
+        url = super().url(name)
+        try:
+            return f'{url}?v={content_hash(self.path(name))}'
+        except OSError:
+            return url
+
+
+def _validators(stat):
+    etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    return etag, int(stat.st_mtime)
+
+
+def parse_range(header, size):
+    """
+    (start, end) inclusive for a single satisfiable range, None to send the
+    whole file (no/unsupported/multi range header), or False for a 416.
+    """
+    match = RANGE_RE.match(header.replace(' ', '')) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # bytes=-N: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end
+
+
+def _if_range_matches(request, etag, last_modified):
+    value = request.META.get('HTTP_IF_RANGE')
+    if not value:
+        return True
+    if value.startswith('"') or value.startswith('W/'):
+        return value == etag
+    modified = parse_http_date_safe(value)
+    return modified is not None and modified >= last_modified
+
+
+def _iter_range(path, start, length):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except Exception:
+        raise Http404('Not found')
+    if not os.path.isfile(full_path):
+        raise Http404('Not found')
+
+    stat = os.stat(full_path)
+    etag, last_modified = _validators(stat)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+    mode = getattr(settings, 'MEDIA_SENDFILE', None)
+
+    if not_modified is not None:
+        response = not_modified
+    elif mode == 'nginx':
+        response = HttpResponse(content_type=content_type)
+        prefix = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + path.lstrip('/')
+    elif mode == 'sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+    else:
+        response = _file_response(request, full_path, stat, content_type, etag, last_modified)
+
+    if encoding and response.status_code != 304:
+        response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+
+    version = request.GET.get('v')
+    if version and version == content_hash(full_path, stat):
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=getattr(settings, 'MEDIA_CACHE_MAX_AGE', 3600))
+    return response
+
+
+def _file_response(request, full_path, stat, content_type, etag, last_modified):
+    size = stat.st_size
+    byte_range = None
+    if request.method in ('GET', 'HEAD') and _if_range_matches(request, etag, last_modified):
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416, content_type=content_type)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if byte_range is None:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+        response['Content-Length'] = size
+        return response
+
+    start, end = byte_range
+    length = end - start + 1
+    response = StreamingHttpResponse(_iter_range(full_path, start, length), status=206, content_type=content_type)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = length
+    return response
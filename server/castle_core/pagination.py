@@ -0,0 +1,215 @@
+"""
+Keyset (cursor) pagination for high-volume list endpoints.
+
+Pages are fetched with `WHERE (key) > (last seen key) ORDER BY key LIMIT n`
+on a composite key such as (created_at, id) or (effective_price, id), so
+page depth does not cost an OFFSET scan and no COUNT(*) is run unless the
+client asks for one with ?count=exact or ?count=estimate.
+
+Requests that send ?page= keep the PageNumberPagination behaviour so
+existing clients work unchanged while they migrate.
+"""
+import base64
+import json
+from collections import OrderedDict
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+def estimate_count(queryset):
+    """
+    Planner row estimate on PostgreSQL (no table scan); exact count elsewhere.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPagination(BasePagination):
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    # Used when the view does not define `keyset_ordering` and the queryset is unordered
+    default_ordering = ('-pk',)
+    legacy_pagination_class = PageNumberPagination
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.legacy = None
+
+        ordering = self.get_ordering(queryset, view)
+        if request.query_params.get('page') is not None or ordering is None:
+            # Legacy clients, and orderings that cannot be expressed as a key
+            # (e.g. search rank), use page numbers
+            self.legacy = self.legacy_pagination_class()
+            return self.legacy.paginate_queryset(queryset, request, view)
+
+        self.page_size = self.get_page_size(request)
+        self.ordering = ordering
+        self.count = self.get_count(queryset, request)
+
+        position, reverse = self.decode_cursor(request)
+        queryset = queryset.order_by(*self._order_by(reverse))
+        if position is not None:
+            queryset = queryset.filter(self._keyset_filter(position, reverse))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        if reverse:
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.first_key = self._row_key(rows[0]) if rows else None
+        self.last_key = self._row_key(rows[-1]) if rows else None
+        return rows
+
+    def get_paginated_response(self, data):
+        if self.legacy is not None:
+            return self.legacy.get_paginated_response(data)
+
+        payload = OrderedDict()
+        if self.count is not None:
+            payload['count'] = self.count
+        payload['next'] = self.get_next_link()
+        payload['previous'] = self.get_previous_link()
+        payload['results'] = data
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {'type': 'integer', 'description': 'Only present with ?count=exact|estimate'},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_count(self, queryset, request):
+        mode = request.query_params.get(self.count_query_param)
+        if mode == 'exact':
+            return queryset.count()
+        if mode == 'estimate':
+            return estimate_count(queryset)
+        return None
+
+    # Ordering
+
+    def get_ordering(self, queryset, view):
+        """
+        Returns [(field, descending), ...] ending in the primary key, or None
+        when the current ordering is not made of plain non-null columns.
+        """
+        terms = list(queryset.query.order_by)
+        if not terms and queryset.query.default_ordering:
+            terms = list(queryset.model._meta.ordering)
+        if not terms:
+            terms = list(getattr(view, 'keyset_ordering', self.default_ordering))
+
+        opts = queryset.model._meta
+        ordering = []
+        for term in terms:
+            if not isinstance(term, str):
+                return None
+            descending = term.startswith('-')
+            name = term.lstrip('-')
+            if name == 'pk':
+                name = opts.pk.name
+            try:
+                field = opts.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            if not field.concrete or field.null or field.many_to_many or field.one_to_many:
+                return None
+            ordering.append((field, descending))
+
+        if not any(field.primary_key for field, _ in ordering):
+            # The primary key makes the key unique, so rows with equal values are not skipped
+            ordering.append((opts.pk, ordering[-1][1] if ordering else True))
+        return ordering
+
+    def _order_by(self, reverse):
+        return [
+            f"{'-' if descending != reverse else ''}{field.attname}"
+            for field, descending in self.ordering
+        ]
+
+    def _keyset_filter(self, position, reverse):
+        # (a, b, c) after (x, y, z) == a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+        condition = Q()
+        for index, (field, descending) in enumerate(self.ordering):
+            lookup = 'lt' if descending != reverse else 'gt'
+            clause = Q(**{f'{field.attname}__{lookup}': position[index]})
+            for prior_index, (prior_field, _) in enumerate(self.ordering[:index]):
+                clause &= Q(**{prior_field.attname: position[prior_index]})
+            condition |= clause
+        return condition
+
+    def _row_key(self, row):
+        return [getattr(row, field.attname) for field, _ in self.ordering]
+
+    # Cursors
+
+    def encode_cursor(self, key, reverse):
+        values = [value.isoformat() if hasattr(value, 'isoformat') else str(value) for value in key]
+        payload = json.dumps({'k': values, 'r': int(reverse)}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            padded = encoded + '=' * (-len(encoded) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+            values = payload['k']
+            if len(values) != len(self.ordering):
+                raise ValueError('Cursor does not match the current ordering')
+            position = [field.to_python(value) for (field, _), value in zip(self.ordering, values)]
+            return position, bool(payload.get('r'))
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def _link(self, key, reverse):
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(key, reverse))
+
+    def get_next_link(self):
+        if not self.has_next or self.last_key is None:
+            return None
+        return self._link(self.last_key, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first_key is None:
+            return None
+        return self._link(self.first_key, reverse=True)
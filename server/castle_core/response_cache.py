@@ -0,0 +1,250 @@
+"""
+Server-side cache for anonymous catalog reads.
+
+Rendered JSON is stored under the normalized request URL and tagged with the
+entities it contains ("products", "product:<id>", "campaign:<id>", ...). Each
+tag has a version in the cache, the time it was last invalidated; an entry
+is only served while every tag still has the version it was stored with, so
+`invalidate()` only has to move the versions of the tags a save touches. A
+response whose tags moved while it was being built is not stored.
+
+Entries never outlive the next campaign start or end, because that moves
+prices without any model being saved.
+
+Tag versions must live in a cache shared by all workers (set REDIS_URL);
+with the per-process local-memory fallback other workers can serve a stale
+entry for up to RESPONSE_CACHE_TIMEOUT seconds.
+"""
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import parse_http_date_safe
+
+KEY_PREFIX = 'rc'
+# Response headers replayed on a hit; Cache-Control is recomputed
+STORED_HEADERS = ('ETag', 'Last-Modified', 'Surrogate-Key')
+BOUNDARY_KEY = f'{KEY_PREFIX}:campaign-boundary'
+NO_BOUNDARY = 0
+
+
+def _cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def _tag_key(tag):
+    return f'{KEY_PREFIX}:tag:{tag}'
+
+
+def _new_version():
+    return time.time_ns()
+
+
+def tag_versions(tags, fresh=None):
+    """
+    Current version of each tag; missing (never invalidated or evicted) tags
+    get `fresh`, by default now.
+    """
+    cache = _cache()
+    keys = {_tag_key(tag): tag for tag in tags}
+    found = cache.get_many(keys)
+    fresh = fresh or _new_version()
+    missing = {key: fresh for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        found.update(missing)
+    return {keys[key]: version for key, version in found.items()}
+
+
+def invalidate(*tags):
+    """Drops every cached response carrying any of `tags`."""
+    # The time rather than an increment: a response being built can tell it was invalidated after it started
+    version = _new_version()
+    _cache().set_many({_tag_key(tag): version for tag in tags}, timeout=None)
+
+
+def invalidate_products(product_ids):
+    invalidate('products', *(f'product:{pk}' for pk in product_ids))
+
+
+def next_campaign_boundary(now=None):
+    """
+    The next campaign start or end, or None. Memoized until that moment;
+    campaign saves call `forget_campaign_boundary()`.
+    """
+    from django.db.models import Min, Q
+    from apps.campaigns.models import Campaign
+
+    now = now or timezone.now()
+    cache = _cache()
+    cached = cache.get(BOUNDARY_KEY)
+    if cached == NO_BOUNDARY:
+        return None
+    if cached is not None and cached > now:
+        return cached
+
+    bounds = Campaign.objects.filter(is_active=True, end_time__gt=now).aggregate(
+        next_start=Min('start_time', filter=Q(start_time__gt=now)),
+        next_end=Min('end_time'),
+    )
+    upcoming = [value for value in bounds.values() if value is not None]
+    boundary = min(upcoming) if upcoming else None
+    if boundary is None:
+        cache.set(BOUNDARY_KEY, NO_BOUNDARY, timeout=None)
+    else:
+        cache.set(BOUNDARY_KEY, boundary, timeout=max(1, int((boundary - now).total_seconds())))
+    return boundary
+
+
+def forget_campaign_boundary():
+    _cache().delete(BOUNDARY_KEY)
+
+
+def seconds_until_boundary(default, now=None):
+    """`default` seconds, cut short by the next campaign start/end."""
+    now = now or timezone.now()
+    boundary = next_campaign_boundary(now)
+    if boundary is None:
+        return default
+    return min(default, max(1, int((boundary - now).total_seconds())))
+
+
+def shared_max_age():
+    """s-maxage for public catalog responses."""
+    return seconds_until_boundary(getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300))
+
+
+def get_or_build(key, tags, build):
+    """
+    Tag-versioned cache for computed values (not whole responses): returns
+    the value stored under `key` unless one of `tags` was invalidated since.
+    """
+    cache = _cache()
+    key = f'{KEY_PREFIX}:value:{hashlib.sha256(key.encode()).hexdigest()}'
+    entry = cache.get(key)
+    if entry is not None and tag_versions(entry['versions']) == entry['versions']:
+        return entry['value']
+
+    versions = tag_versions(tags)
+    value = build()
+    cache.set(key, {'value': value, 'versions': versions}, timeout=shared_max_age())
+    return value
+
+
+def iter_rows(data):
+    """Rows of a serialized object, list, or paginated {'results': [...]} payload."""
+    if isinstance(data, dict) and 'results' in data:
+        data = data['results']
+    if isinstance(data, dict):
+        data = [data]
+    return [row for row in data or () if isinstance(row, dict)]
+
+
+def collect_ids(data, key='id'):
+    return [row[key] for row in iter_rows(data) if row.get(key) is not None]
+
+
+class CachedResponseMixin:
+    """
+    ViewSet mixin caching anonymous JSON `list`/`retrieve` responses.
+
+    `cache_collection_tag` is attached to every entry (bumped when rows are
+    added or removed); `cache_entity_prefix` tags each serialized row by id.
+    Views override `get_cache_tags` to add tags for nested entities.
+    """
+    cache_collection_tag = None
+    cache_entity_prefix = None
+    cached_actions = ('list', 'retrieve')
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def should_cache(self, request):
+        if self.action not in self.cached_actions or request.method != 'GET':
+            return False
+        if request.user.is_authenticated or request.query_params.get('raw') == 'true':
+            return False
+        # The browsable API embeds per-request forms; only plain JSON is shared
+        return getattr(request, 'accepted_renderer', None) is not None and request.accepted_renderer.format == 'json'
+
+    def get_response_cache_key(self, request):
+        query = sorted((key, value) for key, values in request.query_params.lists() for value in values if value != '')
+        raw = '|'.join([request.get_host(), request.path, repr(query), request.accepted_media_type or ''])
+        return f'{KEY_PREFIX}:entry:{hashlib.sha256(raw.encode()).hexdigest()}'
+
+    def get_static_cache_tags(self):
+        """Tags known before the response is built."""
+        return {self.cache_collection_tag} if self.cache_collection_tag else set()
+
+    def get_cache_tags(self, data):
+        tags = set()
+        if self.cache_collection_tag:
+            tags.add(self.cache_collection_tag)
+        if self.cache_entity_prefix:
+            tags.update(f'{self.cache_entity_prefix}:{pk}' for pk in collect_ids(data))
+        return tags
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        self._response_cache_store = None
+        if not self.should_cache(request):
+            return handler(request, *args, **kwargs)
+
+        key = self.get_response_cache_key(request)
+        entry = _cache().get(key)
+        if entry is not None and tag_versions(entry['versions']) == entry['versions']:
+            return self.cached_hit(request, entry)
+
+        # Read before the build (as get_or_build does): an invalidation landing mid-build must win
+        before = tag_versions(self.get_static_cache_tags())
+        started = _new_version()
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            self._response_cache_store = (key, self.get_cache_tags(response.data), before, started)
+        return response
+
+    def cached_hit(self, request, entry):
+        headers = entry.get('headers', {})
+        last_modified = parse_http_date_safe(headers.get('Last-Modified', ''))
+        response = get_conditional_response(request, etag=headers.get('ETag'), last_modified=last_modified)
+        if response is None:
+            response = HttpResponse(entry['content'], content_type=entry['content_type'])
+        for name, value in headers.items():
+            response[name] = value
+        patch_cache_control(response, public=True, max_age=0, must_revalidate=True, s_maxage=shared_max_age())
+        response['X-Cache'] = 'HIT'
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        store = getattr(self, '_response_cache_store', None)
+        if store is None or response.status_code != 200:
+            return response
+
+        self._response_cache_store = None
+        key, tags, before, started = store
+        # Lets an edge cache purge by entity, e.g. "product:<id>" or "campaign:<id>"
+        response['Surrogate-Key'] = ' '.join(sorted(tags))
+        response['X-Cache'] = 'MISS'
+
+        # Tags first seen now count as unchanged since the build started
+        versions = tag_versions(tags, fresh=started)
+        if any(versions.get(tag) != version for tag, version in before.items()) or any(
+            version > started for version in versions.values()
+        ):
+            # Invalidated while this body was being built: it may already be stale
+            return response
+
+        response.render()
+        _cache().set(key, {
+            'content': response.content,
+            'content_type': response['Content-Type'],
+            'headers': {name: response[name] for name in STORED_HEADERS if response.has_header(name)},
+            'versions': versions,
+        }, timeout=shared_max_age())
+        return response
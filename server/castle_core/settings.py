@@ -42,6 +42,8 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    # Trigram lookups for product search (apps.products.search)
+    'django.contrib.postgres',
     
     # Third-party
     'rest_framework',
@@ -117,10 +119,56 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            # Transactions take the write lock when they begin and wait up to `timeout`
+            # seconds for it, so concurrent checkouts queue instead of failing as "locked"
+            'OPTIONS': {
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
         }
     }
 
 
+# Cache
+# Shared by all workers when REDIS_URL is set (needs the redis package);
+# per-process local memory otherwise.
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Anonymous catalog responses (castle_core.response_cache); also bounded by the next campaign start/end
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 300))
+
+# Delta sync (apps.products.changes): rows newer than the lag wait for the next
+# call; clients whose token predates the kept tombstones are told to resync
+CHANGES_LAG_SECONDS = 2
+CHANGES_TOMBSTONE_DAYS = 30
+
+# Wishlist alerts (apps.products.alerts): changes to a product within the window
+# are sent as one alert by the dispatch_alerts command; emails go out in batches
+ALERT_COALESCE_SECONDS = int(os.environ.get('ALERT_COALESCE_SECONDS', 600))
+ALERT_EMAIL_BATCH = 100
+
+# Inventory ledger (apps.products.inventory): compact_stock_ledger leaves movements
+# this recent for its next run, as a transaction still in flight may hold a lower id
+INVENTORY_COMPACT_LAG_SECONDS = 60
+
+# Flash-sale holds (apps.orders.holds): hold requests reserving stock at once per
+# product; the rest get 429 + Retry-After. Counted in the cache, so shared via Redis
+FLASH_SALE_ADMISSION_SLOTS = int(os.environ.get('FLASH_SALE_ADMISSION_SLOTS', 32))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -167,6 +215,26 @@ if not DEBUG:
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Media URLs carry a content hash so they can be cached as immutable (castle_core.media)
+STORAGES = {
+    'default': {'BACKEND': 'castle_core.media.HashedMediaStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+# 'nginx' (X-Accel-Redirect to MEDIA_ACCEL_PREFIX) or 'sendfile' (X-Sendfile) hands
+# the bytes to the front server; unset streams them from Django
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE') or None
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media/')
+MEDIA_CACHE_MAX_AGE = int(os.environ.get('MEDIA_CACHE_MAX_AGE', 3600))
+
+# Resized copies for srcset (castle_core.image_variants). Formats this Pillow
+# build cannot encode (AVIF before Pillow 11.2) are skipped.
+IMAGE_VARIANT_WIDTHS = (160, 320, 640, 1024, 1600)
+IMAGE_VARIANT_FORMATS = ('avif', 'webp', 'jpeg')
+IMAGE_VARIANT_WORKERS = int(os.environ.get('IMAGE_VARIANT_WORKERS', 0)) or None
+# Saves only queue their images for `build_image_variants --queued --interval N`;
+# True also builds them on a background thread of the saving process (local development)
+IMAGE_VARIANTS_ON_SAVE = os.environ.get('IMAGE_VARIANTS_ON_SAVE', 'False') == 'True'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -21,10 +21,10 @@ urlpatterns = [
     path('api/campaigns/', include('apps.campaigns.urls')),
 ]
 
-# Force serve media files in production (not recommended for high traffic, but fine for prototype)
-from django.views.static import serve
+# Media files: streamed/offloaded with range, validator and long-lived cache support
 from django.urls import re_path
+from castle_core.media import serve_media
 
 urlpatterns += [
-    re_path(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT}),
+    re_path(r'^media/(?P<path>.*)$', serve_media),
 ]